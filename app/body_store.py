@@ -0,0 +1,38 @@
+"""
+Corpos de e-mail endereçados pelo conteúdo (tabela email_bodies).
+
+received_emails e outgoing_emails guardam só o SHA-256 do corpo (body_hash); o texto
+fica uma única vez em email_bodies, comprimido com zlib. Newsletters, notificações e a
+mesma mensagem recebida por vários agentes ocupam uma linha só, e as tabelas de
+e-mails, sem o texto, ficam menores no disco e no cache do banco.
+
+Funções puras (sem banco): a gravação fica em models.insert_email_bodies.
+"""
+import hashlib
+import zlib
+
+COMPRESSION_LEVEL = 6  # zlib: 6 é o equilíbrio padrão entre taxa e CPU
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 (hex) do texto em UTF-8: a chave do corpo em email_bodies."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+def body_row(text: str) -> dict:
+    """Linha de email_bodies para o texto."""
+    raw = text.encode("utf-8")
+    return {"content_hash": hashlib.sha256(raw).hexdigest(), "data": zlib.compress(raw, COMPRESSION_LEVEL),
+            "size": len(raw)}
+
+
+# Corpo vazio (ex.: e-mail só com anexos): os resumos ignoram e-mails com este hash
+EMPTY_BODY_HASH = content_hash("")
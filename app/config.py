@@ -1,3 +1,7 @@
+from functools import lru_cache
+from typing import cast
+
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from urllib.parse import quote_plus
 
@@ -15,25 +19,192 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = "localhost"
     POSTGRES_PORT: int = 5130  # Porta customizada
 
+    # --- Pool de conexões do banco (vale para os engines síncrono e assíncrono) ---
+    DB_POOL_SIZE: int = 10  # Conexões mantidas abertas por engine
+    DB_MAX_OVERFLOW: int = 20  # Conexões extras abertas em picos de carga
+    DB_POOL_TIMEOUT: float = 30.0  # Segundos de espera por uma conexão livre
+    DB_POOL_RECYCLE: int = 1800  # Recria conexões mais antigas que isso (segundos)
+    DB_POOL_PRE_PING: bool = True  # Testa a conexão antes de entregá-la
+
+    # --- Instrumentação do banco por requisição ---
+    DEBUG: bool = False  # Devolve as métricas de banco de cada requisição em cabeçalhos X-DB-*
+    DB_INSTRUMENTATION_ENABLED: bool = True
+    DB_N_PLUS_ONE_THRESHOLD: int = 10  # Repetições do mesmo comando que disparam o aviso de N+1
+
+    # --- Logs e métricas (GET /metrics, formato do Prometheus) ---
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # "json" (uma linha JSON por registro) ou "text"
+    METRICS_ENABLED: bool = True  # Expõe GET /metrics
+
     # --- Variável de Segurança ---
     ENCRYPTION_KEY: str
 
+    # --- Hashing de senhas (Argon2) ---
+    # Alterar os custos é seguro: hashes antigos continuam válidos e são refeitos no próximo login.
+    ARGON2_TIME_COST: int = 3  # Iterações
+    ARGON2_MEMORY_COST: int = 65536  # KiB por hash
+    ARGON2_PARALLELISM: int = 4
+    ARGON2_HASH_LEN: int = 32
+    ARGON2_SALT_LEN: int = 16
+    PASSWORD_HASH_WORKERS: int = 0  # Processos do pool de hashing (0 = um por núcleo)
+    PASSWORD_HASH_MAX_PENDING: int = 64  # Operações em execução ou na fila antes de responder 503
+
     # --- Configurações da API do Gmail ---
     GMAIL_CREDENTIALS_PATH: str = "credentials.json"
     GMAIL_API_SCOPES: str = "https://www.googleapis.com/auth/gmail.modify"
     GOOGLE_REDIRECT_URI: str = "http://127.0.0.1:9000/agents/auth/google/callback"
 
+    # --- Cache de credenciais do Google ---
+    CREDENTIAL_CACHE_TTL: float = 3600.0  # Segundos que uma credencial descriptografada fica em memória
+    CREDENTIAL_CACHE_MAX_SIZE: int = 1000
+    CREDENTIAL_REFRESH_MARGIN: float = 300.0  # Renova o token quando faltar menos que isso para expirar
+    CREDENTIAL_REFRESH_INTERVAL: float = 60.0  # Intervalo do renovador em segundo plano
+
     # --- Chave da API do Google (Gemini) ---
     GOOGLE_API_KEY: str
     GEMINI_MODEL_NAME: str = "gemini-2.5-flash" # Modelo rápido, eficiente e de baixo custo.
 
-    @property
-    def database_url(self) -> str:
-        """Gera a URL de conexão para o SQLAlchemy."""
+    # --- Cliente HTTP do Gemini (pool compartilhado) ---
+    GEMINI_HTTP2: bool = True
+    GEMINI_MAX_CONNECTIONS: int = 20
+    GEMINI_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    GEMINI_KEEPALIVE_EXPIRY: float = 60.0  # Segundos que uma conexão ociosa fica no pool
+    GEMINI_TIMEOUT: float = 60.0
+    GEMINI_CONNECT_TIMEOUT: float = 10.0
+
+    # --- Limitação de taxa e novas tentativas do Gemini ---
+    GEMINI_REQUESTS_PER_MINUTE: float = 60.0
+    GEMINI_TOKENS_PER_MINUTE: float = 250000.0
+    GEMINI_MAX_CONCURRENCY: int = 8  # Teto da concorrência adaptativa
+    GEMINI_MIN_CONCURRENCY: int = 1
+    GEMINI_MAX_RETRIES: int = 5  # Novas tentativas em 429/5xx e falhas de rede
+    GEMINI_BACKOFF_BASE: float = 1.0  # Segundos; dobra a cada tentativa
+    GEMINI_BACKOFF_MAX: float = 60.0
+
+    # --- Cache de respostas da IA ---
+    REPLY_CACHE_ENABLED: bool = True
+    REPLY_CACHE_MAX_ENTRIES: int = 10000  # Entradas no LRU em memória de cada processo
+    REPLY_CACHE_TTL: float = 7 * 24 * 3600.0  # Validade de uma resposta em cache (segundos)
+    REPLY_CACHE_PURGE_INTERVAL: float = 3600.0  # Intervalo da remoção das entradas vencidas da tabela
+
+    # --- Contexto das conversas no prompt de resposta ---
+    THREAD_CONTEXT_ENABLED: bool = True
+    THREAD_CONTEXT_MAX_THREADS: int = 5000  # Threads mantidas no LRU em memória de cada processo
+    THREAD_CONTEXT_MAX_CHARS: int = 2000  # Tamanho máximo do contexto enviado ao Gemini
+    THREAD_CONTEXT_RECENT_MESSAGES: int = 3  # Mensagens recentes mantidas na íntegra; as anteriores viram resumo
+    THREAD_CONTEXT_TTL: float = 24 * 3600.0  # Validade do contexto de uma thread (segundos)
+
+    # --- Resumos encaminhados para o webhook do agente (Account.forward_url) ---
+    FORWARDING_ENABLED: bool = True  # Gera e encaminha resumos dos e-mails recebidos
+    SUMMARY_QUEUE_SIZE: int = 1000  # E-mails aguardando resumo em memória (o excesso fica para a varredura)
+    SUMMARY_BATCH_SIZE: int = 20  # E-mails resumidos por lote
+    SUMMARY_SWEEP_LOOKBACK: float = 24 * 3600.0  # A varredura resume e-mails sem resumo recebidos neste intervalo
+    SUMMARY_RETRY_BASE: float = 60.0  # Espera antes de tentar de novo um resumo vazio; dobra a cada tentativa
+    SUMMARY_RETRY_MAX: float = 3600.0
+    # Cota própria do Gemini para os resumos: eles nunca disputam a vaga das respostas
+    SUMMARY_REQUESTS_PER_MINUTE: float = 20.0
+    SUMMARY_TOKENS_PER_MINUTE: float = 50000.0
+    SUMMARY_MAX_CONCURRENCY: int = 2
+    WEBHOOK_MAX_CONNECTIONS: int = 100
+    WEBHOOK_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    WEBHOOK_KEEPALIVE_EXPIRY: float = 30.0
+    WEBHOOK_TIMEOUT: float = 10.0  # Um webhook lento falha em vez de prender a entrega
+    WEBHOOK_CONNECT_TIMEOUT: float = 5.0
+    WEBHOOK_MAX_CONCURRENCY_PER_HOST: int = 4  # Entregas simultâneas para um mesmo host
+    WEBHOOK_MAX_IN_FLIGHT: int = 1000  # Entregas em andamento por processo
+    WEBHOOK_MAX_RETRIES: int = 3  # Novas tentativas em 429/5xx e falhas de rede
+    WEBHOOK_BACKOFF_BASE: float = 1.0  # Segundos; dobra a cada tentativa
+    WEBHOOK_BACKOFF_MAX: float = 30.0
+    WEBHOOK_FLUSH_INTERVAL: float = 1.0  # Intervalo da gravação em lote dos status de entrega
+    WEBHOOK_SWEEP_INTERVAL: float = 60.0  # Intervalo da busca por resumos ainda pendentes
+
+    # --- Processamento de E-mails ---
+    # Quantidade máxima de mensagens processadas em paralelo por execução do pipeline.
+    EMAIL_PROCESSING_CONCURRENCY: int = 8
+    # Mensagens buscadas por requisição batch do Gmail (o Google recomenda no máximo 50
+    # e recusa batches com mais de 100 chamadas).
+    GMAIL_BATCH_SIZE: int = Field(default=50, ge=1, le=100)
+    # Quantidade de requisições batch em andamento ao mesmo tempo.
+    GMAIL_BATCH_CONCURRENCY: int = 2
+    # Execuções em que uma mensagem que falhou é tentada de novo antes de ser deixada de lado
+    # (ela continua não lida no Gmail).
+    GMAIL_MESSAGE_MAX_ATTEMPTS: int = 5
+    # Tamanho máximo (em caracteres) do corpo extraído de cada e-mail; o resto é descartado.
+    EMAIL_BODY_MAX_CHARS: int = 20000
+    # Intervalo dos comentários keep-alive no stream de progresso (evita timeout de proxies).
+    PROCESSING_STREAM_HEARTBEAT: float = 15.0
+
+    # --- Jobs de processamento (POST /agents/{id}/process-emails) ---
+    JOB_MAX_CONCURRENCY: int = 4  # Jobs executados ao mesmo tempo por processo
+    JOB_PROGRESS_INTERVAL: float = 1.0  # Intervalo de gravação do progresso e do heartbeat (segundos)
+    JOB_STALE_AFTER: float = 60.0  # Sem heartbeat há mais que isso, o job é retomado por outro processo
+    JOB_SWEEP_INTERVAL: float = 30.0  # Intervalo da busca por jobs na fila ou parados
+
+    # --- Fila de envio de e-mails (outgoing_emails) ---
+    OUTBOX_WORKERS: int = 2  # Workers iniciados junto com a API (0 desativa)
+    OUTBOX_BATCH_SIZE: int = 10  # E-mails reservados por transação
+    OUTBOX_POLL_INTERVAL: float = 2.0  # Segundos de espera quando a fila está vazia
+    OUTBOX_LEASE_SECONDS: float = 300.0  # Reserva de um e-mail 'sending'; vencida, outro worker o reenvia
+    OUTBOX_MAX_ATTEMPTS: int = 5  # Tentativas de envio antes de marcar o e-mail como 'failed'
+    OUTBOX_BACKOFF_BASE: float = 30.0  # Segundos até a próxima tentativa após um erro temporário; dobra a cada tentativa
+    OUTBOX_BACKOFF_MAX: float = 3600.0
+
+    # --- Agendador de processamento (todas as contas autorizadas) ---
+    SCHEDULER_ENABLED: bool = False  # Inicia o agendador junto com a API
+    SCHEDULER_INTERVAL: float = 60.0  # Intervalo base entre execuções de uma conta (segundos)
+    SCHEDULER_MAX_INTERVAL: float = 900.0  # Teto do backoff para caixas ociosas
+    SCHEDULER_JITTER: float = 0.2  # Variação aleatória de ±20% em cada intervalo
+    SCHEDULER_CONCURRENCY: int = 10  # Contas processadas ao mesmo tempo por processo
+    SCHEDULER_MAX_MESSAGES_PER_RUN: int = 100  # Mensagens por conta em cada execução
+    SCHEDULER_SHARD_INDEX: int = 0  # Shard deste processo (crc32(account_id) % SHARD_COUNT)
+    SCHEDULER_SHARD_COUNT: int = 1
+
+    # --- Retenção e arquivamento de e-mails recebidos (app/services/archiver.py) ---
+    ARCHIVER_ENABLED: bool = True  # Inicia o arquivador junto com a API
+    RECEIVED_EMAIL_RETENTION_DAYS: int = 0  # Padrão das contas sem retention_days (0: nunca arquivar)
+    ARCHIVE_DIR: str = "archive"  # Destino dos arquivos .jsonl.gz com os e-mails arquivados
+    ARCHIVE_BATCH_SIZE: int = 500  # E-mails gravados e apagados por transação
+    ARCHIVE_INTERVAL: float = 3600.0  # Intervalo entre as rodadas do arquivador (segundos)
+    PARTITION_MONTHS_AHEAD: int = 3  # Partições mensais criadas com antecedência (Postgres)
+
+    def _postgres_url(self, scheme: str) -> str:
         encoded_password = quote_plus(self.POSTGRES_PASSWORD)
         return (
-            f"postgresql://{self.POSTGRES_USER}:{encoded_password}@"
+            f"{scheme}://{self.POSTGRES_USER}:{encoded_password}@"
             f"{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
 
-settings = Settings()
\ No newline at end of file
+    @property
+    def database_url(self) -> str:
+        """Gera a URL de conexão para o SQLAlchemy."""
+        return self._postgres_url("postgresql")
+
+    @property
+    def async_database_url(self) -> str:
+        """URL de conexão do engine assíncrono (driver asyncpg)."""
+        return self._postgres_url("postgresql+asyncpg")
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Instância única do Settings, criada (lendo o ambiente e o .env) no primeiro uso."""
+    return Settings()
+
+
+class _LazySettings:
+    """
+    Encaminha leituras e escritas de atributos para get_settings(). Permite manter
+    `from app.config import settings` em todos os módulos sem validar o ambiente na
+    importação: uma variável obrigatória ausente só falha quando for lida.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(get_settings(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(get_settings(), name)
+
+
+settings = cast(Settings, _LazySettings())
@@ -1,6 +1,10 @@
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, selectinload, undefer
 from google.oauth2.credentials import Credentials
-from app import models, schemas, security
+from app import body_store, models, schemas, security
 
 def get_agent_by_email(db: Session, email: str) -> models.Account | None:
     return db.query(models.Account).filter(models.Account.email == email).first()
@@ -14,7 +18,8 @@ def create_agent(db: Session, agent: schemas.AgentCreate) -> models.Account:
         email=agent.email,
         name=agent.name,
         password_hash=hashed_password,
-        forward_url=str(agent.forward_url) if agent.forward_url else None
+        forward_url=str(agent.forward_url) if agent.forward_url else None,
+        retention_days=agent.retention_days,
     )
     db.add(db_agent)
     db.commit()
@@ -25,17 +30,21 @@ def update_agent_credentials(db: Session, agent: models.Account, creds: Credenti
     """
     Converte as credenciais do Google para um dicionário, criptografa e salva no agente.
     """
-    creds_dict = {
-        'token': creds.token,
-        'refresh_token': creds.refresh_token,
-        'token_uri': creds.token_uri,
-        'client_id': creds.client_id,
-        'client_secret': creds.client_secret,
-        'scopes': creds.scopes
-    }
+    creds_dict = security.credentials_to_dict(creds)
     agent.encrypted_credentials = security.encrypt_data(creds_dict)
     db.commit()
     db.refresh(agent)
+    security.credential_cache.invalidate(agent.id)
+    return agent
+
+def update_agent_history_id(db: Session, agent: models.Account, history_id: str | None) -> models.Account:
+    """
+    Salva o historyId do Gmail até onde a caixa do agente já foi sincronizada.
+    None descarta o watermark e força uma sincronização completa na próxima execução.
+    """
+    if agent.gmail_history_id != history_id:
+        agent.gmail_history_id = history_id
+        db.commit()
     return agent
 
 # --- CRUD para E-mails Recebidos ---
@@ -67,6 +76,141 @@ def get_or_create_received_email(db: Session, email_data: schemas.ReceivedEmailC
     return db_email
 
 
+# Linhas por comando INSERT na ingestão em lote (limita o número de parâmetros por comando).
+BULK_INSERT_CHUNK_SIZE = 1000
+
+def _received_email_ids(db: Session, gmail_message_ids: list[str]) -> dict[str, int]:
+    rows = (
+        db.query(models.ReceivedEmail.gmail_message_id, models.ReceivedEmail.id)
+        .filter(models.ReceivedEmail.gmail_message_id.in_(gmail_message_ids))
+        .all()
+    )
+    return dict(rows)
+
+def bulk_create_received_emails(db: Session, emails: list[schemas.ReceivedEmailCreate]) -> dict[str, int]:
+    """
+    Armazena uma página inteira de e-mails recebidos em uma única transação,
+    ignorando os que já existem. Retorna {gmail_message_id: id} de todos os e-mails
+    informados, novos ou já existentes.
+
+    No PostgreSQL usa INSERT ... ON CONFLICT (gmail_message_id, received_at) DO NOTHING
+    RETURNING (a unicidade inclui a chave de partição, ver models.ReceivedEmail);
+    nos demais bancos (ex.: SQLite dos testes) consulta os existentes e insere o restante.
+    """
+    rows = {email.gmail_message_id: email.model_dump() for email in emails}
+    if not rows:
+        return {}
+
+    # Corpos primeiro (FK de body_hash), uma vez por conteúdo, mesmo repetidos na página
+    postgres = db.get_bind().dialect.name == "postgresql"
+    models.insert_email_bodies(db.connection(), [row["body"] for row in rows.values() if row["body"] is not None])
+    for row in rows.values():
+        body = row.pop("body")
+        row["body_hash"] = None if body is None else body_store.content_hash(body)
+        if postgres:
+            row["search_vector"] = models.search_vector_expression(row["subject"], body)
+
+    ids: dict[str, int] = {}
+    if postgres:
+        for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            chunk = list(rows.values())[start:start + BULK_INSERT_CHUNK_SIZE]
+            stmt = (
+                postgresql.insert(models.ReceivedEmail)
+                .values(chunk)
+                .on_conflict_do_nothing(index_elements=[models.ReceivedEmail.gmail_message_id,
+                                                        models.ReceivedEmail.received_at])
+                .returning(models.ReceivedEmail.gmail_message_id, models.ReceivedEmail.id)
+            )
+            ids.update(db.execute(stmt).tuples().all())
+    else:
+        ids.update(_received_email_ids(db, list(rows)))
+        missing = [row for gmail_id, row in rows.items() if gmail_id not in ids]
+        for start in range(0, len(missing), BULK_INSERT_CHUNK_SIZE):
+            db.execute(models.ReceivedEmail.__table__.insert(), missing[start:start + BULK_INSERT_CHUNK_SIZE])
+
+    # Completa com os ids das linhas que já existiam (conflitos) ou recém-inseridas sem RETURNING
+    pending = [gmail_id for gmail_id in rows if gmail_id not in ids]
+    if pending:
+        ids.update(_received_email_ids(db, pending))
+    db.commit()
+    return ids
+
+
+# --- CRUD para E-mails de Saída (fila de envio) ---
+
+def create_outgoing_email(db: Session, agent_id: int, email_data: schemas.SendEmailRequest) -> models.OutgoingEmail:
+    """
+    Registra um novo e-mail na fila de envio, com status 'queued'.
+    """
+    db_email = models.OutgoingEmail(
+        account_id=agent_id,
+        recipient=email_data.receiver,
+        subject=email_data.subject,
+        body=email_data.body,
+        status=models.EmailStatusEnum.queued,
+    )
+    db.add(db_email)
+    db.commit()
+    db.refresh(db_email)
+    return db_email
+
+def claim_queued_emails(db: Session, limit: int, lease_seconds: float) -> list[models.OutgoingEmail]:
+    """
+    Reserva até `limit` e-mails prontos para envio, em ordem de chegada, com FOR UPDATE
+    SKIP LOCKED, e os marca como 'sending' por `lease_seconds`. Quem chamou deve fazer o
+    commit logo em seguida: o envio acontece fora da transação, e é o status (não o lock
+    da linha) que impede outro worker de pegar o mesmo e-mail. Um e-mail 'sending' com a
+    reserva vencida (o worker caiu no meio do envio) volta a ser reservado.
+    """
+    now = datetime.now(timezone.utc)
+    outgoing = models.OutgoingEmail
+    emails = (
+        db.query(outgoing)
+        .options(selectinload(outgoing.account), undefer(outgoing.body_data))
+        .filter(or_(
+            and_(outgoing.status == models.EmailStatusEnum.queued,
+                 or_(outgoing.next_attempt_at.is_(None), outgoing.next_attempt_at <= now)),
+            and_(outgoing.status == models.EmailStatusEnum.sending, outgoing.lease_expires_at < now),
+        ))
+        .order_by(outgoing.created_at, outgoing.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=outgoing)
+        .all()
+    )
+    for db_email in emails:
+        db_email.status = models.EmailStatusEnum.sending
+        db_email.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        db_email.attempts += 1
+    return emails
+
+def count_queued_emails(db: Session) -> int:
+    """Quantidade de e-mails aguardando na fila de envio (usa o índice parcial da fila)."""
+    return db.scalar(
+        select(func.count()).select_from(models.OutgoingEmail)
+        .where(models.OutgoingEmail.status == models.EmailStatusEnum.queued)
+    )
+
+def mark_outgoing_email_sent(db_email: models.OutgoingEmail):
+    """Marca o e-mail como enviado. O commit fica a cargo de quem chamou."""
+    db_email.status = models.EmailStatusEnum.sent
+    db_email.sent_at = datetime.now(timezone.utc)
+    db_email.error_message = None
+    db_email.lease_expires_at = None
+
+def mark_outgoing_email_retry(db_email: models.OutgoingEmail, error_message: str, delay_seconds: float):
+    """Devolve o e-mail à fila para uma nova tentativa daqui a `delay_seconds`. O commit fica a cargo de quem chamou."""
+    db_email.status = models.EmailStatusEnum.queued
+    db_email.error_message = error_message
+    db_email.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+    db_email.lease_expires_at = None
+
+def mark_outgoing_email_failed(db_email: models.OutgoingEmail, error_message: str):
+    """Marca o e-mail como falho. O commit fica a cargo de quem chamou."""
+    db_email.status = models.EmailStatusEnum.failed
+    db_email.error_message = error_message
+    db_email.lease_expires_at = None
+
+
 # --- CRUD para Resumos de E-mail ---
 
 def create_email_summary(db: Session, summary_data: schemas.EmailSummaryCreate) -> models.EmailSummary:
@@ -75,6 +219,12 @@ def create_email_summary(db: Session, summary_data: schemas.EmailSummaryCreate)
     """
     db_summary = models.EmailSummary(
         received_email_id=summary_data.received_email_id,
+        # Copiado do e-mail no próprio INSERT, para a listagem por agente não precisar de JOIN
+        account_id=(
+            select(models.ReceivedEmail.account_id)
+            .where(models.ReceivedEmail.id == summary_data.received_email_id)
+            .scalar_subquery()
+        ),
         summary_text=summary_data.summary_text,
         forward_url=summary_data.forward_url,
         forward_status=models.ForwardStatusEnum.pending  # Inicia como pendente
@@ -95,14 +245,15 @@ def update_summary_status(
     summary_id: int, 
     status: models.ForwardStatusEnum, 
     status_message: str | None = None
-) -> models.EmailSummary | None:
+) -> bool:
     """
-    Atualiza o status de encaminhamento de um resumo de e-mail.
+    Atualiza o status de encaminhamento de um resumo de e-mail com um único UPDATE,
+    sem carregar o resumo antes. Retorna False se o resumo não existir.
     """
-    db_summary = get_summary_by_id(db, summary_id)
-    if db_summary:
-        db_summary.forward_status = status
-        db_summary.status_message = status_message
-        db.commit()
-        db.refresh(db_summary)
-    return db_summary
\ No newline at end of file
+    result = db.execute(
+        update(models.EmailSummary)
+        .where(models.EmailSummary.id == summary_id)
+        .values(forward_status=status, status_message=status_message)
+    )
+    db.commit()
+    return result.rowcount > 0
\ No newline at end of file
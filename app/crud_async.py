@@ -0,0 +1,517 @@
+"""
+Versões assíncronas (AsyncSession) das funções de app/crud.py usadas pelos endpoints
+e pelo pipeline de e-mails. O hashing de senha roda no pool de processos de
+app/password_hashing.py, sem bloquear o event loop.
+
+As sessões assíncronas não expiram os objetos no commit e o INSERT já devolve os
+valores gerados pelo banco (RETURNING), então não há refresh depois das gravações.
+"""
+import base64
+import html
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, literal_column, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from google.oauth2.credentials import Credentials
+from app import body_store, crud, models, schemas, security
+from app.password_hashing import password_hashing_pool
+
+async def get_agent_by_email(db: AsyncSession, email: str) -> models.Account | None:
+    return await db.scalar(select(models.Account).where(models.Account.email == email))
+
+async def get_agent_by_id(db: AsyncSession, agent_id: int) -> models.Account | None:
+    return await db.get(models.Account, agent_id)
+
+async def create_agent(db: AsyncSession, agent: schemas.AgentCreate) -> models.Account:
+    hashed_password = await password_hashing_pool.hash(agent.password)
+    db_agent = models.Account(
+        email=agent.email,
+        name=agent.name,
+        password_hash=hashed_password,
+        forward_url=str(agent.forward_url) if agent.forward_url else None,
+        retention_days=agent.retention_days,
+    )
+    db.add(db_agent)
+    await db.commit()
+    return db_agent
+
+async def update_agent_password_hash(db: AsyncSession, agent: models.Account, password_hash: str) -> models.Account:
+    """
+    Substitui o hash da senha do agente (ex.: refeito no login com novos parâmetros do Argon2).
+    """
+    agent.password_hash = password_hash
+    await db.commit()
+    return agent
+
+async def update_agent_credentials(db: AsyncSession, agent: models.Account, creds: Credentials) -> models.Account:
+    """
+    Converte as credenciais do Google para um dicionário, criptografa e salva no agente.
+    """
+    creds_dict = security.credentials_to_dict(creds)
+    agent.encrypted_credentials = security.encrypt_data(creds_dict)
+    await db.commit()
+    security.credential_cache.invalidate(agent.id)
+    return agent
+
+async def update_agent_history_id(db: AsyncSession, agent: models.Account, history_id: str | None) -> models.Account:
+    """
+    Salva o historyId do Gmail até onde a caixa do agente já foi sincronizada.
+    None descarta o watermark e força uma sincronização completa na próxima execução.
+    """
+    if agent.gmail_history_id != history_id:
+        agent.gmail_history_id = history_id
+        await db.commit()
+    return agent
+
+async def get_message_attempts(db: AsyncSession, account_id: int) -> dict[str, int]:
+    """{gmail_message_id: tentativas} das mensagens da conta que falharam em execuções anteriores."""
+    result = await db.execute(
+        select(models.MessageAttempt.gmail_message_id, models.MessageAttempt.attempts)
+        .where(models.MessageAttempt.account_id == account_id)
+    )
+    return dict(result.all())
+
+async def record_message_attempts(db: AsyncSession, account_id: int, failed_ids: list[str], succeeded_ids: list[str]):
+    """Soma uma tentativa às mensagens que falharam e esquece as que foram concluídas."""
+    if succeeded_ids:
+        await db.execute(
+            delete(models.MessageAttempt)
+            .where(models.MessageAttempt.account_id == account_id,
+                   models.MessageAttempt.gmail_message_id.in_(succeeded_ids))
+        )
+    if failed_ids:
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(models.MessageAttempt).values(
+            [{"account_id": account_id, "gmail_message_id": message_id, "attempts": 1} for message_id in failed_ids]
+        )
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[models.MessageAttempt.account_id, models.MessageAttempt.gmail_message_id],
+            set_={"attempts": models.MessageAttempt.attempts + 1, "last_attempt_at": func.now()},
+        ))
+    if succeeded_ids or failed_ids:
+        await db.commit()
+
+async def prune_message_attempts(db: AsyncSession, account_id: int, unread_ids: list[str]):
+    """
+    Depois de uma listagem completa, esquece as mensagens que não estão mais não lidas
+    (lidas ou apagadas pelo usuário): o registro nunca passa do tamanho da caixa de entrada.
+    """
+    stale = set(await get_message_attempts(db, account_id)) - set(unread_ids)
+    if stale:
+        await db.execute(
+            delete(models.MessageAttempt)
+            .where(models.MessageAttempt.account_id == account_id,
+                   models.MessageAttempt.gmail_message_id.in_(sorted(stale)))
+        )
+        await db.commit()
+
+# --- CRUD para E-mails Recebidos ---
+
+async def bulk_create_received_emails(db: AsyncSession, emails: list[schemas.ReceivedEmailCreate]) -> dict[str, int]:
+    """
+    Armazena uma página inteira de e-mails recebidos em uma única transação, ignorando
+    os que já existem. Retorna {gmail_message_id: id} de todos os e-mails informados.
+    A lógica por dialeto é a mesma de crud.bulk_create_received_emails, executada
+    sobre a conexão assíncrona.
+    """
+    if not emails:
+        return {}
+    return await db.run_sync(crud.bulk_create_received_emails, emails)
+
+# --- CRUD para Resumos de E-mail (encaminhamento para webhooks) ---
+
+async def get_emails_to_summarize(db: AsyncSession, received_email_ids: list[int]) -> list[tuple[models.ReceivedEmail, str]]:
+    """
+    E-mails informados cujo agente tem forward_url e que ainda não têm resumo,
+    junto com a URL de destino.
+    """
+    if not received_email_ids:
+        return []
+    result = await db.execute(
+        select(models.ReceivedEmail, models.Account.forward_url)
+        .options(undefer(models.ReceivedEmail.body_data))
+        .join(models.Account, models.Account.id == models.ReceivedEmail.account_id)
+        .where(
+            models.ReceivedEmail.id.in_(received_email_ids),
+            models.Account.forward_url.isnot(None),
+            ~models.ReceivedEmail.summaries.any(),
+        )
+    )
+    return [tuple(row) for row in result]
+
+async def list_emails_missing_summary(db: AsyncSession, received_after: datetime, limit: int = 500) -> list[int]:
+    """
+    Ids dos e-mails recebidos depois de `received_after`, com corpo, de agentes com
+    forward_url e ainda sem resumo (fila em memória cheia, reinício ou resumo vazio).
+    """
+    result = await db.scalars(
+        select(models.ReceivedEmail.id)
+        .join(models.Account, models.Account.id == models.ReceivedEmail.account_id)
+        .where(
+            models.Account.forward_url.isnot(None),
+            models.ReceivedEmail.received_at >= received_after,
+            models.ReceivedEmail.body_hash.isnot(None),
+            models.ReceivedEmail.body_hash != body_store.EMPTY_BODY_HASH,
+            ~models.ReceivedEmail.summaries.any(),
+        )
+        .order_by(models.ReceivedEmail.id)
+        .limit(limit)
+    )
+    return list(result)
+
+async def create_email_summaries(db: AsyncSession, summaries: list[dict]) -> list[int]:
+    """
+    Insere vários resumos 'pending' em uma única transação. Retorna os ids criados;
+    e-mails que já têm resumo (gravado por outro processo) são ignorados.
+    """
+    if not summaries:
+        return []
+    rows = [{"forward_status": models.ForwardStatusEnum.pending, **summary} for summary in summaries]
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = (
+        dialect.insert(models.EmailSummary)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[models.EmailSummary.received_email_id])
+        .returning(models.EmailSummary.id)
+    )
+    summary_ids = list(await db.scalars(stmt))
+    await db.commit()
+    return summary_ids
+
+async def list_pending_summary_deliveries(
+    db: AsyncSession,
+    summary_ids: list[int] | None = None,
+    created_before: datetime | None = None,
+    limit: int = 500,
+) -> list[dict]:
+    """
+    Resumos ainda 'pending', com os dados do e-mail de origem necessários para a entrega,
+    em uma única consulta.
+    """
+    query = (
+        select(
+            models.EmailSummary.id,
+            models.EmailSummary.account_id,
+            models.EmailSummary.summary_text,
+            models.EmailSummary.forward_url,
+            models.EmailSummary.created_at,
+            models.ReceivedEmail.gmail_message_id,
+            models.ReceivedEmail.sender,
+            models.ReceivedEmail.subject,
+            models.ReceivedEmail.received_at,
+        )
+        .join(models.ReceivedEmail, models.ReceivedEmail.id == models.EmailSummary.received_email_id)
+        .where(models.EmailSummary.forward_status == models.ForwardStatusEnum.pending)
+    )
+    if summary_ids is not None:
+        query = query.where(models.EmailSummary.id.in_(summary_ids))
+    if created_before is not None:
+        query = query.where(models.EmailSummary.created_at < created_before)
+    result = await db.execute(query.order_by(models.EmailSummary.id).limit(limit))
+    return [dict(row) for row in result.mappings()]
+
+async def bulk_update_summary_statuses(db: AsyncSession, statuses: list[dict]) -> None:
+    """
+    Grava o resultado de várias entregas (id, forward_status, status_message) em uma
+    única transação, com um UPDATE por chave primária executado em lote.
+    """
+    if not statuses:
+        return
+    await db.execute(update(models.EmailSummary), statuses)
+    await db.commit()
+
+# --- Listagens paginadas por cursor (keyset) ---
+
+def _encode_cursor(sort_value: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{sort_value.isoformat()}|{row_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        sort_value, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor inválido.") from e
+
+async def _keyset_page(db: AsyncSession, query, sort_column, cursor: str | None, limit: int) -> tuple[list, str | None]:
+    """
+    Página de `query` em ordem decrescente de (sort_column, id), começando depois do
+    item do cursor. A comparação de tuplas usa o índice composto correspondente, então
+    qualquer página custa o mesmo que a primeira (ao contrário de OFFSET).
+    Retorna (itens, cursor da próxima página ou None).
+    """
+    entity = query.column_descriptions[0]["entity"]
+    if cursor is not None:
+        query = query.where(tuple_(sort_column, entity.id) < _decode_cursor(cursor))
+    rows = list(await db.scalars(query.order_by(sort_column.desc(), entity.id.desc()).limit(limit + 1)))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor(getattr(rows[-1], sort_column.key), rows[-1].id)
+
+async def list_received_emails(
+    db: AsyncSession, agent_id: int, sender: str | None = None, cursor: str | None = None, limit: int = 50
+) -> tuple[list[models.ReceivedEmail], str | None]:
+    query = (
+        select(models.ReceivedEmail)
+        .options(undefer(models.ReceivedEmail.body_data))
+        .where(models.ReceivedEmail.account_id == agent_id)
+    )
+    if sender is not None:
+        query = query.where(models.ReceivedEmail.sender == sender)
+    return await _keyset_page(db, query, models.ReceivedEmail.received_at, cursor, limit)
+
+async def list_outgoing_emails(
+    db: AsyncSession, agent_id: int, status: models.EmailStatusEnum | None = None,
+    cursor: str | None = None, limit: int = 50,
+) -> tuple[list[models.OutgoingEmail], str | None]:
+    query = (
+        select(models.OutgoingEmail)
+        .options(undefer(models.OutgoingEmail.body_data))
+        .where(models.OutgoingEmail.account_id == agent_id)
+    )
+    if status is not None:
+        query = query.where(models.OutgoingEmail.status == status)
+    return await _keyset_page(db, query, models.OutgoingEmail.created_at, cursor, limit)
+
+async def list_email_summaries(
+    db: AsyncSession, agent_id: int, status: models.ForwardStatusEnum | None = None,
+    cursor: str | None = None, limit: int = 50,
+) -> tuple[list[models.EmailSummary], str | None]:
+    query = select(models.EmailSummary).where(models.EmailSummary.account_id == agent_id)
+    if status is not None:
+        query = query.where(models.EmailSummary.forward_status == status)
+    return await _keyset_page(db, query, models.EmailSummary.created_at, cursor, limit)
+
+# --- Busca textual em E-mails Recebidos ---
+
+SEARCH_HIGHLIGHT_START, SEARCH_HIGHLIGHT_STOP = "<mark>", "</mark>"
+SEARCH_SNIPPET_WORDS = 20
+# O banco delimita os termos com estes caracteres (uso privado do Unicode); o texto é
+# escapado antes de eles virarem <mark>, para que o HTML do e-mail nunca chegue cru ao cliente.
+_HIGHLIGHT_START_SENTINEL, _HIGHLIGHT_STOP_SENTINEL = "\ue000", "\ue001"
+
+def _escape_highlight(value: str | None) -> str:
+    escaped = html.escape(value or "")
+    return (
+        escaped.replace(_HIGHLIGHT_START_SENTINEL, SEARCH_HIGHLIGHT_START)
+        .replace(_HIGHLIGHT_STOP_SENTINEL, SEARCH_HIGHLIGHT_STOP)
+    )
+
+_HIGHLIGHT_OPTIONS = f"StartSel={_HIGHLIGHT_START_SENTINEL}, StopSel={_HIGHLIGHT_STOP_SENTINEL}"
+
+def _postgres_tsquery(query: str):
+    config = literal_column(f"'{models.SEARCH_TEXT_CONFIG}'::regconfig")
+    return config, func.websearch_to_tsquery(config, query)
+
+def _postgres_search(agent_id: int, query: str, limit: int, offset: int):
+    config, tsquery = _postgres_tsquery(query)
+    search_vector = models.ReceivedEmail.search_vector
+    rank = func.ts_rank_cd(search_vector, tsquery).label("rank")
+    # Primeiro a página (só índice e ranking); o ts_headline, caro, roda apenas nela
+    page = (
+        select(models.ReceivedEmail.id, rank)
+        .where(models.ReceivedEmail.account_id == agent_id, search_vector.op("@@")(tsquery))
+        .order_by(rank.desc(), models.ReceivedEmail.id.desc())
+        .limit(limit)
+        .offset(offset)
+        .subquery()
+    )
+    return (
+        select(
+            models.ReceivedEmail.id,
+            models.ReceivedEmail.gmail_message_id,
+            models.ReceivedEmail.sender,
+            models.ReceivedEmail.received_at,
+            page.c.rank,
+            func.ts_headline(config, func.coalesce(models.ReceivedEmail.subject, ""), tsquery,
+                             f"{_HIGHLIGHT_OPTIONS}, HighlightAll=true").label("subject_highlight"),
+            models.ReceivedEmail.body_data,
+        )
+        .join(page, page.c.id == models.ReceivedEmail.id)
+        .order_by(page.c.rank.desc(), models.ReceivedEmail.id.desc())
+    )
+
+async def _postgres_snippets(db: AsyncSession, query: str, bodies: list[str]) -> list[str]:
+    """
+    Trechos (ts_headline) dos corpos da página, em uma única consulta. O banco guarda o
+    corpo comprimido, então o texto é descomprimido aqui e enviado de volta só para a página.
+    """
+    if not bodies:
+        return []
+    config, tsquery = _postgres_tsquery(query)
+    options = f"{_HIGHLIGHT_OPTIONS}, MaxWords={SEARCH_SNIPPET_WORDS}, MinWords=5"
+    return list((await db.execute(select(*(func.ts_headline(config, body, tsquery, options) for body in bodies)))).one())
+
+def _sqlite_search(agent_id: int, query: str, limit: int, offset: int):
+    # Tabela FTS5 espelhada por triggers (criada em app/tests/conftest.py). Cada termo
+    # vira uma frase entre aspas, para que a entrada do usuário não seja lida como sintaxe FTS5.
+    match = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+    return text(f"""
+        SELECT e.id, e.gmail_message_id, e.sender, e.received_at,
+               -bm25(received_emails_fts, 2.5, 1.0) AS rank,
+               highlight(received_emails_fts, 0, :start_sel, :stop_sel) AS subject_highlight,
+               snippet(received_emails_fts, 1, :start_sel, :stop_sel, '...', {SEARCH_SNIPPET_WORDS}) AS snippet
+        FROM received_emails_fts JOIN received_emails AS e ON e.id = received_emails_fts.rowid
+        WHERE received_emails_fts MATCH :match AND e.account_id = :account_id
+        ORDER BY rank DESC, e.id DESC
+        LIMIT :limit OFFSET :offset
+    """).bindparams(
+        match=match, account_id=agent_id, limit=limit, offset=offset,
+        start_sel=_HIGHLIGHT_START_SENTINEL, stop_sel=_HIGHLIGHT_STOP_SENTINEL,
+    ).columns(
+        received_at=models.ReceivedEmail.received_at.type
+    )
+
+async def search_received_emails(
+    db: AsyncSession, agent_id: int, query: str, limit: int = 20, offset: int = 0
+) -> list[dict]:
+    """
+    Busca textual nos e-mails recebidos do agente, do mais relevante para o menos
+    relevante. Cada resultado traz o assunto e um trecho do corpo com os termos
+    encontrados entre <mark> e </mark>; o restante do texto vem escapado para HTML.
+    No Postgres usa o tsvector indexado (websearch_to_tsquery aceita "frases", OR e -termo);
+    no SQLite, a tabela FTS5 equivalente.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        results = [dict(row) for row in (await db.execute(_postgres_search(agent_id, query, limit, offset))).mappings()]
+        bodies = [body_store.decompress(data) if data else "" for data in (result.pop("body_data") for result in results)]
+        for result, snippet in zip(results, await _postgres_snippets(db, query, bodies)):
+            result["snippet"] = snippet
+    else:
+        results = [dict(row) for row in (await db.execute(_sqlite_search(agent_id, query, limit, offset))).mappings()]
+    for result in results:
+        result["subject_highlight"] = _escape_highlight(result["subject_highlight"])
+        result["snippet"] = _escape_highlight(result["snippet"])
+    return results
+
+# --- CRUD para E-mails de Saída (fila de envio) ---
+
+async def create_outgoing_email(db: AsyncSession, agent_id: int, email_data: schemas.SendEmailRequest) -> models.OutgoingEmail:
+    """
+    Registra um novo e-mail na fila de envio, com status 'queued'.
+    """
+    db_email = models.OutgoingEmail(
+        account_id=agent_id,
+        recipient=email_data.receiver,
+        subject=email_data.subject,
+        body=email_data.body,
+        status=models.EmailStatusEnum.queued,
+    )
+    db.add(db_email)
+    await db.commit()
+    return db_email
+
+
+# --- CRUD para Jobs de Processamento ---
+
+ACTIVE_JOB_STATUSES = (models.JobStatusEnum.queued, models.JobStatusEnum.running)
+
+async def get_active_processing_job(db: AsyncSession, agent_id: int) -> models.ProcessingJob | None:
+    """Job ainda não concluído (na fila ou em execução) do agente, se houver."""
+    return await db.scalar(
+        select(models.ProcessingJob)
+        .where(models.ProcessingJob.account_id == agent_id, models.ProcessingJob.status.in_(ACTIVE_JOB_STATUSES))
+        .order_by(models.ProcessingJob.id)
+        .limit(1)
+    )
+
+async def create_processing_job(db: AsyncSession, agent_id: int) -> models.ProcessingJob:
+    db_job = models.ProcessingJob(account_id=agent_id, status=models.JobStatusEnum.queued)
+    db.add(db_job)
+    await db.commit()
+    return db_job
+
+async def get_processing_job(db: AsyncSession, agent_id: int, job_id: int) -> models.ProcessingJob | None:
+    return await db.scalar(
+        select(models.ProcessingJob)
+        .where(models.ProcessingJob.id == job_id, models.ProcessingJob.account_id == agent_id)
+    )
+
+async def list_processing_job_messages(
+    db: AsyncSession, job_id: int, after_id: int | None = None, limit: int = 100
+) -> list[models.ProcessingJobMessage]:
+    """Resultados por mensagem de um job, em ordem de conclusão, paginados por id."""
+    query = select(models.ProcessingJobMessage).where(models.ProcessingJobMessage.job_id == job_id)
+    if after_id is not None:
+        query = query.where(models.ProcessingJobMessage.id > after_id)
+    return list(await db.scalars(query.order_by(models.ProcessingJobMessage.id).limit(limit)))
+
+async def request_processing_job_cancel(db: AsyncSession, job: models.ProcessingJob) -> models.ProcessingJob:
+    """
+    Pede o cancelamento de um job. Um job ainda na fila é cancelado na hora; um job em
+    execução é interrompido pelo processo que o executa na próxima gravação de progresso.
+    """
+    now = datetime.now(timezone.utc)
+    await db.execute(
+        update(models.ProcessingJob)
+        .where(models.ProcessingJob.id == job.id, models.ProcessingJob.status.in_(ACTIVE_JOB_STATUSES))
+        .values(cancel_requested=True)
+    )
+    await db.execute(
+        update(models.ProcessingJob)
+        .where(models.ProcessingJob.id == job.id, models.ProcessingJob.status == models.JobStatusEnum.queued)
+        .values(status=models.JobStatusEnum.cancelled, finished_at=now)
+    )
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+async def claim_processing_job(db: AsyncSession, job_id: int, stale_after: float) -> bool:
+    """
+    Passa o job para 'running' se ele estiver na fila ou parado (em execução, mas sem
+    heartbeat há mais de `stale_after` segundos, ou seja, o processo que o rodava caiu).
+    O UPDATE condicional garante que apenas um processo assuma o job. Um job assumido
+    com cancelamento pedido deve apenas ser encerrado como 'cancelled'.
+    """
+    now = datetime.now(timezone.utc)
+    result = await db.execute(
+        update(models.ProcessingJob)
+        .where(
+            models.ProcessingJob.id == job_id,
+            or_(
+                models.ProcessingJob.status == models.JobStatusEnum.queued,
+                (models.ProcessingJob.status == models.JobStatusEnum.running)
+                & (models.ProcessingJob.heartbeat_at < now - timedelta(seconds=stale_after)),
+            ),
+        )
+        .values(
+            status=models.JobStatusEnum.running,
+            started_at=func.coalesce(models.ProcessingJob.started_at, now),
+            heartbeat_at=now,
+        )
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def list_resumable_processing_job_ids(db: AsyncSession, stale_after: float) -> list[int]:
+    """Jobs na fila ou parados, que podem ser assumidos por este processo."""
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_after)
+    return list(await db.scalars(
+        select(models.ProcessingJob.id)
+        .where(or_(
+            models.ProcessingJob.status == models.JobStatusEnum.queued,
+            (models.ProcessingJob.status == models.JobStatusEnum.running)
+            & (models.ProcessingJob.heartbeat_at < stale_before),
+        ))
+        .order_by(models.ProcessingJob.id)
+    ))
+
+async def save_processing_job_progress(
+    db: AsyncSession, job_id: int, counters: dict, messages: list[dict], **values
+) -> bool:
+    """
+    Grava os resultados por mensagem acumulados e os contadores do job em uma única
+    transação, renovando o heartbeat. Retorna True se o cancelamento foi pedido.
+    """
+    if messages:
+        await db.execute(insert(models.ProcessingJobMessage), [{"job_id": job_id, **row} for row in messages])
+    cancel_requested = await db.scalar(
+        update(models.ProcessingJob)
+        .where(models.ProcessingJob.id == job_id)
+        .values(heartbeat_at=datetime.now(timezone.utc), **counters, **values)
+        .returning(models.ProcessingJob.cancel_requested)
+    )
+    await db.commit()
+    return bool(cancel_requested)
@@ -1,12 +1,88 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 from app.config import settings
+from app.db_instrumentation import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument_engine
 
-DATABASE_URL = settings.database_url
+# --- Engines (criados sob demanda) ---
+# Nada aqui abre conexões nem carrega os drivers (psycopg2/asyncpg) na importação: os
+# engines são criados no lifespan da aplicação (init_engines) ou, em scripts e workers,
+# na primeira sessão aberta.
+_engine: Engine | None = None
+_async_engine: AsyncEngine | None = None
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def get_engine() -> Engine:
+    """Engine síncrono: workers da fila, persistência de credenciais e scripts."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.database_url, poolclass=TimedQueuePool, **_pool_options())
+        if settings.DB_INSTRUMENTATION_ENABLED:
+            instrument_engine(_engine)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Engine assíncrono (asyncpg): endpoints e pipeline de e-mails, sem bloquear o event loop."""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            settings.async_database_url, poolclass=TimedAsyncAdaptedQueuePool, **_pool_options()
+        )
+        if settings.DB_INSTRUMENTATION_ENABLED:
+            instrument_engine(_async_engine)
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+
+def init_engines():
+    """Cria os dois engines. Chamado no startup da aplicação, antes da primeira requisição."""
+    get_engine()
+    get_async_engine()
+
+
+async def dispose_engines():
+    """Fecha as conexões dos pools no shutdown (um novo uso volta a abri-las)."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker que cria o engine síncrono na primeira sessão, se ainda não existir."""
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            get_engine()
+        return super().__call__(**local_kw)
+
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    """async_sessionmaker que cria o engine assíncrono na primeira sessão, se ainda não existir."""
+
+    def __call__(self, **local_kw) -> AsyncSession:
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            get_async_engine()
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+# expire_on_commit=False evita recarregamentos implícitos (I/O fora de um await) após o commit.
+AsyncSessionLocal = _LazyAsyncSessionmaker(autoflush=False, expire_on_commit=False)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
@@ -14,4 +90,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,214 @@
+"""
+Instrumentação do banco de dados por requisição, baseada nos eventos do SQLAlchemy.
+
+Para cada requisição HTTP são medidos a quantidade de comandos SQL, o tempo total no
+banco, a espera por uma conexão livre no pool e o comando mais lento. Os números são
+somados em `db_metrics` e, com settings.DEBUG, devolvidos em cabeçalhos X-DB-*.
+O mesmo comando repetido muitas vezes em uma requisição gera um aviso de possível N+1.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# Tamanho máximo do comando SQL guardado nas métricas e nos cabeçalhos
+MAX_STATEMENT_LENGTH = 300
+
+
+def _normalize_statement(statement: str) -> str:
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryStats:
+    """Estatísticas de banco de uma requisição (ou de qualquer bloco medido com track_queries)."""
+
+    __slots__ = ("query_count", "db_time", "pool_wait", "slowest_time", "slowest_statement", "statements")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: str | None = None
+        self.statements: Counter[str] = Counter()
+
+    def record_query(self, statement: str, elapsed: float):
+        statement = _normalize_statement(statement)
+        self.query_count += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold: int) -> list[tuple[str, int]]:
+        """Comandos executados pelo menos `threshold` vezes (indício de N+1)."""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def as_headers(self) -> dict[str, str]:
+        headers = {
+            "X-DB-Query-Count": str(self.query_count),
+            "X-DB-Time-Ms": f"{self.db_time * 1000:.2f}",
+            "X-DB-Pool-Wait-Ms": f"{self.pool_wait * 1000:.2f}",
+            "X-DB-Slowest-Ms": f"{self.slowest_time * 1000:.2f}",
+        }
+        if self.slowest_statement:
+            # Cabeçalhos HTTP só aceitam latin-1
+            statement = self.slowest_statement[:MAX_STATEMENT_LENGTH]
+            headers["X-DB-Slowest-Statement"] = statement.encode("latin-1", "replace").decode("latin-1")
+        return headers
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("db_query_stats", default=None)
+
+@contextmanager
+def track_queries():
+    """
+    Mede os comandos executados dentro do bloco. O contexto é herdado por tarefas
+    asyncio e por asyncio.to_thread, então o trabalho feito por eles também conta.
+    """
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+# --- Medição da espera por conexões do pool ---
+class _TimedCheckoutMixin:
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = _current_stats.get()
+            if stats is not None:
+                stats.pool_wait += time.perf_counter() - started_at
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    """QueuePool que soma às estatísticas da requisição o tempo de espera por uma conexão."""
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    """Versão de TimedQueuePool para engines assíncronos."""
+
+
+# --- Medição dos comandos SQL ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started_at = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "_instrumentation_started_at", None)
+    stats = _current_stats.get()
+    if started_at is not None and stats is not None:
+        stats.record_query(statement, time.perf_counter() - started_at)
+
+def instrument_engine(engine):
+    """Registra os eventos de medição em um Engine ou AsyncEngine (apenas uma vez)."""
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+# --- Métricas agregadas ---
+class DBMetrics:
+    """Totais de banco de todas as requisições do processo, por rota."""
+
+    def __init__(self, max_slowest: int = 10):
+        self.max_slowest = max_slowest
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.queries = 0
+            self.db_time = 0.0
+            self.pool_wait = 0.0
+            self.max_pool_wait = 0.0
+            self.n_plus_one_warnings = 0
+            self._routes: dict[str, dict] = {}
+            self._slowest: list[tuple[float, str, str]] = []
+
+    def record(self, route: str, stats: QueryStats, n_plus_one: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.queries += stats.query_count
+            self.db_time += stats.db_time
+            self.pool_wait += stats.pool_wait
+            self.max_pool_wait = max(self.max_pool_wait, stats.pool_wait)
+            self.n_plus_one_warnings += n_plus_one
+
+            totals = self._routes.setdefault(route, {"requests": 0, "queries": 0, "db_time": 0.0, "pool_wait": 0.0})
+            totals["requests"] += 1
+            totals["queries"] += stats.query_count
+            totals["db_time"] += stats.db_time
+            totals["pool_wait"] += stats.pool_wait
+
+            if stats.slowest_statement:
+                self._slowest.append((stats.slowest_time, route, stats.slowest_statement[:MAX_STATEMENT_LENGTH]))
+                self._slowest.sort(reverse=True)
+                del self._slowest[self.max_slowest:]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "queries": self.queries,
+                "db_time_seconds": self.db_time,
+                "pool_wait_seconds": self.pool_wait,
+                "max_pool_wait_seconds": self.max_pool_wait,
+                "n_plus_one_warnings": self.n_plus_one_warnings,
+                "routes": {
+                    route: {
+                        "requests": totals["requests"],
+                        "avg_queries": totals["queries"] / totals["requests"],
+                        "avg_db_time_seconds": totals["db_time"] / totals["requests"],
+                        "avg_pool_wait_seconds": totals["pool_wait"] / totals["requests"],
+                    }
+                    for route, totals in self._routes.items()
+                },
+                "slowest_statements": [
+                    {"seconds": seconds, "route": route, "statement": statement}
+                    for seconds, route, statement in self._slowest
+                ],
+            }
+
+
+db_metrics = DBMetrics()
+
+
+async def db_instrumentation_middleware(request: Request, call_next):
+    """Middleware HTTP que mede o banco durante cada requisição."""
+    if not settings.DB_INSTRUMENTATION_ENABLED:
+        return await call_next(request)
+
+    with track_queries() as stats:
+        response = await call_next(request)
+
+    # O template da rota ("/agents/{agent_id}/...") evita uma entrada por id
+    route = getattr(request.scope.get("route"), "path", "<sem rota>")
+    repeated = stats.repeated_statements(settings.DB_N_PLUS_ONE_THRESHOLD)
+    for statement, count in repeated:
+        logger.warning("Possível N+1 em %s %s: comando executado %d vezes: %s",
+                       request.method, route, count, statement[:MAX_STATEMENT_LENGTH])
+    db_metrics.record(route, stats, n_plus_one=len(repeated))
+
+    if settings.DEBUG:
+        response.headers.update(stats.as_headers())
+    return response
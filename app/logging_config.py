@@ -0,0 +1,60 @@
+"""
+Logs estruturados da aplicação.
+
+Com settings.LOG_FORMAT="json", cada registro vira uma linha JSON com horário, nível,
+logger, mensagem, o agente da execução atual (ver app/metrics.py) e os campos passados
+em `extra=` (ex.: message_id, job_id). Com "text", o formato é legível para desenvolvimento.
+Os módulos usam `logger = logging.getLogger(__name__)`; configure_logging é chamada
+pelos pontos de entrada (API, workers e agendador).
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+from app.config import settings
+from app.metrics import NO_AGENT, current_agent
+
+# Atributos padrão de um LogRecord; o que não estiver aqui veio de `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "agent"}
+
+
+class _AgentFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "agent"):
+            record.agent = current_agent()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formata cada registro como um objeto JSON em uma única linha."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        agent = getattr(record, "agent", NO_AGENT)
+        if agent != NO_AGENT:
+            entry["agent"] = agent
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str | None = None, log_format: str | None = None):
+    """Configura o logger raiz (substitui handlers anteriores, então pode ser chamada de novo)."""
+    handler = logging.StreamHandler()
+    handler.addFilter(_AgentFilter())
+    if (log_format or settings.LOG_FORMAT) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [agent=%(agent)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel((level or settings.LOG_LEVEL).upper())
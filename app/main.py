@@ -1,18 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app import models
-from app.database import engine
-from app.routers import agents
+from app import database, security
+from app.config import settings
+from app.db_instrumentation import db_instrumentation_middleware
+from app.logging_config import configure_logging
+from app.password_hashing import password_hashing_pool
+from app.routers import agents, db_metrics, metrics, reply_cache
+from app.services import email_service, http_clients
+from app.services.archiver import received_email_archiver
+from app.services.job_runner import job_runner
+from app.services.outbox_worker import start_outbox_workers
+from app.services.reply_cache import reply_cache as reply_cache_service
+from app.services.scheduler import PollingScheduler
+from app.services.summary_forwarder import summary_forwarder
+
+configure_logging()
+
+# O schema não é criado nem alterado aqui: rode `python -m app.migrate` antes de
+# iniciar a API (ver README). Assim nenhum processo novo executa DDL ao subir.
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cria os recursos compartilhados no startup e os libera no shutdown."""
+    email_service.check_gemini_api_key()
+    database.init_engines()
+    await http_clients.init_gemini_client()
+    stop_event = asyncio.Event()
+    background_tasks = [asyncio.create_task(security.run_credential_refresher(stop_event))]
+    background_tasks += start_outbox_workers(stop_event)
+    # Retoma os jobs de processamento pendentes (inclusive os interrompidos por um reinício)
+    background_tasks.append(asyncio.create_task(job_runner.run(stop_event)))
+    if settings.REPLY_CACHE_ENABLED:
+        background_tasks.append(asyncio.create_task(reply_cache_service.run_purger(stop_event)))
+    if settings.FORWARDING_ENABLED:
+        background_tasks.append(asyncio.create_task(summary_forwarder.run(stop_event)))
+    if settings.SCHEDULER_ENABLED:
+        background_tasks.append(asyncio.create_task(PollingScheduler().run(stop_event)))
+    if settings.ARCHIVER_ENABLED:
+        background_tasks.append(asyncio.create_task(received_email_archiver.run(stop_event)))
+    yield
+    stop_event.set()
+    await asyncio.gather(*background_tasks)
+    await http_clients.close_gemini_client()
+    await http_clients.close_webhook_client()
+    await database.dispose_engines()
+    await asyncio.to_thread(password_hashing_pool.shutdown)
 
-# Cria/atualiza as tabelas no banco de dados com base nos modelos
-models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="AI Agent for Gmail",
-    description="Uma API para gerenciar agentes de IA que interagem com o Gmail."
+    description="Uma API para gerenciar agentes de IA que interagem com o Gmail.",
+    lifespan=lifespan,
 )
 
+app.middleware("http")(db_instrumentation_middleware)
+
 app.include_router(agents.router)
+app.include_router(reply_cache.router)
+app.include_router(db_metrics.router)
+if settings.METRICS_ENABLED:
+    app.include_router(metrics.router)
 
 @app.get("/", tags=["Root"])
 def read_root():
-    return {"status": "API está funcionando!"}
\ No newline at end of file
+    return {"status": "API está funcionando!"}
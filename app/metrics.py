@@ -0,0 +1,135 @@
+"""
+Métricas do pipeline de e-mails no formato do Prometheus (exportadas em GET /metrics).
+
+- gmail_agent_pipeline_stage_seconds: duração de cada etapa do pipeline (listagem,
+  busca, gravação, contexto, geração, envio, marcação como lido e a execução inteira).
+- gmail_agent_external_call_seconds: duração de cada chamada ao Gmail, ao Gemini e aos
+  webhooks, com o resultado (ok/error).
+- gmail_agent_messages_total: mensagens processadas, respondidas, ignoradas e com falha.
+- gmail_agent_token_refreshes_total: renovações de token do Google (ok/error).
+- gmail_agent_queue_depth: mensagens de cada agente ainda no pipeline e, com agent="all",
+  as filas do processo (resumos, entregas de webhooks, jobs em execução e a fila de envio).
+
+Todas as séries têm o rótulo `agent` (id da conta). O agente da execução atual fica em
+uma ContextVar, herdada por tarefas asyncio e por asyncio.to_thread, então as chamadas
+feitas pelo pipeline não precisam recebê-lo como parâmetro.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Rótulo usado fora de uma execução do pipeline e para as filas do processo
+NO_AGENT = "-"
+ALL_AGENTS = "all"
+
+# De 5 ms (consultas e chamadas rápidas) até 5 min (execuções com muitas mensagens)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "gmail_agent_pipeline_stage_seconds",
+    "Duração de cada etapa do pipeline de e-mails.",
+    ["agent", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "gmail_agent_external_call_seconds",
+    "Duração das chamadas às APIs externas (Gmail, Gemini e webhooks).",
+    ["agent", "service", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+MESSAGES_TOTAL = Counter(
+    "gmail_agent_messages",
+    "Mensagens tratadas pelo pipeline, por resultado (processed, replied, skipped, failed).",
+    ["agent", "outcome"],
+)
+TOKEN_REFRESHES_TOTAL = Counter(
+    "gmail_agent_token_refreshes",
+    "Renovações de token de acesso do Google.",
+    ["agent", "outcome"],
+)
+QUEUE_DEPTH = Gauge(
+    "gmail_agent_queue_depth",
+    "Itens aguardando ou em andamento em cada fila.",
+    ["agent", "queue"],
+)
+
+_current_agent: ContextVar[str] = ContextVar("metrics_agent", default=NO_AGENT)
+
+
+def current_agent() -> str:
+    return _current_agent.get()
+
+
+@contextmanager
+def agent_context(agent_id: int | str | None):
+    """Associa às métricas (e aos logs) do bloco o agente informado."""
+    token = _current_agent.set(NO_AGENT if agent_id is None else str(agent_id))
+    try:
+        yield
+    finally:
+        _current_agent.reset(token)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Mede a duração de uma etapa do pipeline, mesmo que ela termine com erro."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(agent=current_agent(), stage=stage).observe(time.perf_counter() - started_at)
+
+
+class CallOutcome:
+    """Resultado de uma chamada medida por observe_call; respostas de erro chamam failed()."""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+    def failed(self):
+        self.outcome = "error"
+
+
+@contextmanager
+def observe_call(service: str, operation: str):
+    """Mede uma chamada externa; exceções são contadas com outcome="error" e propagadas."""
+    started_at = time.perf_counter()
+    call = CallOutcome()
+    try:
+        yield call
+    except BaseException:
+        call.failed()
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(
+            agent=current_agent(), service=service, operation=operation, outcome=call.outcome
+        ).observe(time.perf_counter() - started_at)
+
+
+def record_messages(outcome: str, count: int = 1):
+    if count:
+        MESSAGES_TOTAL.labels(agent=current_agent(), outcome=outcome).inc(count)
+
+
+def record_token_refresh(agent_id: int | str, success: bool):
+    TOKEN_REFRESHES_TOTAL.labels(agent=str(agent_id), outcome="ok" if success else "error").inc()
+
+
+def agent_queue(queue: str) -> Gauge:
+    """Gauge da fila `queue` do agente atual (use inc/dec)."""
+    return QUEUE_DEPTH.labels(agent=current_agent(), queue=queue)
+
+
+def register_queue(queue: str, depth: Callable[[], float]):
+    """Registra uma fila do processo, cujo tamanho é lido a cada coleta."""
+    QUEUE_DEPTH.labels(agent=ALL_AGENTS, queue=queue).set_function(depth)
+
+
+def render_latest() -> tuple[bytes, str]:
+    """Corpo e Content-Type da exportação no formato texto do Prometheus."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,156 @@
+"""
+Cria e atualiza o schema do banco, fora do startup da API.
+
+    python -m app.migrate
+
+1. create_all: cria as tabelas (e os índices e a busca textual de app/models.py) que
+   ainda não existem. Tabelas existentes não são alteradas.
+2. Aplica em ordem os scripts de sql/migrations/, que atualizam bancos criados por
+   versões anteriores. Todos são idempotentes, então rodar de novo é seguro.
+3. Move para email_bodies os corpos que ainda estão nas colunas body de received_emails
+   e outgoing_emails (bancos anteriores à migração 007), em lotes, e remove as colunas.
+   Um lote interrompido é retomado na próxima execução.
+
+Cada comando roda em autocommit, como no psql: alguns scripts usam
+ALTER TYPE ... ADD VALUE, cujo valor novo não pode ser usado na mesma transação.
+"""
+import argparse
+import logging
+from pathlib import Path
+
+from sqlalchemy import Engine, inspect, text
+
+from app import body_store, models
+from app.database import get_engine
+from app.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "sql" / "migrations"
+BODY_BATCH_SIZE = 1000
+
+
+def split_statements(script: str) -> list[str]:
+    """
+    Separa um script SQL nos seus comandos (por ';'), respeitando strings, identificadores
+    entre aspas, comentários e blocos $$ ... $$ (DO e funções).
+    """
+    statements, current = [], []
+    i, length = 0, len(script)
+    quote: str | None = None  # "'", '"' ou o delimitador $tag$ aberto
+    while i < length:
+        char = script[i]
+        if quote is not None:
+            if script.startswith(quote, i):
+                current.append(quote)
+                i += len(quote)
+                quote = None
+            else:
+                current.append(char)
+                i += 1
+            continue
+        if script.startswith("--", i):
+            end = script.find("\n", i)
+            i = length if end == -1 else end
+            continue
+        if char in ("'", '"'):
+            quote = char
+        elif char == "$":
+            end = script.find("$", i + 1)
+            tag = script[i:end + 1] if end != -1 else ""
+            if tag and (tag == "$$" or tag[1:-1].isidentifier()):
+                quote = tag
+                current.append(tag)
+                i = end + 1
+                continue
+        elif char == ";":
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            i += 1
+            continue
+        current.append(char)
+        i += 1
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def migration_files(directory: Path = MIGRATIONS_DIR) -> list[Path]:
+    return sorted(directory.glob("*.sql"))
+
+
+def apply_migrations(engine: Engine, files: list[Path]):
+    # Cursor do driver, sem parâmetros: o SQL vai como está (ex.: os %I/%L de format())
+    connection = engine.raw_connection()
+    try:
+        connection.driver_connection.autocommit = True
+        cursor = connection.cursor()
+        for path in files:
+            logger.info("Aplicando %s", path.name)
+            for statement in split_statements(path.read_text(encoding="utf-8")):
+                cursor.execute(statement)
+        cursor.close()
+    finally:
+        connection.driver_connection.autocommit = False
+        connection.close()
+
+
+def move_bodies_to_store(engine: Engine, batch_size: int = BODY_BATCH_SIZE) -> int:
+    """
+    Copia para email_bodies (comprimidos, um por conteúdo) os corpos das colunas body
+    antigas, preenche body_hash e remove as colunas. Retorna as linhas atualizadas.
+    """
+    moved = 0
+    for table in ("received_emails", "outgoing_emails"):
+        if "body" not in {column["name"] for column in inspect(engine).get_columns(table)}:
+            continue
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(f"SELECT id, body FROM {table} WHERE id > :last_id AND body_hash IS NULL "
+                         f"AND body IS NOT NULL ORDER BY id LIMIT :limit"),
+                    {"last_id": last_id, "limit": batch_size},
+                ).all()
+                if not rows:
+                    break
+                models.insert_email_bodies(conn, [body for _, body in rows])
+                conn.execute(
+                    text(f"UPDATE {table} AS t SET body_hash = v.hash "
+                         f"FROM unnest(CAST(:ids AS integer[]), CAST(:hashes AS varchar[])) AS v(id, hash) "
+                         f"WHERE t.id = v.id"),
+                    {"ids": [row_id for row_id, _ in rows],
+                     "hashes": [body_store.content_hash(body) for _, body in rows]},
+                )
+            moved += len(rows)
+            last_id = rows[-1][0]
+            logger.info("%s: %d corpo(s) movido(s) para email_bodies.", table, moved)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN body"))
+        logger.info("Coluna %s.body removida.", table)
+    return moved
+
+
+def migrate(engine: Engine | None = None, files: list[Path] | None = None):
+    """
+    Cria as tabelas que faltam, aplica as migrações (padrão: todas de sql/migrations/) e
+    move os corpos antigos para email_bodies.
+    """
+    engine = engine or get_engine()
+    models.Base.metadata.create_all(bind=engine)
+    if engine.dialect.name != "postgresql":
+        # Os scripts usam recursos do Postgres; em outros bancos só o create_all se aplica
+        return
+    apply_migrations(engine, migration_files() if files is None else files)
+    move_bodies_to_store(engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria e atualiza o schema do banco de dados.")
+    parser.parse_args()
+    configure_logging()
+    migrate()
+    logger.info("Schema atualizado.")
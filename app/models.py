@@ -1,14 +1,21 @@
 import enum
-from sqlalchemy import (Column, Integer, String, Text, Boolean, DateTime,
-                        LargeBinary, ForeignKey, Enum)
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+from sqlalchemy import (DDL, Column, Integer, String, Text, Boolean, DateTime,
+                        LargeBinary, ForeignKey, Enum, Index, PrimaryKeyConstraint, event, inspect,
+                        literal_column, select)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import column_property, declared_attr, deferred, relationship
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.sql import func
+from app import body_store
 from app.database import Base
 
 
 class EmailStatusEnum(enum.Enum):
     draft = 'draft'
     queued = 'queued'
+    sending = 'sending'  # Reservado por um worker da fila de envio (ver lease_expires_at)
     sent = 'sent'
     failed = 'failed'
 
@@ -23,38 +30,206 @@ class Account(Base):
     password_hash = Column(String(255), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     forward_url = Column(String(2048), nullable=True) # URL para encaminhar resumos
+    gmail_history_id = Column(String(32), nullable=True) # Watermark da sincronização incremental
+    retention_days = Column(Integer, nullable=True) # Dias até arquivar os e-mails recebidos (vazio: padrão das settings, 0: nunca)
 
     received_emails = relationship("ReceivedEmail", back_populates="account", cascade="all, delete-orphan")
     outgoing_emails = relationship("OutgoingEmail", back_populates="account", cascade="all, delete-orphan")
+    processing_jobs = relationship("ProcessingJob", back_populates="account", cascade="all, delete-orphan")
+    message_attempts = relationship("MessageAttempt", cascade="all, delete-orphan")
 
 
-class ReceivedEmail(Base):
+# --- Corpos de e-mail (ver app/body_store.py) ---
+class EmailBody(Base):
+    __tablename__ = "email_bodies"
+
+    content_hash = Column(String(64), primary_key=True) # SHA-256 do texto em UTF-8
+    data = Column(LargeBinary, nullable=False) # Texto comprimido com zlib
+    size = Column(Integer, nullable=False) # Tamanho do texto original, em bytes
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    @property
+    def text(self) -> str:
+        return body_store.decompress(self.data)
+
+
+def insert_email_bodies(connection, texts) -> None:
+    """
+    Grava em email_bodies os corpos que ainda não existem (ON CONFLICT DO NOTHING).
+    As linhas vão em ordem de hash: duas transações gravando corpos em comum não se
+    bloqueiam em ordens opostas.
+    """
+    rows = {row["content_hash"]: row for row in map(body_store.body_row, texts)}
+    if not rows:
+        return
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(EmailBody).on_conflict_do_nothing(index_elements=[EmailBody.content_hash])
+    connection.execute(stmt, [rows[key] for key in sorted(rows)])
+
+
+class EmailBodyMixin:
+    """
+    body_hash referencia o corpo em email_bodies. O corpo comprimido (body_data) só é
+    lido do banco quando pedido (options(undefer(Model.body_data))), na mesma consulta do
+    e-mail; sem isso, ler `body` de um objeto carregado do banco levanta erro em vez de
+    fazer uma consulta escondida. Objetos criados com body=... gravam o corpo no flush
+    (ver _store_email_body).
+    """
+
+    @declared_attr
+    def body_hash(cls):
+        return Column(String(64), ForeignKey("email_bodies.content_hash"), nullable=True, index=True)
+
+    @declared_attr
+    def body_data(cls):
+        # Só os bytes, sem um objeto EmailBody por e-mail na listagem. Não expira no flush:
+        # um corpo novo só entra pelo setter de `body`, que atualiza _body_cache
+        return column_property(
+            select(EmailBody.data).where(EmailBody.content_hash == cls.body_hash).scalar_subquery(),
+            deferred=True, raiseload=True, expire_on_flush=False,
+        )
+
+    @property
+    def body(self) -> str | None:
+        cached = self.__dict__.get("_body_cache")
+        if cached is not None and cached[0] == self.body_hash:
+            return cached[1]
+        if self.body_hash is None:
+            return None
+        text = body_store.decompress(self.body_data)
+        self._body_cache = (self.body_hash, text)
+        return text
+
+    @body.setter
+    def body(self, value: str | None):
+        self.body_hash = None if value is None else body_store.content_hash(value)
+        self._body_cache = (self.body_hash, value)
+
+
+# --- Busca textual em received_emails (Postgres) ---
+# tsvector do assunto (peso A) e do corpo (peso B) com um GIN composto com account_id
+# (extensão btree_gin), para que a busca de um agente seja resolvida só pelo índice.
+# O corpo fica comprimido em email_bodies, então o vetor é calculado na gravação
+# (search_vector_expression). Os testes em SQLite usam uma tabela FTS5. Ver sql/DDL.sql.
+SEARCH_TEXT_CONFIG = "portuguese"
+
+def search_vector_expression(subject: str | None, body: str | None):
+    config = literal_column(f"'{SEARCH_TEXT_CONFIG}'::regconfig")
+    return func.setweight(func.to_tsvector(config, subject or ""), literal_column("'A'")).op("||")(
+        func.setweight(func.to_tsvector(config, body or ""), literal_column("'B'"))
+    )
+
+
+class ReceivedEmail(EmailBodyMixin, Base):
     __tablename__ = "received_emails"
-    id = Column(Integer, primary_key=True, index=True)
-    gmail_message_id = Column(String(255), unique=True, index=True)
+    # No Postgres a tabela é particionada por mês em received_at (sql/migrations/006), e a
+    # chave primária precisa incluir a chave de partição: (id, received_at). O id continua
+    # único (SERIAL) e é por ele que os resumos e a API referenciam o e-mail.
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    gmail_message_id = Column(String(255), index=True)
     account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
     sender = Column(String(255), nullable=False)
     subject = Column(Text)
-    body = Column(Text)
-    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Faz parte da identidade do objeto na sessão: o valor padrão é gerado na aplicação para
+    # não depender do RETURNING (o app sempre informa o internalDate do Gmail)
+    received_at = Column(DateTime(timezone=True), primary_key=True,
+                         default=lambda: datetime.now(timezone.utc), server_default=func.now()) # Chave de partição
     is_read = Column(Boolean, server_default='False')
+    # Só o Postgres preenche; deferred: nunca vem nas consultas da entidade
+    search_vector = deferred(Column(postgresql.TSVECTOR().with_variant(Text(), "sqlite")))
     account = relationship("Account", back_populates="received_emails")
-    summaries = relationship("EmailSummary", back_populates="received_email", cascade="all, delete-orphan")
+    summaries = relationship(
+        "EmailSummary", back_populates="received_email", cascade="all, delete-orphan",
+        primaryjoin="ReceivedEmail.id == foreign(EmailSummary.received_email_id)",
+    )
+
+    __table_args__ = (
+        # Toda restrição única precisa incluir a chave de partição. received_at vem do
+        # internalDate do Gmail, então continua valendo um registro por mensagem.
+        Index("uq_received_emails_gmail_message", "gmail_message_id", "received_at", unique=True),
+        # Listagem paginada por cursor (received_at, id), com e sem filtro de remetente
+        Index("idx_received_emails_account_received", "account_id", "received_at", "id"),
+        Index("idx_received_emails_account_sender", "account_id", "sender", "received_at", "id"),
+    )
+
+
+for _statement in (
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    "CREATE INDEX idx_received_emails_search ON received_emails USING GIN (account_id, search_vector)",
+):
+    event.listen(ReceivedEmail.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+
+
+# O SQLite (testes e benchmarks) só gera ids para uma chave primária INTEGER de uma única
+# coluna (o rowid). Lá, uma chave composta com um id autoincremento vira só (id), que já é único.
+def _sqlite_composite_autoincrement(table) -> bool:
+    return len(table.primary_key.columns) > 1 and table.autoincrement_column is not None
 
+@compiles(CreateColumn, "sqlite")
+def _sqlite_create_column(create, compiler, **kw):
+    column = create.element
+    if column.table is not None and column is column.table.autoincrement_column \
+            and _sqlite_composite_autoincrement(column.table):
+        return f"{compiler.preparer.format_column(column)} INTEGER NOT NULL"
+    return compiler.visit_create_column(create, **kw)
 
-class OutgoingEmail(Base):
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _sqlite_primary_key(constraint, compiler, **kw):
+    if _sqlite_composite_autoincrement(constraint.table):
+        return f"PRIMARY KEY ({compiler.preparer.format_column(constraint.table.autoincrement_column)})"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+class OutgoingEmail(EmailBodyMixin, Base):
     __tablename__ = "outgoing_emails"
     id = Column(Integer, primary_key=True, index=True)
     account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
     recipient = Column(String(255), nullable=False)
     subject = Column(Text)
-    body = Column(Text)
-    status = Column(Enum(EmailStatusEnum), nullable=False, default=EmailStatusEnum.draft)
+    status = Column(Enum(EmailStatusEnum, name="email_status"), nullable=False, default=EmailStatusEnum.draft)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     sent_at = Column(DateTime(timezone=True), nullable=True)
     error_message = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0') # Tentativas de envio já feitas
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True) # Após um erro temporário, só reenvia a partir daqui
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True) # Fim da reserva de um e-mail 'sending'
     account = relationship("Account", back_populates="outgoing_emails")
 
+    __table_args__ = (
+        # Índice parcial usado pelos workers para reservar a fila em ordem de chegada
+        Index("idx_outgoing_emails_queued", "created_at", "id",
+              postgresql_where=(status == EmailStatusEnum.queued)),
+        # Reservas vencidas de workers que caíram no meio do envio
+        Index("idx_outgoing_emails_sending", "lease_expires_at",
+              postgresql_where=(status == EmailStatusEnum.sending)),
+        # Listagem paginada por cursor (created_at, id), com e sem filtro de status
+        Index("idx_outgoing_emails_account_created", "account_id", "created_at", "id"),
+        Index("idx_outgoing_emails_account_status", "account_id", "status", "created_at", "id"),
+    )
+
+
+def _store_email_body(mapper, connection, target):
+    """Grava em email_bodies o corpo atribuído com body=... antes do INSERT/UPDATE do e-mail."""
+    cached = target.__dict__.get("_body_cache")
+    if cached is None or cached[1] is None or cached[0] != target.body_hash:
+        return
+    if inspect(target).attrs.body_hash.history.has_changes():
+        insert_email_bodies(connection, [cached[1]])
+
+def _set_search_vector(mapper, connection, target):
+    if connection.dialect.name == "postgresql":
+        target.search_vector = search_vector_expression(target.subject, target.body)
+
+def _update_search_vector(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.subject.history.has_changes() or attrs.body_hash.history.has_changes():
+        _set_search_vector(mapper, connection, target)
+
+event.listen(EmailBodyMixin, "before_insert", _store_email_body, propagate=True)
+event.listen(EmailBodyMixin, "before_update", _store_email_body, propagate=True)
+event.listen(ReceivedEmail, "before_insert", _set_search_vector)
+event.listen(ReceivedEmail, "before_update", _update_search_vector)
+
 
 class ForwardStatusEnum(enum.Enum):
     pending = 'pending'
@@ -66,11 +241,105 @@ class EmailSummary(Base):
     __tablename__ = "email_summaries"
 
     id = Column(Integer, primary_key=True, index=True)
-    received_email_id = Column(Integer, ForeignKey("received_emails.id"), nullable=False, index=True)
+    # Sem chave estrangeira: received_emails é particionada e sua chave é (id, received_at)
+    # (sql/migrations/006). O arquivador apaga os resumos junto com os e-mails.
+    received_email_id = Column(Integer, nullable=False)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False) # Cópia de received_emails.account_id para a listagem
     summary_text = Column(Text, nullable=False)
     forward_url = Column(String(2048), nullable=False)
-    forward_status = Column(Enum(ForwardStatusEnum), nullable=False, default=ForwardStatusEnum.pending)
+    forward_status = Column(Enum(ForwardStatusEnum, name="forward_status"), nullable=False, default=ForwardStatusEnum.pending)
     status_message = Column(Text, nullable=True) # To store potential error messages
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    received_email = relationship("ReceivedEmail", back_populates="summaries")
\ No newline at end of file
+    received_email = relationship(
+        "ReceivedEmail", back_populates="summaries",
+        primaryjoin="foreign(EmailSummary.received_email_id) == ReceivedEmail.id",
+    )
+
+    __table_args__ = (
+        # Um resumo por e-mail, mesmo com vários processos resumindo ao mesmo tempo
+        Index("uq_email_summaries_received_email", "received_email_id", unique=True),
+        # Listagem paginada por cursor (created_at, id), com e sem filtro de status
+        Index("idx_email_summaries_account_created", "account_id", "created_at", "id"),
+        Index("idx_email_summaries_account_status", "account_id", "forward_status", "created_at", "id"),
+    )
+
+
+class MessageAttempt(Base):
+    """
+    Mensagem do Gmail que falhou no pipeline. O watermark da conta avança mesmo assim, e a
+    mensagem é tentada de novo nas próximas execuções até settings.GMAIL_MESSAGE_MAX_ATTEMPTS.
+    """
+    __tablename__ = "gmail_message_attempts"
+
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    gmail_message_id = Column(String(255), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=1)
+    last_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class AIReplyCache(Base):
+    __tablename__ = "ai_reply_cache"
+
+    cache_key = Column(String(64), primary_key=True) # SHA-256 do conteúdo normalizado
+    model_name = Column(String(100), nullable=False)
+    prompt_version = Column(String(20), nullable=False)
+    reply_text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class JobStatusEnum(enum.Enum):
+    queued = 'queued'
+    running = 'running'
+    completed = 'completed'
+    failed = 'failed'
+    cancelled = 'cancelled'
+
+
+class MessageOutcomeEnum(enum.Enum):
+    replied = 'replied'
+    no_reply = 'no_reply'  # Processada e marcada como lida, mas sem resposta da IA
+    failed = 'failed'  # Continua não lida e será tentada novamente
+
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False, index=True)
+    status = Column(Enum(JobStatusEnum, name="processing_job_status"), nullable=False, default=JobStatusEnum.queued)
+    total_messages = Column(Integer, nullable=False, default=0)
+    processed_messages = Column(Integer, nullable=False, default=0)
+    replied_messages = Column(Integer, nullable=False, default=0)
+    failed_messages = Column(Integer, nullable=False, default=0)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True) # Atualizado enquanto o job roda
+
+    account = relationship("Account", back_populates="processing_jobs")
+    messages = relationship("ProcessingJobMessage", back_populates="job", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # No máximo um job ativo por conta, mesmo com pedidos simultâneos
+        Index("uq_processing_jobs_active_account", "account_id", unique=True,
+              postgresql_where=status.in_([JobStatusEnum.queued, JobStatusEnum.running]),
+              sqlite_where=status.in_([JobStatusEnum.queued, JobStatusEnum.running])),
+    )
+
+
+class ProcessingJobMessage(Base):
+    __tablename__ = "processing_job_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("processing_jobs.id"), nullable=False, index=True)
+    gmail_message_id = Column(String(255), nullable=False)
+    outcome = Column(Enum(MessageOutcomeEnum, name="processing_message_outcome"), nullable=False)
+    error_message = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True) # Quando a mensagem foi buscada
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+
+    job = relationship("ProcessingJob", back_populates="messages")
@@ -0,0 +1,107 @@
+"""
+Hashing de senhas com Argon2, executado em um pool de processos limitado.
+
+Cada hash custa dezenas de milissegundos de CPU e dezenas de MiB de memória de
+propósito. Rodar isso no event loop (ou em threads, que disputam o GIL nas partes em
+Python) faz uma rajada de logins parar a API. O pool usa um processo por núcleo e
+recusa pedidos além de settings.PASSWORD_HASH_MAX_PENDING, para que o excesso receba
+503 rapidamente em vez de acumular latência.
+
+Este módulo depende apenas de app.config, para que os processos do pool iniciem rápido.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+
+from app.config import settings
+
+
+def build_password_hasher() -> PasswordHasher:
+    """PasswordHasher com os custos do Argon2 definidos em Settings."""
+    return PasswordHasher(
+        time_cost=settings.ARGON2_TIME_COST,
+        memory_cost=settings.ARGON2_MEMORY_COST,
+        parallelism=settings.ARGON2_PARALLELISM,
+        hash_len=settings.ARGON2_HASH_LEN,
+        salt_len=settings.ARGON2_SALT_LEN,
+    )
+
+ph = build_password_hasher()
+
+def hash_password(password: str) -> str:
+    return ph.hash(password)
+
+def verify_password(hashed_password: str, password: str) -> bool:
+    try:
+        ph.verify(hashed_password, password)
+        return True
+    except VerifyMismatchError:
+        return False
+    except Exception:
+        return False
+
+def verify_and_rehash(hashed_password: str, password: str) -> tuple[bool, str | None]:
+    """
+    Verifica a senha e, se o hash salvo foi gerado com outros parâmetros do Argon2,
+    devolve também um hash novo com os parâmetros atuais (a senha em texto só existe
+    neste momento). Retorna (senha_correta, novo_hash_ou_None).
+    """
+    if not verify_password(hashed_password, password):
+        return False, None
+    if ph.check_needs_rehash(hashed_password):
+        return True, ph.hash(password)
+    return True, None
+
+
+class PasswordHashingBusyError(Exception):
+    """O pool de hashing está com a fila cheia; o cliente deve tentar novamente depois."""
+
+
+class PasswordHashingPool:
+    """
+    Executa as funções deste módulo em um ProcessPoolExecutor criado sob demanda.
+    No máximo `max_pending` pedidos ficam em execução ou na fila ao mesmo tempo.
+    """
+
+    def __init__(self, workers: int | None = None, max_pending: int | None = None):
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+        self.max_pending = max(1, max_pending or settings.PASSWORD_HASH_MAX_PENDING)
+        self.pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn": os processos não herdam threads nem conexões abertas do processo da API
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHashingBusyError(
+                f"Há {self.pending} operações de senha pendentes; tente novamente em instantes."
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password)
+
+    async def verify_and_rehash(self, hashed_password: str, password: str) -> tuple[bool, str | None]:
+        return await self._submit(verify_and_rehash, hashed_password, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_hashing_pool = PasswordHashingPool()
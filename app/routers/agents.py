@@ -1,78 +1,209 @@
 # Em routers/agents.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
-from app import crud, schemas, security
-from app.database import get_db
-from app.services.email_service import process_and_reply_to_emails, send_new_email
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud_async, models, schemas, security
+from app.config import settings
+from app.database import get_async_db
+from app.password_hashing import PasswordHashingBusyError, password_hashing_pool
+from app.services.email_service import process_and_reply_to_emails
+from app.services.job_runner import job_runner
 
 router = APIRouter(
     prefix="/agents",
     tags=["Agents"]
 )
 
-# --- Endpoint de registro (sem alterações) ---
+def _password_hashing_busy(error: PasswordHashingBusyError) -> HTTPException:
+    """Resposta para quando o pool de hashing de senhas está saturado."""
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(error),
+                         headers={"Retry-After": "1"})
+
+
+# --- Endpoint de registro ---
 @router.post("/register", response_model=schemas.AgentResponse, status_code=status.HTTP_201_CREATED)
-def register_agent(agent: schemas.AgentCreate, db: Session = Depends(get_db)):
-    # ... (código original sem alterações)
-    db_agent = crud.get_agent_by_email(db, email=agent.email)
+async def register_agent(agent: schemas.AgentCreate, db: AsyncSession = Depends(get_async_db)):
+    db_agent = await crud_async.get_agent_by_email(db, email=agent.email)
     if db_agent:
         raise HTTPException(status_code=400, detail="E-mail já registrado.")
-    return crud.create_agent(db=db, agent=agent)
+    try:
+        return await crud_async.create_agent(db=db, agent=agent)
+    except PasswordHashingBusyError as e:
+        raise _password_hashing_busy(e)
 
 
-# --- Endpoint de login (sem alterações) ---
+# --- Endpoint de login ---
 @router.post("/login")
-def login_agent(agent_data: schemas.AgentLogin, db: Session = Depends(get_db)):
-    # ... (código original sem alterações)
-    db_agent = crud.get_agent_by_email(db, email=agent_data.email)
-    if not db_agent or not security.verify_password(db_agent.password_hash, agent_data.password):
+async def login_agent(agent_data: schemas.AgentLogin, db: AsyncSession = Depends(get_async_db)):
+    db_agent = await crud_async.get_agent_by_email(db, email=agent_data.email)
+    valid, new_hash = False, None
+    if db_agent:
+        try:
+            valid, new_hash = await password_hashing_pool.verify_and_rehash(
+                db_agent.password_hash, agent_data.password
+            )
+        except PasswordHashingBusyError as e:
+            raise _password_hashing_busy(e)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="E-mail ou senha incorretos",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Os parâmetros do Argon2 mudaram desde o último login: salva o hash refeito
+    if new_hash:
+        await crud_async.update_agent_password_hash(db, db_agent, new_hash)
     return {"message": f"Login bem-sucedido para o agente {db_agent.email}!"}
 
 
-# 2. --- ALTERADO: Endpoint de processamento de e-mails ---
-@router.post("/{agent_id}/process-emails") # Removido o response_model obsoleto
-async def trigger_email_processing(agent_id: int, db: Session = Depends(get_db)):
+# 2. --- Endpoints de processamento de e-mails (jobs assíncronos) ---
+@router.post("/{agent_id}/process-emails", response_model=schemas.ProcessingJob,
+             status_code=status.HTTP_202_ACCEPTED)
+async def trigger_email_processing(agent_id: int, response: Response, db: AsyncSession = Depends(get_async_db)):
     """
-    Inicia o processo de leitura de e-mails não lidos, geração de resposta com IA e envio.
+    Enfileira o processamento dos e-mails não lidos do agente (leitura, resposta com IA
+    e envio) e responde na hora com o job criado. O andamento é consultado em
+    GET /agents/{agent_id}/jobs/{job_id}. Se o agente já tem um job na fila ou em
+    execução, esse job é devolvido em vez de criar outro.
     """
-    agent = crud.get_agent_by_id(db, agent_id=agent_id)
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agente não encontrado.")
+    if not agent.encrypted_credentials:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail=f"O agente '{agent.email}' não autorizou o acesso ao Gmail.")
+
+    job = await crud_async.get_active_processing_job(db, agent.id)
+    if job is None:
+        try:
+            job = await crud_async.create_processing_job(db, agent.id)
+        except IntegrityError:
+            # Outro pedido criou o job ativo ao mesmo tempo
+            await db.rollback()
+            job = await crud_async.get_active_processing_job(db, agent.id)
+        else:
+            job_runner.submit(job.id)
+
+    response.headers["Location"] = f"/agents/{agent_id}/jobs/{job.id}"
+    return job
+
+
+async def _get_job_or_404(db: AsyncSession, agent_id: int, job_id: int):
+    job = await crud_async.get_processing_job(db, agent_id=agent_id, job_id=job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return job
+
+
+@router.get("/{agent_id}/jobs/{job_id}", response_model=schemas.ProcessingJob, summary="Status de um job")
+async def get_processing_job(agent_id: int, job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Status, contadores de progresso e tempos de um job de processamento."""
+    return await _get_job_or_404(db, agent_id, job_id)
+
+
+@router.get("/{agent_id}/jobs/{job_id}/messages", response_model=schemas.ProcessingJobMessagePage,
+            summary="Resultado de cada mensagem de um job")
+async def list_processing_job_messages(
+    agent_id: int,
+    job_id: int,
+    after_id: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=100, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Resultados por mensagem, em ordem de conclusão. Use next_after_id para a próxima página."""
+    await _get_job_or_404(db, agent_id, job_id)
+    items = await crud_async.list_processing_job_messages(db, job_id, after_id=after_id, limit=limit)
+    return {"items": items, "next_after_id": items[-1].id if len(items) == limit else None}
+
 
+@router.post("/{agent_id}/jobs/{job_id}/cancel", response_model=schemas.ProcessingJob,
+             status_code=status.HTTP_202_ACCEPTED, summary="Cancelar um job")
+async def cancel_processing_job(agent_id: int, job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Pede o cancelamento do job. Um job na fila é cancelado na hora; um job em execução
+    é interrompido na próxima gravação de progresso (a cada settings.JOB_PROGRESS_INTERVAL segundos).
+    """
+    job = await _get_job_or_404(db, agent_id, job_id)
+    return await crud_async.request_processing_job_cancel(db, job)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _processing_events(db: AsyncSession, agent_id: int):
+    """
+    Executa o pipeline em uma tarefa e repassa cada evento de progresso como SSE.
+    Enquanto não há eventos, envia comentários keep-alive. Se o cliente desconectar,
+    a execução é cancelada: o que não foi marcado como lido fica para a próxima.
+    """
+    queue: asyncio.Queue[dict | None] = asyncio.Queue()
+
+    async def _run():
+        try:
+            # A sessão da dependência já foi encerrada quando o stream começa: recarrega o agente
+            agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
+            replied = await process_and_reply_to_emails(
+                db=db, agent=agent, on_event=queue.put_nowait, stream_replies=True
+            )
+            queue.put_nowait({"event": "completed", "replied": replied})
+        except ConnectionError as e:
+            queue.put_nowait({"event": "error", "detail": f"Erro de conexão com o serviço do Google: {e}"})
+        except Exception as e:
+            queue.put_nowait({"event": "error", "detail": f"Ocorreu um erro inesperado: {e}"})
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(_run())
     try:
-        # Chama a nova função refatorada
-        processed_count = await process_and_reply_to_emails(db=db, agent=agent)
-        
-        # Retorna uma resposta simples e direta
-        return {
-            "message": f"Processamento concluído. {processed_count} e-mails foram processados e respondidos."
-        }
-    except ConnectionError as e:
-        if "não autorizou o acesso" in str(e) or "Credenciais inválidas" in str(e):
-             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Erro de conexão com o serviço do Google: {e}")
-    except Exception as e:
-        # Um bloco de captura genérico para outros erros inesperados
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Ocorreu um erro inesperado: {str(e)}")
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.PROCESSING_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield _sse(event.pop("event"), event)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await db.close()
+
+
+@router.post("/{agent_id}/process-emails/stream", summary="Processar e-mails com progresso em tempo real (SSE)")
+async def stream_email_processing(agent_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Mesmo processamento de /process-emails, executado durante a requisição (sem job),
+    respondendo imediatamente com um stream
+    text/event-stream: um evento por etapa de cada mensagem (listed, fetched, generating,
+    generated, sent, failed, marked_read) e, ao final, completed ou error.
+    """
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agente não encontrado.")
+
+    return StreamingResponse(
+        _processing_events(db, agent_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # --- Endpoints de autorização OAuth2 (sem alterações) ---
 @router.get("/{agent_id}/authorize/google", summary="Gerar URL de autorização do Google")
-def authorize_google_for_agent(agent_id: int, db: Session = Depends(get_db)) -> dict:
-    # ... (código original sem alterações)
-    agent = crud.get_agent_by_id(db, agent_id=agent_id)
+async def authorize_google_for_agent(agent_id: int, db: AsyncSession = Depends(get_async_db)) -> dict:
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agente não encontrado.")
 
     try:
-        flow = security.create_google_auth_flow()
+        flow = await asyncio.to_thread(security.create_google_auth_flow)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Falha ao criar o fluxo de autorização do Google: {e}")
@@ -87,8 +218,7 @@ def authorize_google_for_agent(agent_id: int, db: Session = Depends(get_db)) ->
 
 
 @router.get("/auth/google/callback", summary="Callback da autorização do Google", response_class=HTMLResponse)
-def google_auth_callback(request: Request, db: Session = Depends(get_db)) -> str:
-    # ... (código original sem alterações)
+async def google_auth_callback(request: Request, db: AsyncSession = Depends(get_async_db)) -> str:
     code = request.query_params.get('code')
     state = request.query_params.get('state')
     error = request.query_params.get('error')
@@ -101,14 +231,15 @@ def google_auth_callback(request: Request, db: Session = Depends(get_db)) -> str
         raise HTTPException(status_code=400, detail="Parâmetros 'code' ou 'state' ausentes no callback.")
 
     agent_id = int(state)
-    agent = crud.get_agent_by_id(db, agent_id=agent_id)
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agente com ID {agent_id} não encontrado.")
 
-    flow = security.create_google_auth_flow()
-    flow.fetch_token(code=code)
-    
-    crud.update_agent_credentials(db, agent=agent, creds=flow.credentials)
+    # Leitura do client secret e troca do código pelo token são bloqueantes
+    flow = await asyncio.to_thread(security.create_google_auth_flow)
+    await asyncio.to_thread(flow.fetch_token, code=code)
+
+    await crud_async.update_agent_credentials(db, agent=agent, creds=flow.credentials)
     
     html_content = f"""
     <html>
@@ -122,24 +253,96 @@ def google_auth_callback(request: Request, db: Session = Depends(get_db)) -> str
 
 
 @router.post("/{agent_id}/emails/send", status_code=status.HTTP_202_ACCEPTED, summary="Enviar um e-mail simples")
-def send_simple_email(agent_id: int, email_data: schemas.SendEmailRequest, db: Session = Depends(get_db)):
+async def send_simple_email(agent_id: int, email_data: schemas.SendEmailRequest, db: AsyncSession = Depends(get_async_db)):
     """
-    Envia um novo e-mail a partir da conta do agente para um destinatário específico.
+    Coloca um novo e-mail na fila de envio do agente. O envio pelo Gmail é feito
+    pelos workers da fila (app/services/outbox_worker.py), fora da requisição.
     """
-    agent = crud.get_agent_by_id(db, agent_id=agent_id)
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agente não encontrado.")
-    
+    if not agent.encrypted_credentials:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail=f"O agente '{agent.email}' não autorizou o acesso ao Gmail.")
+
+    db_email = await crud_async.create_outgoing_email(db, agent_id=agent.id, email_data=email_data)
+    return {
+        "message": f"E-mail para {email_data.receiver} foi enviado para a fila de envio.",
+        "email_id": db_email.id,
+    }
+
+
+# --- Listagens paginadas por cursor ---
+async def _get_agent_or_404(db: AsyncSession, agent_id: int):
+    agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agente não encontrado.")
+    return agent
+
+
+async def _page(list_function, db: AsyncSession, agent_id: int, **filters) -> dict:
+    """Executa uma listagem de crud_async e monta a página; cursor inválido vira 400."""
+    agent = await _get_agent_or_404(db, agent_id)
     try:
-        service = security.get_agent_gmail_service(agent=agent, db=db)
-        send_new_email(
-            service=service,
-            to=email_data.receiver,
-            subject=email_data.subject,
-            body_text=email_data.body
-        )
-        return {"message": f"E-mail para {email_data.receiver} foi enviado para a fila de envio."}
-    except ConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Ocorreu um erro inesperado: {str(e)}")
\ No newline at end of file
+        items, next_cursor = await list_function(db, agent.id, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/{agent_id}/emails/received", response_model=schemas.ReceivedEmailPage,
+            summary="Listar e-mails recebidos")
+async def list_received_emails(
+    agent_id: int,
+    sender: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """E-mails recebidos do mais recente para o mais antigo. Use next_cursor para a próxima página."""
+    return await _page(crud_async.list_received_emails, db, agent_id, sender=sender, cursor=cursor, limit=limit)
+
+
+@router.get("/{agent_id}/emails/outgoing", response_model=schemas.OutgoingEmailPage,
+            summary="Listar e-mails enviados e na fila de envio")
+async def list_outgoing_emails(
+    agent_id: int,
+    status: models.EmailStatusEnum | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """E-mails de saída do mais recente para o mais antigo, opcionalmente filtrados por status."""
+    return await _page(crud_async.list_outgoing_emails, db, agent_id, status=status, cursor=cursor, limit=limit)
+
+
+@router.get("/{agent_id}/summaries", response_model=schemas.EmailSummaryPage, summary="Listar resumos de e-mails")
+async def list_email_summaries(
+    agent_id: int,
+    status: models.ForwardStatusEnum | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Resumos do mais recente para o mais antigo, opcionalmente filtrados pelo status do encaminhamento."""
+    return await _page(crud_async.list_email_summaries, db, agent_id, status=status, cursor=cursor, limit=limit)
+
+
+@router.get("/{agent_id}/emails/search", response_model=schemas.EmailSearchPage, summary="Buscar nos e-mails recebidos")
+async def search_received_emails(
+    agent_id: int,
+    q: str = Query(min_length=1, max_length=256, description="Termos buscados no assunto e no corpo"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Busca textual nos e-mails recebidos pelo agente, ordenada por relevância, com os
+    termos destacados no assunto e em um trecho do corpo. Use next_offset para a
+    próxima página (páginas profundas são limitadas para manter a busca rápida).
+    """
+    agent = await _get_agent_or_404(db, agent_id)
+
+    # Um resultado a mais indica se existe próxima página
+    rows = await crud_async.search_received_emails(db, agent.id, q, limit=limit + 1, offset=offset)
+    return {"items": rows[:limit], "next_offset": offset + limit if len(rows) > limit else None}
@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+
+from app.db_instrumentation import db_metrics
+
+router = APIRouter(
+    prefix="/db-metrics",
+    tags=["Database Metrics"]
+)
+
+
+@router.get("/stats", summary="Métricas agregadas de uso do banco por rota")
+def get_db_metrics() -> dict:
+    """
+    Quantidade de comandos, tempo no banco e espera por conexões do pool, somados desde
+    o início do processo, além dos comandos mais lentos e dos avisos de possível N+1.
+    """
+    return db_metrics.snapshot()
+
+
+@router.delete("/stats", summary="Zerar as métricas de banco")
+def reset_db_metrics() -> dict:
+    db_metrics.reset()
+    return {"message": "Métricas de banco zeradas."}
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Response
+
+from app.metrics import render_latest
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", summary="Métricas do pipeline no formato do Prometheus")
+def get_metrics() -> Response:
+    """
+    Histogramas de latência por etapa do pipeline e por chamada externa, contadores de
+    mensagens e de renovações de token e o tamanho das filas, todos por agente.
+    """
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
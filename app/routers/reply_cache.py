@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+
+from app.services.reply_cache import reply_cache
+
+router = APIRouter(
+    prefix="/reply-cache",
+    tags=["Reply Cache"]
+)
+
+
+@router.get("/stats", summary="Contadores do cache de respostas da IA")
+def get_reply_cache_stats() -> dict:
+    return reply_cache.stats()
+
+
+@router.delete("", summary="Invalidar respostas em cache")
+async def invalidate_reply_cache(
+    key: str | None = None,
+    model_name: str | None = None,
+    prompt_version: str | None = None,
+) -> dict:
+    """
+    Remove do cache uma chave específica, as respostas de um modelo e/ou versão do
+    prompt, ou todas as respostas quando nenhum filtro é informado.
+    """
+    deleted = await reply_cache.invalidate(key=key, model_name=model_name, prompt_version=prompt_version)
+    return {"deleted": deleted}
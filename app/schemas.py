@@ -1,6 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr, ConfigDict, HttpUrl
-from app.models import ForwardStatusEnum
+from pydantic import BaseModel, EmailStr, ConfigDict, Field, HttpUrl, computed_field
+from app.models import EmailStatusEnum, ForwardStatusEnum, JobStatusEnum, MessageOutcomeEnum
 
 
 # --- Schema para a entrada de dados ---
@@ -12,6 +12,7 @@ class AgentCreate(AgentBase):
     password: str
     name: str
     forward_url: HttpUrl | None = None
+    retention_days: int | None = Field(default=None, ge=0) # Vazio: padrão do servidor; 0: nunca arquivar
 
 
 class AgentLogin(AgentBase):
@@ -29,6 +30,7 @@ class AgentResponse(AgentBase):
     id: int
     name: str
     forward_url: str | None = None
+    retention_days: int | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -53,6 +55,24 @@ class ReceivedEmail(ReceivedEmailBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ReceivedEmailPage(BaseModel):
+    items: list[ReceivedEmail]
+    next_cursor: str | None = None  # Passe como cursor para buscar a próxima página
+
+class EmailSearchResult(BaseModel):
+    id: int
+    gmail_message_id: str
+    sender: str
+    received_at: datetime | None = None
+    rank: float  # Maior é mais relevante
+    subject_highlight: str  # Assunto escapado para HTML, com os termos encontrados entre <mark></mark>
+    snippet: str  # Trecho do corpo em volta dos termos encontrados
+
+class EmailSearchPage(BaseModel):
+    items: list[EmailSearchResult]
+    next_offset: int | None = None  # Passe como offset para buscar a próxima página
+
+
 # --- Schemas para Resumo de E-mail ---
 
 class EmailSummaryBase(BaseModel):
@@ -71,6 +91,10 @@ class EmailSummary(EmailSummaryBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class EmailSummaryPage(BaseModel):
+    items: list[EmailSummary]
+    next_cursor: str | None = None
+
 class SummarizeAndForwardResponse(BaseModel):
     message: str
     processed_emails: int
@@ -93,3 +117,67 @@ class SendEmailRequest(BaseModel):
     receiver: EmailStr  # Valida automaticamente se o e-mail é válido
     subject: str
     body: str
+
+class OutgoingEmail(BaseModel):
+    id: int
+    recipient: str
+    subject: str | None = None
+    body: str | None = None
+    status: EmailStatusEnum
+    created_at: datetime
+    sent_at: datetime | None = None
+    error_message: str | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class OutgoingEmailPage(BaseModel):
+    items: list[OutgoingEmail]
+    next_cursor: str | None = None
+
+
+# --- Schemas para Jobs de Processamento ---
+
+def _duration_seconds(started_at: datetime | None, finished_at: datetime | None) -> float | None:
+    if started_at is None or finished_at is None:
+        return None
+    return (finished_at - started_at).total_seconds()
+
+class ProcessingJob(BaseModel):
+    id: int
+    account_id: int
+    status: JobStatusEnum
+    total_messages: int
+    processed_messages: int
+    replied_messages: int
+    failed_messages: int
+    cancel_requested: bool
+    error_message: str | None = None
+    created_at: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def duration_seconds(self) -> float | None:
+        return _duration_seconds(self.started_at, self.finished_at)
+
+class ProcessingJobMessage(BaseModel):
+    id: int
+    gmail_message_id: str
+    outcome: MessageOutcomeEnum
+    error_message: str | None = None
+    started_at: datetime | None = None
+    finished_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def duration_seconds(self) -> float | None:
+        return _duration_seconds(self.started_at, self.finished_at)
+
+class ProcessingJobMessagePage(BaseModel):
+    items: list[ProcessingJobMessage]
+    next_after_id: int | None = None  # Passe como after_id para buscar a próxima página
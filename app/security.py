@@ -1,48 +1,50 @@
+import asyncio
+import copy
 import json
-import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from sqlalchemy.orm import Session
+from typing import TYPE_CHECKING
 
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from cryptography.fernet import Fernet, InvalidToken
 
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from app.config import settings
-from app import models, crud
+if TYPE_CHECKING:
+    from google_auth_oauthlib.flow import Flow
 
-# --- SEÇÃO 1: HASHING DE SENHAS (Argon2) ---
-ph = PasswordHasher()
+from app.config import settings
+from app.database import SessionLocal
+from app import metrics, models
 
-def hash_password(password: str) -> str:
-    return ph.hash(password)
+logger = logging.getLogger(__name__)
 
-def verify_password(hashed_password: str, password: str) -> bool:
-    try:
-        ph.verify(hashed_password, password)
-        return True
-    except VerifyMismatchError:
-        return False
-    except Exception:
-        return False
+# --- SEÇÃO 1: HASHING DE SENHAS (Argon2) ---
+# Implementado em app/password_hashing.py, que os processos do pool de hashing importam
+# sem carregar o restante deste módulo. Nos endpoints, use password_hashing_pool.
+from app.password_hashing import hash_password, ph, verify_and_rehash, verify_password
 
 # --- SEÇÃO 2: CRIPTOGRAFIA DE DADOS (Fernet) ---
-ENCRYPTION_KEY_BYTES = settings.ENCRYPTION_KEY.encode('utf-8')
-fernet = Fernet(ENCRYPTION_KEY_BYTES)
+@lru_cache(maxsize=1)
+def _fernet() -> Fernet:
+    """Instância do Fernet, criada no primeiro uso (a chave vem do Settings)."""
+    return Fernet(settings.ENCRYPTION_KEY.encode('utf-8'))
 
 def encrypt_data(data: dict) -> bytes:
     json_string = json.dumps(data)
     data_bytes = json_string.encode('utf-8')
-    return fernet.encrypt(data_bytes)
+    return _fernet().encrypt(data_bytes)
 
 def decrypt_data(encrypted_data: bytes) -> dict:
     try:
-        decrypted_bytes = fernet.decrypt(encrypted_data)
+        decrypted_bytes = _fernet().decrypt(encrypted_data)
         json_string = decrypted_bytes.decode('utf-8')
         return json.loads(json_string)
     except InvalidToken:
@@ -51,64 +53,223 @@ def decrypt_data(encrypted_data: bytes) -> dict:
         raise ValueError(f"Erro ao descriptografar dados: {e}")
 
 # --- SEÇÃO 3: AUTENTICAÇÃO COM API DO GOOGLE (GMAIL) ---
-def create_google_auth_flow() -> Flow:
-    """Cria uma instância do fluxo de autorização do Google."""
-    credentials_path = Path(settings.GMAIL_CREDENTIALS_PATH).resolve()
+# google_auth_oauthlib e googleapiclient.discovery são importados dentro das funções que
+# os usam: são os módulos mais pesados da aplicação e não são necessários para subir a API.
+@lru_cache(maxsize=4)
+def _client_secrets_config(credentials_path: Path) -> dict:
+    """Conteúdo do credentials.json, lido do disco apenas uma vez por processo."""
     if not credentials_path.exists():
         raise FileNotFoundError(
             f"Arquivo de credenciais do Google não encontrado em: '{credentials_path}'."
         )
-    
-    flow = Flow.from_client_secrets_file(
-        client_secrets_file=credentials_path,
+    with open(credentials_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def create_google_auth_flow() -> "Flow":
+    """Cria uma instância do fluxo de autorização do Google."""
+    from google_auth_oauthlib.flow import Flow
+
+    credentials_path = Path(settings.GMAIL_CREDENTIALS_PATH).resolve()
+    # Cada fluxo recebe uma cópia: o Flow guarda estado próprio (ex.: code_verifier)
+    flow = Flow.from_client_config(
+        copy.deepcopy(_client_secrets_config(credentials_path)),
         scopes=settings.GMAIL_API_SCOPES.split(','),
         redirect_uri=settings.GOOGLE_REDIRECT_URI
     )
     return flow
 
-def get_agent_gmail_service(agent: models.Account, db: Session):
+def credentials_to_dict(creds: Credentials) -> dict:
+    """Converte as credenciais do Google no dicionário que é criptografado no banco."""
+    return {
+        'token': creds.token,
+        'refresh_token': creds.refresh_token,
+        'token_uri': creds.token_uri,
+        'client_id': creds.client_id,
+        'client_secret': creds.client_secret,
+        'scopes': creds.scopes,
+        # Guardar a expiração permite renovar o token antes que ele expire
+        'expiry': creds.expiry.isoformat() if creds.expiry else None,
+    }
+
+@lru_cache(maxsize=1)
+def _gmail_discovery_document() -> str:
+    """Documento de discovery da API do Gmail, lido do pacote apenas uma vez por processo."""
+    from googleapiclient.discovery_cache import get_static_doc
+
+    return get_static_doc("gmail", "v1")
+
+def get_agent_gmail_service(agent: models.Account):
     """
     Constrói um serviço da API do Gmail para um agente específico usando as
     credenciais criptografadas armazenadas no banco de dados.
-    Gerencia a renovação do token de acesso, se necessário.
+    As credenciais descriptografadas ficam em cache e são renovadas em segundo plano
+    antes de expirar (ver SEÇÃO 4); a renovação só acontece aqui como último recurso.
     """
     if not agent.encrypted_credentials:
         raise ConnectionError(f"O agente '{agent.email}' não autorizou o acesso ao Gmail.")
 
-    # Descriptografa as credenciais do banco
-    creds_dict = decrypt_data(agent.encrypted_credentials)
-    creds = Credentials.from_authorized_user_info(creds_dict, settings.GMAIL_API_SCOPES.split(','))
-
-    # Se as credenciais expiraram e um refresh_token existe, renova.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-                # CRUCIAL: Se o token foi renovado, salve as novas credenciais no banco
-                new_creds_dict = {
-                    'token': creds.token,
-                    'refresh_token': creds.refresh_token,
-                    'token_uri': creds.token_uri,
-                    'client_id': creds.client_id,
-                    'client_secret': creds.client_secret,
-                    'scopes': creds.scopes
-                }
-                agent.encrypted_credentials = encrypt_data(new_creds_dict)
-                db.commit()
-                db.refresh(agent)
-                print(f"Token para o agente {agent.email} foi renovado com sucesso.")
-            except Exception as e:
-                # Se a renovação falhar (ex: token revogado), limpe as credenciais
-                agent.encrypted_credentials = None
-                db.commit()
-                raise ConnectionError(f"Não foi possível renovar o token para o agente {agent.email}. Por favor, autorize novamente. Erro: {e}")
-        else:
-            # Não há credenciais válidas ou refresh_token
-            raise ConnectionError(f"Credenciais inválidas para o agente {agent.email}. Por favor, autorize o acesso.")
+    from googleapiclient.discovery import build_from_document
+
+    creds = _get_valid_credentials(agent)
 
     try:
-        service = build("gmail", "v1", credentials=creds)
+        service = build_from_document(_gmail_discovery_document(), credentials=creds)
         return service
     except HttpError as error:
-        print(f"Ocorreu um erro ao construir o serviço do Gmail: {error}")
+        logger.error("Ocorreu um erro ao construir o serviço do Gmail: %s", error)
         return None
+
+
+# --- SEÇÃO 4: CACHE DE CREDENCIAIS DESCRIPTOGRAFADAS ---
+class CredentialCache:
+    """
+    Cache LRU em memória das credenciais do Google já descriptografadas, por conta.
+    As entradas expiram após `ttl_seconds` e, acima de `max_size`, as menos usadas
+    são descartadas. Cada conta tem um lock próprio para que apenas uma renovação
+    de token aconteça por vez (single-flight).
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[Credentials, float]] = OrderedDict()
+        self._refresh_locks: dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, account_id: int) -> Credentials | None:
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry is None:
+                return None
+            creds, cached_at = entry
+            if time.monotonic() - cached_at > self.ttl_seconds:
+                self._entries.pop(account_id, None)
+                return None
+            self._entries.move_to_end(account_id)
+            return creds
+
+    def put(self, account_id: int, creds: Credentials):
+        with self._lock:
+            self._entries[account_id] = (creds, time.monotonic())
+            self._entries.move_to_end(account_id)
+            while len(self._entries) > self.max_size:
+                evicted_id, _ = self._entries.popitem(last=False)
+                self._refresh_locks.pop(evicted_id, None)
+
+    def invalidate(self, account_id: int | None = None):
+        """Remove uma conta do cache (ou todas, se nenhuma for informada)."""
+        with self._lock:
+            if account_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(account_id, None)
+
+    def refresh_lock(self, account_id: int) -> threading.Lock:
+        with self._lock:
+            return self._refresh_locks.setdefault(account_id, threading.Lock())
+
+    def expiring_within(self, seconds: float) -> list[tuple[int, Credentials]]:
+        """Lista as contas em cache cujo token expira nos próximos `seconds` segundos."""
+        limit = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=seconds)
+        with self._lock:
+            return [
+                (account_id, creds)
+                for account_id, (creds, _) in self._entries.items()
+                if creds.refresh_token and creds.expiry and creds.expiry <= limit
+            ]
+
+
+credential_cache = CredentialCache(
+    ttl_seconds=settings.CREDENTIAL_CACHE_TTL,
+    max_size=settings.CREDENTIAL_CACHE_MAX_SIZE,
+)
+
+def _save_credentials(account_id: int, encrypted_credentials: bytes | None):
+    """
+    Grava as credenciais da conta em uma sessão própria e curta, para não
+    fazer commit no meio da transação de quem chamou.
+    """
+    with SessionLocal() as session:
+        session.query(models.Account).filter(models.Account.id == account_id).update(
+            {models.Account.encrypted_credentials: encrypted_credentials}
+        )
+        session.commit()
+
+def _refresh_credentials(account_id: int, creds: Credentials, label: str):
+    """
+    Renova o token de acesso, salva o resultado no banco e atualiza o cache.
+    Deve ser chamada com o lock de renovação da conta adquirido.
+    """
+    try:
+        with metrics.observe_call("google_oauth", "token.refresh"):
+            creds.refresh(Request())
+    except RefreshError as e:
+        metrics.record_token_refresh(account_id, success=False)
+        # O Google recusou o refresh_token (ex: revogado, invalid_grant): limpe as credenciais
+        credential_cache.invalidate(account_id)
+        _save_credentials(account_id, None)
+        raise ConnectionError(f"Não foi possível renovar o token para o agente {label}. Por favor, autorize novamente. Erro: {e}")
+    except Exception as e:
+        metrics.record_token_refresh(account_id, success=False)
+        # Falha de rede (TransportError, DNS, timeout): as credenciais continuam válidas no
+        # banco e no cache, e a próxima renovação tenta de novo
+        raise ConnectionError(f"Falha temporária ao renovar o token para o agente {label}. Erro: {e}")
+
+    _save_credentials(account_id, encrypt_data(credentials_to_dict(creds)))
+    credential_cache.put(account_id, creds)
+    metrics.record_token_refresh(account_id, success=True)
+    logger.info("Token para o agente %s foi renovado com sucesso.", label, extra={"account_id": account_id})
+
+def _get_valid_credentials(agent: models.Account) -> Credentials:
+    """Retorna credenciais válidas do agente, usando o cache sempre que possível."""
+    creds = credential_cache.get(agent.id)
+    if creds is None:
+        creds_dict = decrypt_data(agent.encrypted_credentials)
+        creds = Credentials.from_authorized_user_info(creds_dict, settings.GMAIL_API_SCOPES.split(','))
+        credential_cache.put(agent.id, creds)
+
+    if creds.valid:
+        return creds
+
+    if not creds.refresh_token:
+        # Não há credenciais válidas ou refresh_token
+        raise ConnectionError(f"Credenciais inválidas para o agente {agent.email}. Por favor, autorize o acesso.")
+
+    # Single-flight: só uma requisição renova; as demais esperam e reaproveitam o resultado.
+    with credential_cache.refresh_lock(agent.id):
+        creds = credential_cache.get(agent.id) or creds
+        if not creds.valid:
+            _refresh_credentials(agent.id, creds, agent.email)
+    return creds
+
+def refresh_expiring_credentials(margin_seconds: float | None = None) -> int:
+    """
+    Renova proativamente os tokens em cache que expiram dentro da margem configurada.
+    Retorna a quantidade de tokens renovados.
+    """
+    margin = settings.CREDENTIAL_REFRESH_MARGIN if margin_seconds is None else margin_seconds
+    refreshed = 0
+    for account_id, creds in credential_cache.expiring_within(margin):
+        lock = credential_cache.refresh_lock(account_id)
+        if not lock.acquire(blocking=False):
+            continue  # Outra thread já está renovando esta conta
+        try:
+            _refresh_credentials(account_id, creds, str(account_id))
+            refreshed += 1
+        except ConnectionError as e:
+            logger.warning("%s", e, extra={"account_id": account_id})
+        finally:
+            lock.release()
+    return refreshed
+
+async def run_credential_refresher(stop_event: asyncio.Event):
+    """Laço em segundo plano que renova os tokens antes da expiração até `stop_event`."""
+    while not stop_event.is_set():
+        try:
+            await asyncio.to_thread(refresh_expiring_credentials)
+        except Exception as e:
+            logger.exception("Erro inesperado ao renovar credenciais em segundo plano: %s", e)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.CREDENTIAL_REFRESH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,294 @@
+"""
+Retenção e arquivamento de received_emails.
+
+No PostgreSQL a tabela é particionada por mês em received_at (sql/migrations/006). A
+cada settings.ARCHIVE_INTERVAL o arquivador:
+
+1. cria as partições do mês atual e dos próximos settings.PARTITION_MONTHS_AHEAD meses.
+   E-mails de meses sem partição (ex.: mensagens antigas de uma conta recém-conectada)
+   caem na partição padrão, received_emails_default;
+2. para cada conta com retenção (Account.retention_days ou, se vazio,
+   settings.RECEIVED_EMAIL_RETENTION_DAYS; 0 guarda para sempre), grava os e-mails mais
+   antigos que o prazo em arquivos JSON Lines comprimidos (gzip), um por conta e mês
+   de recebimento, e só então os apaga do banco, junto com os resumos;
+3. apaga de email_bodies os corpos que ficaram sem referência;
+4. remove as partições de meses anteriores que ficaram vazias.
+
+Assim as partições e os índices consultados na ingestão e na listagem guardam só o
+período de retenção. O arquivo é gravado (com fsync) antes da exclusão: uma falha no
+meio repete o lote, e o arquivo pode ter linhas repetidas, mas nunca perde uma. No
+PostgreSQL, um advisory lock mantém um único arquivador entre os processos.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import delete, exists, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import undefer
+
+from app import models
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock do arquivador (a de um inteiro não colide com a de dois do mailbox_lock)
+ARCHIVER_LOCK_KEY = 7302
+PARTITION_PREFIX = "received_emails_p"  # received_emails_p2026_10: outubro de 2026 (UTC)
+
+
+# --- Partições mensais ---
+def month_start(moment: datetime) -> datetime:
+    """Primeiro instante (UTC) do mês de `moment`."""
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+def partition_month(name: str) -> datetime | None:
+    """Mês de uma partição criada por partition_name (None para as demais, ex.: a padrão)."""
+    try:
+        return datetime.strptime(name.removeprefix(PARTITION_PREFIX), "%Y_%m").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+async def is_partitioned(db: AsyncSession) -> bool:
+    if db.bind is None or db.bind.dialect.name != "postgresql":
+        return False
+    stmt = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('received_emails'))")
+    return bool((await db.execute(stmt)).scalar())
+
+
+async def ensure_partitions(db: AsyncSession, now: datetime, months_ahead: int) -> list[str]:
+    """Cria as partições do mês de `now` e dos `months_ahead` seguintes que ainda não existem."""
+    created = []
+    first = month_start(now)
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        name = partition_name(month)
+        if (await db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})).scalar():
+            continue
+        try:
+            await db.execute(text(
+                f"CREATE TABLE {name} PARTITION OF received_emails "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            await db.commit()
+            created.append(name)
+        except DBAPIError as e:
+            # Ex.: a partição padrão já tem e-mails desse mês (data no futuro)
+            await db.rollback()
+            logger.warning("Não foi possível criar a partição %s: %s", name, e)
+    return created
+
+
+async def drop_empty_partitions(db: AsyncSession, now: datetime) -> list[str]:
+    """Remove as partições de meses anteriores ao de `now` que não têm mais linhas."""
+    stmt = text(
+        "SELECT c.relname FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'received_emails'::regclass"
+    )
+    names = (await db.execute(stmt)).scalars().all()
+    current = month_start(now)
+    dropped = []
+    for name in sorted(names):
+        month = partition_month(name)
+        if month is None or month >= current:
+            continue
+        # O lock impede que um e-mail chegue à partição entre a verificação e a remoção
+        await db.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        if (await db.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})"))).scalar():
+            await db.rollback()
+            continue
+        await db.execute(text(f"ALTER TABLE received_emails DETACH PARTITION {name}"))
+        await db.execute(text(f"DROP TABLE {name}"))
+        await db.commit()
+        dropped.append(name)
+    return dropped
+
+
+async def delete_unreferenced_bodies(db: AsyncSession) -> int:
+    """
+    Apaga de email_bodies os corpos que nenhum e-mail referencia mais. Se uma ingestão
+    reaproveitar um desses corpos ao mesmo tempo, o INSERT dela falha pela FK e a página é
+    tentada de novo na próxima execução (as mensagens continuam não lidas).
+    """
+    result = await db.execute(
+        delete(models.EmailBody).where(
+            ~exists().where(models.ReceivedEmail.body_hash == models.EmailBody.content_hash),
+            ~exists().where(models.OutgoingEmail.body_hash == models.EmailBody.content_hash),
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+# --- Arquivamento por conta ---
+def _archive_row(email: models.ReceivedEmail) -> dict:
+    return {
+        "id": email.id,
+        "gmail_message_id": email.gmail_message_id,
+        "account_id": email.account_id,
+        "sender": email.sender,
+        "subject": email.subject,
+        "body": email.body,
+        "received_at": email.received_at.isoformat() if email.received_at else None,
+        "is_read": email.is_read,
+    }
+
+
+def write_archive(archive_dir: Path, account_id: int, rows: list[dict]):
+    """
+    Acrescenta as linhas aos arquivos account_<id>/received_emails_<AAAA_MM>.jsonl.gz.
+    Cada chamada grava um novo membro gzip no fim do arquivo (gzip lê todos em sequência).
+    """
+    by_month: dict[str, list[dict]] = {}
+    for row in rows:
+        month = (row["received_at"] or "")[:7].replace("-", "_") or "sem_data"
+        by_month.setdefault(month, []).append(row)
+
+    directory = archive_dir / f"account_{account_id}"
+    directory.mkdir(parents=True, exist_ok=True)
+    for month, month_rows in by_month.items():
+        with open(directory / f"received_emails_{month}.jsonl.gz", "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                for row in month_rows:
+                    archive.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+class ReceivedEmailArchiver:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        archive_dir: str | Path | None = None,
+        batch_size: int | None = None,
+    ):
+        self.session_factory = session_factory
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+
+    def _archive_dir(self) -> Path:
+        return Path(self.archive_dir or settings.ARCHIVE_DIR)
+
+    async def retention_by_account(self) -> dict[int, int]:
+        """{account_id: dias de retenção} das contas cujos e-mails expiram."""
+        async with self.session_factory() as db:
+            rows = (await db.execute(select(models.Account.id, models.Account.retention_days))).all()
+        retention = {}
+        for account_id, days in rows:
+            days = settings.RECEIVED_EMAIL_RETENTION_DAYS if days is None else days
+            if days > 0:
+                retention[account_id] = days
+        return retention
+
+    async def archive_account(self, account_id: int, cutoff: datetime) -> int:
+        """Arquiva e apaga, em lotes, os e-mails da conta recebidos antes de `cutoff`."""
+        batch_size = self.batch_size or settings.ARCHIVE_BATCH_SIZE
+        archived = 0
+        while True:
+            async with self.session_factory() as db:
+                emails = (await db.execute(
+                    select(models.ReceivedEmail)
+                    .options(undefer(models.ReceivedEmail.body_data))
+                    .where(models.ReceivedEmail.account_id == account_id,
+                           models.ReceivedEmail.received_at < cutoff)
+                    .order_by(models.ReceivedEmail.received_at, models.ReceivedEmail.id)
+                    .limit(batch_size)
+                )).scalars().all()
+                if not emails:
+                    return archived
+
+                await asyncio.to_thread(write_archive, self._archive_dir(), account_id,
+                                        [_archive_row(email) for email in emails])
+                ids = [email.id for email in emails]
+                await db.execute(
+                    delete(models.EmailSummary).where(models.EmailSummary.received_email_id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+                # received_at no filtro: o Postgres só visita as partições antigas
+                await db.execute(
+                    delete(models.ReceivedEmail)
+                    .where(models.ReceivedEmail.id.in_(ids), models.ReceivedEmail.received_at < cutoff)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            archived += len(ids)
+            if len(ids) < batch_size:
+                return archived
+
+    @asynccontextmanager
+    async def _single_archiver(self):
+        """No PostgreSQL, produz True só no processo que conseguir o advisory lock."""
+        async with self.session_factory() as db:
+            engine = db.bind
+        if engine is None or engine.dialect.name != "postgresql":
+            yield True
+            return
+        async with engine.connect() as conn:
+            acquired = (await conn.execute(select(func.pg_try_advisory_lock(ARCHIVER_LOCK_KEY)))).scalar()
+            await conn.commit()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.execute(select(func.pg_advisory_unlock(ARCHIVER_LOCK_KEY)))
+                    await conn.commit()
+
+    async def run_once(self, now: datetime | None = None) -> int:
+        """Uma rodada completa (partições, arquivamento e limpeza). Retorna os e-mails arquivados."""
+        now = now or datetime.now(timezone.utc)
+        async with self._single_archiver() as acquired:
+            if not acquired:
+                return 0
+            async with self.session_factory() as db:
+                partitioned = await is_partitioned(db)
+                if partitioned:
+                    for name in await ensure_partitions(db, now, settings.PARTITION_MONTHS_AHEAD):
+                        logger.info("Partição %s criada.", name)
+
+            archived = 0
+            for account_id, days in (await self.retention_by_account()).items():
+                count = await self.archive_account(account_id, now - timedelta(days=days))
+                if count:
+                    logger.info("%d e-mail(s) arquivado(s).", count, extra={"account_id": account_id})
+                archived += count
+
+            if archived:
+                async with self.session_factory() as db:
+                    removed = await delete_unreferenced_bodies(db)
+                logger.info("%d corpo(s) sem referência removido(s) de email_bodies.", removed)
+
+            if partitioned:
+                async with self.session_factory() as db:
+                    for name in await drop_empty_partitions(db, now):
+                        logger.info("Partição vazia %s removida.", name)
+            return archived
+
+    async def run(self, stop_event: asyncio.Event):
+        """Laço em segundo plano que executa uma rodada a cada settings.ARCHIVE_INTERVAL."""
+        while not stop_event.is_set():
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("Erro inesperado no arquivamento de e-mails: %s", e)
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=settings.ARCHIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+received_email_archiver = ReceivedEmailArchiver()
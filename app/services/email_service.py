@@ -1,89 +1,360 @@
+import asyncio
 import base64
-from datetime import datetime
+import logging
+import threading
+import weakref
+from datetime import datetime, timezone
 from email.mime.text import MIMEText # NOVO: Import necessário para criar a resposta do e-mail
+from typing import Callable
 
+import httplib2
 import httpx
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.errors import HttpError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, models, schemas
+from app import crud_async, metrics, models, schemas
 from app.config import settings
 from app.security import get_agent_gmail_service
+from app.services.gemini_client import generate_content, stream_generate_content
+from app.services.mailbox_lock import mailbox_lock
+from app.services.mime_decoder import decode_message_body
+from app.services.reply_cache import reply_cache, reply_cache_key
+from app.services.summary_forwarder import summary_forwarder
+from app.services.thread_context import AGENT_AUTHOR, thread_context_cache
+
+logger = logging.getLogger(__name__)
 
 # --- Validação da Chave de API do Google (mantida) ---
-if not settings.GOOGLE_API_KEY:
-    raise ValueError(
-        "A chave da API do Google (GOOGLE_API_KEY) não foi encontrada. "
-        "Verifique seu arquivo .env e garanta que a chave para o Gemini está configurada."
-    )
+def check_gemini_api_key():
+    """Falha no startup da aplicação (e não na importação) se a chave do Gemini estiver vazia."""
+    if not settings.GOOGLE_API_KEY:
+        raise ValueError(
+            "A chave da API do Google (GOOGLE_API_KEY) não foi encontrada. "
+            "Verifique seu arquivo .env e garanta que a chave para o Gemini está configurada."
+        )
+
+
+# --- Eventos de progresso do pipeline ---
+# Recebe dicionários como {"event": "sent", "message_id": ..., ...}. Os eventos são:
+# listed, fetched, generating (trecho da resposta em streaming), generated, sent,
+# failed e marked_read. A função é chamada no event loop e não deve bloquear.
+ProgressCallback = Callable[[dict], None]
+
+def _emit(on_event: ProgressCallback | None, event: str, **data):
+    if on_event is not None:
+        on_event({"event": event, **data})
+
+
+# --- Execução das chamadas bloqueantes da API do Gmail fora do event loop ---
+_thread_local = threading.local()
+
+def _thread_http(request):
+    """
+    Retorna um objeto Http exclusivo da thread atual para as credenciais da requisição.
+    O httplib2 não é thread-safe, então cada thread do executor mantém o seu próprio.
+    """
+    credentials = getattr(request.http, "credentials", None)
+    if credentials is None:
+        return None
+
+    cache = getattr(_thread_local, "http_by_credentials", None)
+    if cache is None:
+        cache = _thread_local.http_by_credentials = weakref.WeakKeyDictionary()
+
+    http = cache.get(credentials)
+    if http is None:
+        http = cache[credentials] = AuthorizedHttp(credentials, http=httplib2.Http())
+    return http
 
-# --- _decode_email_body (mantida sem alterações) ---
-def _decode_email_body(parts: list) -> str:
-    """Decodifica o corpo do e-mail a partir das partes da mensagem."""
-    # ... (seu código original aqui, sem alterações)
-    body = ""
-    if not parts:
-        return body
-
-    for part in parts:
-        mime_type = part.get("mimeType", "")
-        if mime_type == "text/plain":
-            data = part.get("body", {}).get("data", "")
-            if data:
-                body += base64.urlsafe_b64decode(data).decode("utf-8")
-        elif mime_type == "multipart/alternative":
-            return _decode_email_body(part.get("parts", []))
-    return body
+def _gmail_operation(request) -> str:
+    """Nome da operação nas métricas (ex.: "messages.list"), a partir do methodId da requisição."""
+    method_id = getattr(request, "methodId", None)
+    if not isinstance(method_id, str):
+        return "unknown"
+    return method_id.removeprefix("gmail.users.")
+
+async def _execute(request):
+    """Executa uma requisição da API do Google em uma thread, sem bloquear o event loop."""
+    with metrics.observe_call("gmail", _gmail_operation(request)):
+        return await asyncio.to_thread(lambda: request.execute(http=_thread_http(request)))
+
+
+# --- Requisições em lote (batch) e respostas parciais da API do Gmail ---
+# Máscara de campos (partial response): apenas o que o pipeline realmente lê de cada mensagem.
+_PART_FIELDS = "mimeType,filename,headers(name,value),body(data,size,attachmentId)"
+GMAIL_MESSAGE_FIELDS = (
+    f"id,threadId,internalDate,labelIds,"
+    f"payload({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS},parts)))"
+)
+# Limite documentado do endpoint users.messages.batchModify.
+GMAIL_BATCH_MODIFY_MAX_IDS = 1000
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Indica se o erro da API do Google é um 404 (recurso inexistente ou expirado)."""
+    return isinstance(error, HttpError) and getattr(error.resp, "status", None) == 404
+
+def _chunks(items: list, size: int):
+    """Divide uma lista em blocos de no máximo `size` itens."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def _fetch_messages_batch(service, message_ids: list[str]) -> tuple[list[dict], list[str]]:
+    """
+    Busca várias mensagens em uma única requisição HTTP usando o endpoint de batch do Gmail.
+    Retorna as mensagens obtidas e os ids das que falharam. Mensagens removidas nesse
+    meio-tempo (404) são apenas ignoradas e não contam como falha.
+    """
+    fetched: dict[str, dict] = {}
+    failed_ids: list[str] = []
+
+    def _on_response(request_id, response, exception):
+        if exception is not None:
+            if _is_not_found(exception):
+                metrics.record_messages("skipped")
+            else:
+                failed_ids.append(request_id)
+                metrics.record_messages("failed")
+            logger.warning("Falha ao buscar o e-mail %s no lote: %s", request_id, exception,
+                           extra={"message_id": request_id})
+            return
+        fetched[request_id] = response
+
+    batch = service.new_batch_http_request(callback=_on_response)
+    first_request = None
+    for message_id in message_ids:
+        request = service.users().messages().get(
+            userId='me', id=message_id, format='full', fields=GMAIL_MESSAGE_FIELDS
+        )
+        first_request = first_request or request
+        batch.add(request, request_id=message_id)
+
+    with metrics.observe_call("gmail", "messages.batchGet"):
+        await asyncio.to_thread(lambda: batch.execute(http=_thread_http(first_request)))
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched], failed_ids
+
+async def _mark_as_read(service, message_ids: list[str]):
+    """Remove o rótulo UNREAD de várias mensagens com chamadas batchModify."""
+    for chunk in _chunks(message_ids, GMAIL_BATCH_MODIFY_MAX_IDS):
+        await _execute(service.users().messages().batchModify(
+            userId='me', body={'ids': chunk, 'removeLabelIds': ['UNREAD']}
+        ))
+        logger.info("%d e-mail(s) marcados como lidos.", len(chunk))
+
+
+class _ReadMarker:
+    """
+    Marca cada mensagem como lida assim que ela sai do pipeline, sem esperar o resto do
+    bloco: uma execução cancelada no meio (job cancelado, shutdown, cliente do stream
+    desconectado) não reenvia respostas já enviadas. As mensagens que terminam enquanto
+    um batchModify está em andamento vão juntas no seguinte.
+    """
+
+    def __init__(self, service, on_event: ProgressCallback | None = None):
+        self.service = service
+        self.on_event = on_event
+        self._pending: list[str] = []
+        self._failed: set[str] = set()
+        self._lock = asyncio.Lock()
+
+    async def mark(self, message_id: str) -> bool:
+        """Marca a mensagem (e as que estiverem esperando) como lida. Retorna False se o Gmail recusou."""
+        self._pending.append(message_id)
+        async with self._lock:
+            if message_id in self._pending:  # Ainda não foi levada por outro batchModify
+                message_ids, self._pending = self._pending, []
+                try:
+                    with metrics.observe_stage("mark_read"):
+                        await _mark_as_read(self.service, message_ids)
+                except HttpError as error:
+                    logger.error("Falha ao marcar %d e-mail(s) como lidos: %s", len(message_ids), error)
+                    self._failed.update(message_ids)
+                else:
+                    metrics.record_messages("processed", len(message_ids))
+                    _emit(self.on_event, "marked_read", message_ids=message_ids)
+        return message_id not in self._failed
+
+
+# --- Sincronização incremental da caixa de entrada (historyId) ---
+async def _list_unread_message_ids(service) -> list[str]:
+    """Lista os ids de todos os e-mails não lidos, percorrendo todas as páginas."""
+    message_ids = []
+    page_token = None
+    while True:
+        results = await _execute(service.users().messages().list(
+            userId='me', q='is:unread', maxResults=500,
+            pageToken=page_token, fields='messages(id),nextPageToken'
+        ))
+        message_ids.extend(message_info['id'] for message_info in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return message_ids
+
+async def _list_changed_message_ids(
+    service, start_history_id: str
+) -> tuple[list[str], str, dict[str, set[str]]]:
+    """
+    Lista, via users.history.list, as mensagens que chegaram (ou voltaram a ficar não
+    lidas) desde `start_history_id`. Retorna os ids, o historyId mais recente da caixa e
+    as mensagens adicionadas por thread (lidas ou não, inclusive as enviadas), usadas pelo
+    cache de contexto das threads. Lança HttpError 404 quando o watermark expirou.
+    """
+    message_ids: dict[str, None] = {}  # dict preserva a ordem e remove duplicatas
+    thread_messages: dict[str, set[str]] = {}
+    latest_history_id = start_history_id
+    page_token = None
+    while True:
+        results = await _execute(service.users().history().list(
+            userId='me', startHistoryId=start_history_id,
+            historyTypes=['messageAdded', 'labelAdded'], pageToken=page_token,
+            fields='history(messagesAdded(message(id,threadId,labelIds)),labelsAdded(message(id,labelIds))),'
+                   'historyId,nextPageToken'
+        ))
+        for record in results.get('history', []):
+            for change in record.get('messagesAdded', []):
+                message = change.get('message', {})
+                if message.get('threadId'):
+                    thread_messages.setdefault(message['threadId'], set()).add(message['id'])
+            for change in record.get('messagesAdded', []) + record.get('labelsAdded', []):
+                message = change.get('message', {})
+                if 'UNREAD' in message.get('labelIds', []):
+                    message_ids[message['id']] = None
+        latest_history_id = results.get('historyId', latest_history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return list(message_ids), latest_history_id, thread_messages
+
+async def _list_pending_message_ids(service, agent: models.Account) -> tuple[list[str], str, bool]:
+    """
+    Retorna os ids a processar, o novo watermark da conta e se a listagem foi completa.
+    Usa a sincronização incremental quando há um historyId salvo; na primeira execução
+    ou quando o watermark expirou, faz a listagem completa (paginada) de `is:unread`.
+    """
+    if agent.gmail_history_id:
+        try:
+            message_ids, history_id, thread_messages = await _list_changed_message_ids(service, agent.gmail_history_id)
+        except HttpError as error:
+            if not _is_not_found(error):
+                raise
+            logger.info("O historyId salvo para o agente %s expirou. Fazendo sincronização completa.", agent.email)
+        else:
+            thread_context_cache.apply_history(
+                agent.id, agent.gmail_history_id, history_id, thread_messages, pending_ids=message_ids
+            )
+            return message_ids, history_id, False
+
+    # O historyId é lido ANTES da listagem para que nada que chegue durante ela seja perdido.
+    profile = await _execute(service.users().getProfile(userId='me', fields='historyId'))
+    message_ids = await _list_unread_message_ids(service)
+    thread_context_cache.reset_account(agent.id, profile['historyId'])
+    return message_ids, profile['historyId'], True
 
 
 # --- ALTERADO: Função de IA para GERAR RESPOSTA em vez de resumir ---
-async def _generate_reply_with_ai(original_body: str, sender: str, subject: str) -> str:
+# Versão do prompt de resposta. Altere sempre que o texto do prompt mudar, para que
+# respostas em cache geradas com o prompt antigo deixem de ser reaproveitadas.
+REPLY_PROMPT_VERSION = "1"
+
+async def _generate_reply_with_ai(
+    original_body: str,
+    sender: str,
+    subject: str,
+    client: httpx.AsyncClient | None = None,
+    on_chunk: Callable[[str], None] | None = None,
+    thread_context: str = "",
+) -> str:
     """
     Gera uma resposta de e-mail usando a API REST do Google Gemini.
+    Usa o cliente HTTP compartilhado da aplicação, a menos que outro seja informado.
+    Com `on_chunk`, a resposta é gerada em streaming e cada trecho é repassado assim que chega.
+    `thread_context` (ver app/services/thread_context.py) descreve a conversa anterior.
+    Lança GeminiUnavailableError se a API continuar limitando a taxa ou fora do ar
+    após as novas tentativas, para que o e-mail não seja marcado como lido sem resposta.
     """
     if not original_body:
         return ""
 
-    api_url = f"https://generativelanguage.googleapis.com/v1/models/{settings.GEMINI_MODEL_NAME}:generateContent?key={settings.GOOGLE_API_KEY}"
-    headers = {"Content-Type": "application/json"}
-
-    async with httpx.AsyncClient() as client:
-        # NOVO PROMPT: Instrução para gerar uma resposta, não um resumo.
-        prompt = (
-            "Você é um assistente de IA profissional e sua tarefa é responder e-mails. "
-            "Baseado no e-mail original abaixo, gere uma resposta educada, concisa e relevante. "
-            "Responda apenas com o corpo do texto da resposta, sem cabeçalhos como 'Assunto:' ou 'Para:'.\n\n"
-            f"--- E-mail Original ---\n"
-            f"De: {sender}\n"
-            f"Assunto: {subject}\n"
-            f"Corpo: {original_body}\n"
-            f"--- Fim do E-mail Original ---\n\n"
-            f"Resposta Sugerida:"
+    # Conversa anterior da thread, já resumida e com tamanho limitado
+    context_section = ""
+    if thread_context:
+        context_section = (
+            "Considere a conversa anterior desta thread ao responder.\n\n"
+            f"--- Conversa Anterior ---\n{thread_context}\n--- Fim da Conversa Anterior ---\n\n"
         )
-        data = {"contents": [{"parts": [{"text": prompt}]}]}
 
-        try:
-            response = await client.post(api_url, json=data, headers=headers, timeout=60.0)
-            response.raise_for_status()
-            result = response.json()
+    # NOVO PROMPT: Instrução para gerar uma resposta, não um resumo.
+    prompt = (
+        "Você é um assistente de IA profissional e sua tarefa é responder e-mails. "
+        "Baseado no e-mail original abaixo, gere uma resposta educada, concisa e relevante. "
+        "Responda apenas com o corpo do texto da resposta, sem cabeçalhos como 'Assunto:' ou 'Para:'.\n\n"
+        f"{context_section}"
+        f"--- E-mail Original ---\n"
+        f"De: {sender}\n"
+        f"Assunto: {subject}\n"
+        f"Corpo: {original_body}\n"
+        f"--- Fim do E-mail Original ---\n\n"
+        f"Resposta Sugerida:"
+    )
+
+    try:
+        if on_chunk is not None:
+            chunks = []
+            async for chunk in stream_generate_content(prompt, client=client):
+                chunks.append(chunk)
+                on_chunk(chunk)
+            if not chunks:
+                logger.warning("A API do Gemini não retornou conteúdo no stream.")
+            return "".join(chunks).strip()
+
+        result = await generate_content(prompt, client=client)
+
+        if not result.get("candidates") or not result["candidates"][0].get("content", {}).get("parts"):
+            finish_reason = result.get("candidates", [{}])[0].get("finishReason", "UNKNOWN")
+            logger.warning("A API do Gemini não retornou conteúdo. Motivo: %s", finish_reason)
+            return "" # Retorna vazio em caso de erro para não enviar e-mail em branco
+
+        reply_text = result["candidates"][0]["content"]["parts"][0]["text"]
+        return reply_text.strip()
+    except (httpx.HTTPStatusError, KeyError, IndexError) as e:
+        logger.error("Erro ao chamar a API do Gemini: %s", e)
+        return ""
 
-            if not result.get("candidates") or not result["candidates"][0].get("content", {}).get("parts"):
-                finish_reason = result.get("candidates", [{}])[0].get("finishReason", "UNKNOWN")
-                error_message = f"A API do Gemini não retornou conteúdo. Motivo: {finish_reason}"
-                print(error_message)
-                return "" # Retorna vazio em caso de erro para não enviar e-mail em branco
 
-            reply_text = result["candidates"][0]["content"]["parts"][0]["text"]
-            return reply_text.strip()
-        except (httpx.HTTPStatusError, KeyError, IndexError) as e:
-            print(f"Erro ao chamar a API do Gemini: {e}")
-            return ""
+async def _get_reply(
+    body: str,
+    sender: str,
+    subject: str,
+    on_chunk: Callable[[str], None] | None = None,
+    thread_context: str = "",
+) -> str:
+    """
+    Retorna a resposta da IA para o e-mail, reaproveitando o cache de respostas
+    quando um conteúdo equivalente já foi respondido. Respostas dentro de uma conversa
+    (com `thread_context`) dependem dela e não passam pelo cache.
+    """
+    def _generate():
+        options = {}
+        if on_chunk is not None:
+            options["on_chunk"] = on_chunk
+        if thread_context:
+            options["thread_context"] = thread_context
+        return _generate_reply_with_ai(original_body=body, sender=sender, subject=subject, **options)
+
+    if not settings.REPLY_CACHE_ENABLED or not body or thread_context:
+        return await _generate()
+
+    key = reply_cache_key(sender, subject, body, settings.GEMINI_MODEL_NAME, REPLY_PROMPT_VERSION)
+    return await reply_cache.get_or_generate(
+        key, _generate, model_name=settings.GEMINI_MODEL_NAME, prompt_version=REPLY_PROMPT_VERSION
+    )
 
 
 # --- NOVO: Função para ENVIAR A RESPOSTA via API do Gmail ---
-def _send_reply_email(service, to: str, subject: str, message_text: str, thread_id: str):
+async def _send_reply_email(service, to: str, subject: str, message_text: str, thread_id: str) -> dict | None:
     """
     Envia a resposta do e-mail usando a API do Gmail, mantendo na mesma thread.
+    Retorna a mensagem enviada (id e threadId) ou None se o Gmail recusou o envio.
     """
     try:
         message = MIMEText(message_text)
@@ -94,77 +365,281 @@ def _send_reply_email(service, to: str, subject: str, message_text: str, thread_
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
         body = {'raw': raw_message, 'threadId': thread_id}
 
-        service.users().messages().send(userId='me', body=body).execute()
-        print(f"Resposta enviada com sucesso para {to} na thread {thread_id}.")
+        sent_message = await _execute(service.users().messages().send(userId='me', body=body))
+        logger.info("Resposta enviada com sucesso para %s na thread %s.", to, thread_id,
+                    extra={"thread_id": thread_id})
+        return sent_message or {}
     except HttpError as error:
-        print(f"Ocorreu um erro ao enviar o e-mail: {error}")
+        logger.error("Ocorreu um erro ao enviar o e-mail: %s", error, extra={"thread_id": thread_id})
+        return None
+
+
+def _parse_message(agent: models.Account, msg: dict) -> schemas.ReceivedEmailCreate:
+    """Extrai remetente, assunto, corpo e data de uma mensagem do Gmail."""
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'Sem Assunto')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Desconhecido')
+
+    return schemas.ReceivedEmailCreate(
+        gmail_message_id=msg['id'], account_id=agent.id, sender=sender,
+        subject=subject, body=decode_message_body(payload),
+        received_at=datetime.fromtimestamp(int(msg['internalDate']) / 1000, tz=timezone.utc)
+    )
+
+
+async def _process_message(
+    service,
+    msg: dict,
+    email: schemas.ReceivedEmailCreate,
+    on_event: ProgressCallback | None = None,
+    stream_replies: bool = False,
+) -> bool | None:
+    """
+    Processa uma mensagem já buscada e salva: gera a resposta e a envia.
+    Retorna True se uma resposta foi enviada, False se a IA não gerou resposta e None
+    se o Gmail recusou o envio (a mensagem continua não lida e é tentada de novo).
+    """
+    thread_id = msg['threadId'] # Essencial para manter a conversa
+    sender, subject, body = email.sender, email.subject, email.body
+
+    # 0. Contexto da conversa (cache incremental por thread; a thread só é buscada uma vez)
+    thread_context = ""
+    if settings.THREAD_CONTEXT_ENABLED:
+        with metrics.observe_stage("thread_context"):
+            thread_context = await thread_context_cache.context_for(
+                service, email.account_id, msg, sender=sender, body=body, execute=_execute
+            )
+
+    # 1. Gera a resposta com a IA (ou reaproveita a resposta de um conteúdo idêntico).
+    # Em modo streaming, cada trecho gerado vira um evento "generating".
+    on_chunk = None
+    if stream_replies and on_event is not None:
+        def on_chunk(text: str):
+            _emit(on_event, "generating", message_id=msg['id'], text=text)
+    with metrics.observe_stage("generate"):
+        ai_reply = await _get_reply(body, sender, subject, on_chunk=on_chunk, thread_context=thread_context)
+    _emit(on_event, "generated", message_id=msg['id'], has_reply=bool(ai_reply))
+
+    # 2. Envia a resposta se a IA gerou algum conteúdo
+    if ai_reply:
+        reply_subject = subject if subject.lower().startswith("re:") else f"Re: {subject}"
+        with metrics.observe_stage("send"):
+            sent = await _send_reply_email(
+                service,
+                to=sender,
+                subject=reply_subject,
+                message_text=ai_reply,
+                thread_id=thread_id
+            )
+        if sent is not None:
+            metrics.record_messages("replied")
+            _emit(on_event, "sent", message_id=msg['id'], to=sender)
+            # Com o id, a resposta não conta como novidade na verificação da thread
+            thread_context_cache.record(email.account_id, thread_id, sent.get('id'), AGENT_AUTHOR, ai_reply)
+            return True
+        metrics.record_messages("failed")
+        _emit(on_event, "failed", message_id=msg['id'], error="Falha ao enviar a resposta.")
+        return None
+
+    metrics.record_messages("skipped")
+    logger.info("Nenhuma resposta foi gerada pela IA para o e-mail de %s. O e-mail não será respondido.",
+                sender, extra={"message_id": msg['id']})
+    return False
+
+
+async def _process_chunk(
+    db: AsyncSession,
+    db_lock: asyncio.Lock,
+    agent: models.Account,
+    service,
+    message_ids: list[str],
+    fetch_semaphore: asyncio.Semaphore,
+    semaphore: asyncio.Semaphore,
+    read_marker: _ReadMarker,
+    on_event: ProgressCallback | None = None,
+    stream_replies: bool = False,
+) -> tuple[int, list[str]]:
+    """
+    Processa um bloco de mensagens: busca todas em um único batch, responde cada uma
+    em paralelo (limitado por `semaphore`) e marca cada concluída como lida logo em
+    seguida (`read_marker`).
+    Os blocos rodam em paralelo e compartilham `db`; uma AsyncSession não aceita
+    operações simultâneas, então o acesso a ela é serializado por `db_lock`.
+    Retorna a quantidade de respostas enviadas e os ids das mensagens que falharam.
+    """
+    async with fetch_semaphore:
+        with metrics.observe_stage("fetch"):
+            messages, failed_ids = await _fetch_messages_batch(service, message_ids)
+
+    # A lista pode vir do histórico: ignora o que já foi lido desde então.
+    unread = [msg for msg in messages if 'UNREAD' in msg.get('labelIds', [])]
+    metrics.record_messages("skipped", len(messages) - len(unread))
+    messages = unread
+
+    # Salva o bloco inteiro de e-mails recebidos em uma única transação
+    emails = [_parse_message(agent, msg) for msg in messages]
+    async with db_lock:
+        with metrics.observe_stage("db_save"):
+            saved_ids = await crud_async.bulk_create_received_emails(db, emails)
+    if agent.forward_url and saved_ids:
+        # Resumo e encaminhamento rodam em segundo plano (app/services/summary_forwarder.py)
+        summary_forwarder.enqueue(list(saved_ids.values()))
+    for msg, email in zip(messages, emails):
+        _emit(on_event, "fetched", message_id=msg['id'], thread_id=msg['threadId'],
+              sender=email.sender, subject=email.subject)
+
+    async def _bounded(msg: dict, email: schemas.ReceivedEmailCreate) -> bool | None:
+        async with semaphore:
+            try:
+                with metrics.observe_stage("message"):
+                    outcome = await _process_message(service, msg, email, on_event, stream_replies)
+                if outcome is None or await read_marker.mark(msg['id']):
+                    return outcome
+                _emit(on_event, "failed", message_id=msg['id'], error="Falha ao marcar o e-mail como lido.")
+            except HttpError as error:
+                logger.error("Ocorreu um erro na API do Gmail ao processar o e-mail %s: %s", msg['id'], error,
+                             extra={"message_id": msg['id']})
+                _emit(on_event, "failed", message_id=msg['id'], error=str(error))
+            except Exception as e:
+                logger.exception("Ocorreu um erro inesperado ao processar o e-mail %s: %s", msg['id'], e,
+                                 extra={"message_id": msg['id']})
+                _emit(on_event, "failed", message_id=msg['id'], error=str(e))
+            metrics.record_messages("failed")
+            return None
+
+    # Só os e-mails que passaram pelo pipeline sem erro são marcados como lidos (em _bounded)
+    outcomes = await asyncio.gather(*(_bounded(msg, email) for msg, email in zip(messages, emails)))
+    failed_ids += [msg['id'] for msg, outcome in zip(messages, outcomes) if outcome is None]
+    return sum(1 for outcome in outcomes if outcome), failed_ids
 
 
 # --- ALTERADO: Função principal para orquestrar o processo de RESPOSTA ---
-async def process_and_reply_to_emails(db: Session, agent: models.Account):
+async def process_and_reply_to_emails(
+    db: AsyncSession,
+    agent: models.Account,
+    concurrency: int | None = None,
+    max_messages: int | None = None,
+    on_event: ProgressCallback | None = None,
+    stream_replies: bool = False,
+) -> int:
     """
     Processo principal para ler e-mails não lidos, gerar uma resposta com IA e enviá-la.
+
+    Apenas as mensagens novas desde a última execução são consideradas (sincronização
+    incremental por historyId). Elas são buscadas em lotes de settings.GMAIL_BATCH_SIZE
+    (uma requisição HTTP por lote, com máscara de campos) e processadas em pipeline:
+    até `concurrency` mensagens (padrão: settings.EMAIL_PROCESSING_CONCURRENCY) são
+    respondidas ao mesmo tempo, e cada uma é marcada como lida assim que termina (as que
+    terminam juntas vão no mesmo batchModify).
+    `max_messages` limita quantas mensagens são tratadas nesta execução; o restante
+    fica para a próxima. `on_event` recebe os eventos de progresso de cada mensagem
+    (ver ProgressCallback); com `stream_replies`, as respostas são geradas em streaming
+    e cada trecho também é emitido. Retorna a quantidade de e-mails respondidos.
+    As métricas e os logs da execução são associados ao agente (ver app/metrics.py).
+    Execuções para a mesma conta nunca se sobrepõem, venham do job, do stream ou do
+    agendador: a segunda espera a primeira terminar (ver app/services/mailbox_lock.py).
     """
-    service = get_agent_gmail_service(agent=agent, db=db)
+    with metrics.agent_context(agent.id):
+        async with mailbox_lock(db, agent.id):
+            with metrics.observe_stage("run"):
+                return await _reply_to_pending_emails(db, agent, concurrency, max_messages, on_event, stream_replies)
+
+
+async def _reply_to_pending_emails(
+    db: AsyncSession,
+    agent: models.Account,
+    concurrency: int | None,
+    max_messages: int | None,
+    on_event: ProgressCallback | None,
+    stream_replies: bool,
+) -> int:
+    service = await asyncio.to_thread(get_agent_gmail_service, agent=agent)
     if not service:
         raise ConnectionError("Não foi possível conectar ao serviço do Gmail.")
 
     try:
-        results = service.users().messages().list(userId='me', q='is:unread').execute()
-        messages = results.get('messages', [])
+        with metrics.observe_stage("list"):
+            message_ids, history_id, full_sync = await _list_pending_message_ids(service, agent)
+    except HttpError as error:
+        logger.error("Ocorreu um erro na API do Gmail: %s", error)
+        return 0
 
-        if not messages:
-            print("Nenhum e-mail não lido encontrado.")
-            return
+    # Mensagens que falharam em execuções anteriores voltam junto com as novas (o watermark
+    # já passou por elas); as que esgotaram settings.GMAIL_MESSAGE_MAX_ATTEMPTS ficam de fora
+    if full_sync:
+        await crud_async.prune_message_attempts(db, agent.id, message_ids)
+    attempts = await crud_async.get_message_attempts(db, agent.id)
+    max_attempts = settings.GMAIL_MESSAGE_MAX_ATTEMPTS
+    retry_ids = [message_id for message_id, count in attempts.items() if count < max_attempts]
+    message_ids = [message_id for message_id in dict.fromkeys(retry_ids + message_ids)
+                   if attempts.get(message_id, 0) < max_attempts]
+
+    if not message_ids:
+        logger.info("Nenhum e-mail não lido encontrado.")
+        _emit(on_event, "listed", count=0)
+        await crud_async.update_agent_history_id(db, agent, history_id)
+        return 0
+
+    truncated = max_messages is not None and len(message_ids) > max_messages
+    if truncated:
+        message_ids = message_ids[:max_messages]
+    _emit(on_event, "listed", count=len(message_ids))
+
+    semaphore = asyncio.Semaphore(max(1, concurrency or settings.EMAIL_PROCESSING_CONCURRENCY))
+    fetch_semaphore = asyncio.Semaphore(max(1, settings.GMAIL_BATCH_CONCURRENCY))
+    db_lock = asyncio.Lock()
+    read_marker = _ReadMarker(service, on_event)
+    # Mensagens desta execução que ainda não saíram do pipeline
+    pending = metrics.agent_queue("pipeline_messages")
+    pending.inc(len(message_ids))
 
-        for message_info in messages:
-            msg = service.users().messages().get(userId='me', id=message_info['id'], format='full').execute()
-            
-            payload = msg.get('payload', {})
-            headers = payload.get('headers', [])
-            thread_id = msg['threadId'] # Essencial para manter a conversa
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'Sem Assunto')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Desconhecido')
-            
-            body = _decode_email_body(payload.get('parts', []))
-            if not body and payload.get('body', {}).get('data'):
-                 body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-
-            # --- Lógica de salvar e-mail recebido (mantida) ---
-            email_data = schemas.ReceivedEmailCreate(
-                gmail_message_id=msg['id'], account_id=agent.id, sender=sender,
-                subject=subject, body=body, received_at=datetime.fromtimestamp(int(msg['internalDate']) / 1000)
+    async def _safe_chunk(chunk: list[str]) -> tuple[int, list[str]]:
+        try:
+            return await _process_chunk(
+                db, db_lock, agent, service, chunk, fetch_semaphore, semaphore, read_marker, on_event, stream_replies
             )
-            crud.get_or_create_received_email(db, email_data)
-
-            # 1. Gera a resposta com a IA
-            ai_reply = await _generate_reply_with_ai(original_body=body, sender=sender, subject=subject)
-
-            # 2. Envia a resposta se a IA gerou algum conteúdo
-            if ai_reply:
-                reply_subject = subject if subject.lower().startswith("re:") else f"Re: {subject}"
-                _send_reply_email(
-                    service,
-                    to=sender,
-                    subject=reply_subject,
-                    message_text=ai_reply,
-                    thread_id=thread_id
-                )
-            else:
-                print(f"Nenhuma resposta foi gerada pela IA para o e-mail de {sender}. O e-mail não será respondido.")
+        except HttpError as error:
+            logger.error("Ocorreu um erro na API do Gmail ao processar um lote de e-mails: %s", error)
+            error_message = str(error)
+        except Exception as e:
+            logger.exception("Ocorreu um erro inesperado ao processar um lote de e-mails: %s", e)
+            error_message = str(e)
+        finally:
+            pending.dec(len(chunk))
+        metrics.record_messages("failed", len(chunk))
+        for message_id in chunk:
+            _emit(on_event, "failed", message_id=message_id, error=error_message)
+        return 0, list(chunk)
+
+    outcomes = await asyncio.gather(
+        *(_safe_chunk(chunk) for chunk in _chunks(message_ids, max(1, settings.GMAIL_BATCH_SIZE)))
+    )
+    replied = sum(chunk_replied for chunk_replied, _ in outcomes)
+    failed_ids = {message_id for _, chunk_failed in outcomes for message_id in chunk_failed}
 
-            # 3. Marca o e-mail como lido no Gmail (mantido)
-            service.users().messages().modify(
-                userId='me', id=msg['id'], body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            print(f"E-mail {msg['id']} processado e marcado como lido.")
+    # Falhas ficam registradas para a próxima execução, e o watermark avança mesmo assim:
+    # uma mensagem que sempre falha não prende a sincronização incremental da conta.
+    await crud_async.record_message_attempts(
+        db, agent.id, failed_ids=sorted(failed_ids),
+        succeeded_ids=[message_id for message_id in message_ids if message_id not in failed_ids],
+    )
+    if failed_ids:
+        given_up = sorted(message_id for message_id in failed_ids if attempts.get(message_id, 0) + 1 >= max_attempts)
+        logger.warning("%d e-mail(s) falharam e serão tentados novamente nas próximas execuções.",
+                       len(failed_ids) - len(given_up))
+        if given_up:
+            logger.error("%d e-mail(s) falharam %d vezes e não serão mais tentados: %s",
+                         len(given_up), max_attempts, ", ".join(given_up))
+    if truncated:
+        # Ainda há mensagens pendentes: a próxima execução refaz a listagem de is:unread,
+        # que já exclui o que foi respondido agora, e estabelece um novo watermark.
+        await crud_async.update_agent_history_id(db, agent, None)
+    else:
+        await crud_async.update_agent_history_id(db, agent, history_id)
+    return replied
 
-    except HttpError as error:
-        print(f"Ocorreu um erro na API do Gmail: {error}")
-    except Exception as e:
-        print(f"Ocorreu um erro inesperado no processamento de e-mails: {e}")
-        
 def send_new_email(service, to: str, subject: str, body_text: str):
     """
     Cria e envia um novo e-mail (não é uma resposta).
@@ -179,9 +654,9 @@ def send_new_email(service, to: str, subject: str, body_text: str):
         body = {'raw': raw_message}
 
         sent_message = service.users().messages().send(userId='me', body=body).execute()
-        print(f"Novo e-mail enviado com sucesso para {to}. Message ID: {sent_message['id']}")
+        logger.info("Novo e-mail enviado com sucesso para %s. Message ID: %s", to, sent_message['id'])
         return sent_message
     except HttpError as error:
-        print(f"Ocorreu um erro ao enviar o novo e-mail: {error}")
+        logger.error("Ocorreu um erro ao enviar o novo e-mail: %s", error)
         # Lança a exceção para que o endpoint possa tratá-la
-        raise ConnectionError(f"Falha ao enviar e-mail: {error}")
\ No newline at end of file
+        raise ConnectionError(f"Falha ao enviar e-mail: {error}") from error
\ No newline at end of file
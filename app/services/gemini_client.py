@@ -0,0 +1,195 @@
+"""
+Chamadas à API REST do Google Gemini, com limitação de taxa e novas tentativas.
+
+Respostas 429/5xx e falhas de rede são repetidas com backoff exponencial (respeitando o
+cabeçalho Retry-After). Se todas as tentativas falharem, GeminiUnavailableError é lançada
+para que o e-mail continue pendente, em vez de ser marcado como lido sem resposta.
+
+generate_content devolve a resposta completa; stream_generate_content usa
+:streamGenerateContent (SSE) e entrega o texto à medida que é gerado.
+"""
+import asyncio
+import json
+import logging
+import random
+from typing import AsyncIterator
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app import metrics
+from app.config import settings
+from app.services.http_clients import get_gemini_client
+from app.services.rate_limiter import RateLimiter, gemini_rate_limiter
+
+GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1/models"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+THROTTLE_STATUS_CODES = {429, 503}
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiUnavailableError(Exception):
+    """A API do Gemini continuou indisponível ou limitando a taxa após todas as tentativas."""
+
+
+def model_url(method: str) -> str:
+    return f"{GEMINI_API_BASE_URL}/{settings.GEMINI_MODEL_NAME}:{method}?key={settings.GOOGLE_API_KEY}"
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa grosseira (~4 caracteres por token) usada para reservar a cota de tokens."""
+    return max(1, len(text) // 4)
+
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    """Lê o cabeçalho Retry-After, em segundos ou como data HTTP."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter completo, limitado a settings.GEMINI_BACKOFF_MAX."""
+    return random.uniform(0, min(settings.GEMINI_BACKOFF_MAX, settings.GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+async def _wait_before_retry(attempt: int, retry_after: float | None, last_error: str):
+    delay = backoff_delay(attempt) if retry_after is None else min(retry_after, settings.GEMINI_BACKOFF_MAX)
+    logger.warning("API do Gemini indisponível (%s). Nova tentativa em %.1fs.", last_error, delay)
+    await asyncio.sleep(delay)
+
+def _record_success(limiter: RateLimiter, result: dict, estimated: int):
+    """Sinaliza o sucesso ao limitador e acerta a cota de tokens com o custo real."""
+    limiter.concurrency.on_success()
+    used = result.get("usageMetadata", {}).get("totalTokenCount")
+    if used:
+        limiter.tokens.adjust(used - estimated)
+
+def _unavailable(last_error: str) -> GeminiUnavailableError:
+    return GeminiUnavailableError(
+        f"A API do Gemini falhou após {settings.GEMINI_MAX_RETRIES + 1} tentativas ({last_error})."
+    )
+
+
+async def generate_content(
+    prompt: str,
+    client: httpx.AsyncClient | None = None,
+    limiter: RateLimiter | None = None,
+) -> dict:
+    """
+    Chama :generateContent e retorna o JSON da resposta.
+    Erros 4xx não repetíveis são propagados como httpx.HTTPStatusError.
+    """
+    client = client or get_gemini_client()
+    limiter = limiter or gemini_rate_limiter
+    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    estimated = estimate_tokens(prompt)
+    last_error = "sem resposta"
+
+    for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+        delay = None
+        async with limiter.slot(estimated):
+            try:
+                with metrics.observe_call("gemini", "generateContent") as call:
+                    response = await client.post(model_url("generateContent"), json=data)
+                    if response.is_error:
+                        call.failed()
+            except httpx.TransportError as e:
+                last_error = f"erro de rede: {e}"
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    result = response.json()
+                    _record_success(limiter, result, estimated)
+                    return result
+
+                last_error = f"HTTP {response.status_code}"
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    limiter.concurrency.on_throttle()
+                delay = retry_after_seconds(response)
+
+        if attempt < settings.GEMINI_MAX_RETRIES:
+            await _wait_before_retry(attempt, delay, last_error)
+
+    raise _unavailable(last_error)
+
+
+def candidate_text(result: dict) -> str:
+    """Texto do primeiro candidato de uma resposta (ou de um trecho do stream)."""
+    parts = (result.get("candidates") or [{}])[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+async def _sse_events(response: httpx.Response) -> AsyncIterator[dict]:
+    """Lê um corpo text/event-stream e produz o JSON de cada evento."""
+    data_lines: list[str] = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[5:].strip())
+        elif not line and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+async def stream_generate_content(
+    prompt: str,
+    client: httpx.AsyncClient | None = None,
+    limiter: RateLimiter | None = None,
+) -> AsyncIterator[str]:
+    """
+    Chama :streamGenerateContent?alt=sse e produz os trechos de texto conforme chegam.
+    Falhas antes do primeiro trecho são repetidas como em generate_content. Depois que
+    algum texto foi entregue, repetir duplicaria a resposta: a falha vira
+    GeminiUnavailableError. A vaga no limitador fica reservada durante todo o stream.
+    """
+    client = client or get_gemini_client()
+    limiter = limiter or gemini_rate_limiter
+    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    estimated = estimate_tokens(prompt)
+    last_error = "sem resposta"
+    streamed = False
+
+    for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+        delay = None
+        async with limiter.slot(estimated):
+            try:
+                # Mede o stream inteiro, até o último trecho
+                with metrics.observe_call("gemini", "streamGenerateContent") as call:
+                    async with client.stream(
+                        "POST", model_url("streamGenerateContent") + "&alt=sse", json=data
+                    ) as response:
+                        if response.status_code not in RETRYABLE_STATUS_CODES:
+                            if response.is_error:
+                                await response.aread()
+                                response.raise_for_status()
+                            last_event: dict = {}
+                            async for event in _sse_events(response):
+                                last_event = event
+                                text = candidate_text(event)
+                                if text:
+                                    streamed = True
+                                    yield text
+                            # O último evento traz o usageMetadata da resposta inteira
+                            _record_success(limiter, last_event, estimated)
+                            return
+
+                        call.failed()
+                        last_error = f"HTTP {response.status_code}"
+                        if response.status_code in THROTTLE_STATUS_CODES:
+                            limiter.concurrency.on_throttle()
+                        delay = retry_after_seconds(response)
+            except httpx.TransportError as e:
+                if streamed:
+                    raise GeminiUnavailableError(f"O stream do Gemini foi interrompido: {e}") from e
+                last_error = f"erro de rede: {e}"
+
+        if attempt < settings.GEMINI_MAX_RETRIES:
+            await _wait_before_retry(attempt, delay, last_error)
+
+    raise _unavailable(last_error)
@@ -0,0 +1,85 @@
+import httpx
+
+from app.config import settings
+
+# --- Cliente HTTP compartilhado para a API do Gemini ---
+# Criado uma única vez no lifespan da aplicação para reaproveitar conexões
+# (keep-alive/HTTP2) em vez de refazer o handshake TCP+TLS a cada e-mail.
+_gemini_client: httpx.AsyncClient | None = None
+
+
+def create_gemini_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """
+    Cria um cliente HTTP assíncrono com pool de conexões configurado a partir do Settings.
+    Um `transport` pode ser informado para substituir a rede (ex.: httpx.MockTransport nos testes).
+    """
+    limits = httpx.Limits(
+        max_connections=settings.GEMINI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GEMINI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.GEMINI_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.GEMINI_TIMEOUT, connect=settings.GEMINI_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(
+        http2=settings.GEMINI_HTTP2,
+        limits=limits,
+        timeout=timeout,
+        transport=transport,
+    )
+
+
+async def init_gemini_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """Inicializa (ou substitui) o cliente compartilhado. Chamado no startup da aplicação."""
+    global _gemini_client
+    await close_gemini_client()
+    _gemini_client = create_gemini_client(transport=transport)
+    return _gemini_client
+
+
+async def close_gemini_client():
+    """Fecha o cliente compartilhado e libera as conexões do pool."""
+    global _gemini_client
+    if _gemini_client is not None:
+        client, _gemini_client = _gemini_client, None
+        await client.aclose()
+
+
+def get_gemini_client() -> httpx.AsyncClient:
+    """
+    Retorna o cliente compartilhado. Se a aplicação foi usada fora do lifespan
+    (ex.: scripts), o cliente é criado sob demanda na primeira chamada.
+    """
+    global _gemini_client
+    if _gemini_client is None or _gemini_client.is_closed:
+        _gemini_client = create_gemini_client()
+    return _gemini_client
+
+
+# --- Cliente HTTP compartilhado para os webhooks dos agentes ---
+# Separado do cliente do Gemini: webhooks lentos ou fora do ar não ocupam as conexões
+# usadas para gerar respostas.
+_webhook_client: httpx.AsyncClient | None = None
+
+
+def create_webhook_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.WEBHOOK_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.WEBHOOK_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.WEBHOOK_TIMEOUT, connect=settings.WEBHOOK_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, transport=transport)
+
+
+async def close_webhook_client():
+    global _webhook_client
+    if _webhook_client is not None:
+        client, _webhook_client = _webhook_client, None
+        await client.aclose()
+
+
+def get_webhook_client() -> httpx.AsyncClient:
+    """Retorna o cliente dos webhooks, criado sob demanda na primeira entrega."""
+    global _webhook_client
+    if _webhook_client is None or _webhook_client.is_closed:
+        _webhook_client = create_webhook_client()
+    return _webhook_client
@@ -0,0 +1,216 @@
+"""
+Execução dos jobs de processamento de e-mails (tabela processing_jobs).
+
+POST /agents/{id}/process-emails apenas cria o job e devolve o id; o pipeline roda
+aqui, fora da requisição. A cada settings.JOB_PROGRESS_INTERVAL segundos, os contadores
+e o resultado de cada mensagem concluída são gravados junto com um heartbeat, e o
+pedido de cancelamento é verificado. Jobs na fila ou cujo processo caiu (heartbeat
+parado há mais de settings.JOB_STALE_AFTER) são retomados pela varredura periódica,
+então um job sobrevive a reinícios da API.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud_async, metrics, models
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.services.email_service import process_and_reply_to_emails
+
+logger = logging.getLogger(__name__)
+
+
+class _JobProgress:
+    """
+    Acumula os eventos do pipeline (ver ProgressCallback) até a próxima gravação.
+    Um job retomado continua a partir dos contadores já gravados.
+    """
+
+    def __init__(self, job: models.ProcessingJob):
+        self.replied = job.replied_messages
+        self.failed = job.failed_messages
+        self.no_reply = job.processed_messages - job.replied_messages - job.failed_messages
+        self._already_processed = job.processed_messages
+        self.total = job.total_messages
+        self._started_at: dict[str, datetime] = {}
+        self._finished: set[str] = set()
+        self._pending: list[dict] = []
+
+    def _finish(self, message_id: str, outcome: models.MessageOutcomeEnum, error: str | None = None):
+        if message_id in self._finished:
+            return
+        self._finished.add(message_id)
+        if outcome == models.MessageOutcomeEnum.replied:
+            self.replied += 1
+        elif outcome == models.MessageOutcomeEnum.failed:
+            self.failed += 1
+        else:
+            self.no_reply += 1
+        self._pending.append({
+            "gmail_message_id": message_id,
+            "outcome": outcome,
+            "error_message": error,
+            "started_at": self._started_at.pop(message_id, None),
+            "finished_at": datetime.now(timezone.utc),
+        })
+
+    def on_event(self, event: dict):
+        name = event["event"]
+        if name == "listed":
+            self.total = self._already_processed + event["count"]
+        elif name == "fetched":
+            self._started_at[event["message_id"]] = datetime.now(timezone.utc)
+        elif name == "sent":
+            self._finish(event["message_id"], models.MessageOutcomeEnum.replied)
+        elif name == "failed":
+            self._finish(event["message_id"], models.MessageOutcomeEnum.failed, event["error"])
+        elif name == "marked_read":
+            # Mensagens tratadas sem erro e sem resposta enviada
+            for message_id in event["message_ids"]:
+                self._finish(message_id, models.MessageOutcomeEnum.no_reply)
+
+    def counters(self) -> dict:
+        return {
+            "total_messages": self.total,
+            "processed_messages": self.replied + self.failed + self.no_reply,
+            "replied_messages": self.replied,
+            "failed_messages": self.failed,
+        }
+
+    def drain(self) -> list[dict]:
+        """Resultados por mensagem ainda não gravados."""
+        pending, self._pending = self._pending, []
+        return pending
+
+
+class JobRunner:
+    """
+    Executa os jobs de processamento deste processo, no máximo `max_concurrency` ao
+    mesmo tempo. Cada job é assumido com um UPDATE condicional, então vários processos
+    podem varrer a mesma tabela sem executar um job duas vezes.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        max_concurrency: int | None = None,
+        progress_interval: float | None = None,
+        stale_after: float | None = None,
+        sweep_interval: float | None = None,
+    ):
+        self.session_factory = session_factory
+        self.max_concurrency = max(1, max_concurrency or settings.JOB_MAX_CONCURRENCY)
+        self.progress_interval = progress_interval or settings.JOB_PROGRESS_INTERVAL
+        self.stale_after = stale_after or settings.JOB_STALE_AFTER
+        self.sweep_interval = sweep_interval or settings.JOB_SWEEP_INTERVAL
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # O semáforo pertence ao event loop em que foi criado
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def submit(self, job_id: int) -> asyncio.Task:
+        """Agenda a execução de um job neste processo (sem efeito se ele já está agendado)."""
+        task = self._tasks.get(job_id)
+        if task is None:
+            task = asyncio.create_task(self.run_job(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return task
+
+    async def resume_pending(self) -> list[int]:
+        """Agenda os jobs na fila ou parados. Retorna os ids agendados."""
+        async with self.session_factory() as db:
+            job_ids = await crud_async.list_resumable_processing_job_ids(db, self.stale_after)
+        job_ids = [job_id for job_id in job_ids if job_id not in self._tasks]
+        for job_id in job_ids:
+            self.submit(job_id)
+        return job_ids
+
+    async def run(self, stop_event: asyncio.Event):
+        """Varre periodicamente os jobs pendentes até `stop_event` ser sinalizado."""
+        while not stop_event.is_set():
+            try:
+                await self.resume_pending()
+            except Exception as e:
+                logger.exception("Jobs: erro ao buscar jobs pendentes: %s", e)
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Interrompe os jobs em execução; eles voltam para a fila e são retomados depois."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _process(self, agent_id: int, on_event) -> int:
+        # Sessão própria: o laço de progresso grava no banco ao mesmo tempo
+        async with self.session_factory() as db:
+            agent = await crud_async.get_agent_by_id(db, agent_id=agent_id)
+            if not agent:
+                raise ValueError("Agente não encontrado.")
+            return await process_and_reply_to_emails(db=db, agent=agent, on_event=on_event)
+
+    async def _save(self, job_id: int, progress: _JobProgress, **values) -> bool:
+        async with self.session_factory() as db:
+            return await crud_async.save_processing_job_progress(
+                db, job_id, progress.counters(), progress.drain(), **values
+            )
+
+    async def run_job(self, job_id: int):
+        """Assume e executa um job, gravando o progresso até o fim."""
+        async with self._get_semaphore():
+            async with self.session_factory() as db:
+                if not await crud_async.claim_processing_job(db, job_id, self.stale_after):
+                    return  # Já concluído, cancelado ou assumido por outro processo
+                job = await db.get(models.ProcessingJob, job_id)
+
+            progress = _JobProgress(job)
+            if job.cancel_requested:
+                await self._save(
+                    job_id, progress, status=models.JobStatusEnum.cancelled, finished_at=datetime.now(timezone.utc)
+                )
+                return
+            pipeline = asyncio.create_task(self._process(job.account_id, progress.on_event))
+            try:
+                while True:
+                    done, _ = await asyncio.wait({pipeline}, timeout=self.progress_interval)
+                    if done:
+                        break
+                    if await self._save(job_id, progress) and not pipeline.done():
+                        pipeline.cancel()
+                        await asyncio.wait({pipeline})
+                        break
+            except asyncio.CancelledError:
+                # Processo encerrando: o job volta para a fila com o progresso já feito
+                pipeline.cancel()
+                await asyncio.gather(pipeline, return_exceptions=True)
+                await asyncio.shield(self._save(job_id, progress, status=models.JobStatusEnum.queued))
+                raise
+
+            values = {"finished_at": datetime.now(timezone.utc)}
+            if pipeline.cancelled():
+                values["status"] = models.JobStatusEnum.cancelled
+            elif pipeline.exception() is not None:
+                logger.error("Jobs: o job %s falhou: %s", job_id, pipeline.exception(), extra={"job_id": job_id})
+                values["status"] = models.JobStatusEnum.failed
+                values["error_message"] = str(pipeline.exception())
+            else:
+                values["status"] = models.JobStatusEnum.completed
+            await self._save(job_id, progress, **values)
+
+
+job_runner = JobRunner()
+metrics.register_queue("jobs", lambda: len(job_runner._tasks))
@@ -0,0 +1,51 @@
+"""
+Uma execução do pipeline por caixa de entrada de cada vez.
+
+Os jobs (POST /process-emails), o stream de progresso e o agendador chamam
+process_and_reply_to_emails de forma independente. Duas execuções simultâneas para a
+mesma conta listariam as mesmas mensagens não lidas antes que qualquer uma as marcasse
+como lidas, e o remetente receberia respostas duplicadas. Por isso cada execução
+segura um lock da conta: um asyncio.Lock dentro do processo e, no PostgreSQL, um
+advisory lock (válido entre processos). A segunda execução espera a primeira terminar
+e então só encontra o que continua não lido.
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Primeira chave do advisory lock de dois inteiros (a segunda é o id da conta)
+MAILBOX_LOCK_NAMESPACE = 7301
+
+_local_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def _local_lock(account_id: int) -> asyncio.Lock:
+    lock = _local_locks.get(account_id)
+    if lock is None:
+        lock = _local_locks[account_id] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def mailbox_lock(db: AsyncSession, account_id: int):
+    """Aguarda e segura o lock da caixa de entrada da conta durante o bloco."""
+    async with _local_lock(account_id):
+        engine = db.bind
+        if engine is None or engine.dialect.name != "postgresql":
+            yield
+            return
+
+        # Conexão própria: o advisory lock pertence à conexão, e a sessão do pipeline
+        # devolve a sua ao pool a cada commit. O commit logo após adquirir evita
+        # deixar a conexão "idle in transaction" durante a execução.
+        async with engine.connect() as conn:
+            await conn.execute(select(func.pg_advisory_lock(MAILBOX_LOCK_NAMESPACE, account_id)))
+            await conn.commit()
+            try:
+                yield
+            finally:
+                await conn.execute(select(func.pg_advisory_unlock(MAILBOX_LOCK_NAMESPACE, account_id)))
+                await conn.commit()
@@ -0,0 +1,111 @@
+"""
+Extração do texto de uma mensagem do Gmail (payload do formato 'full').
+
+A árvore de partes é percorrida uma única vez, em ordem, sem recursão. O texto é
+acumulado em uma lista e juntado no final, e a decodificação para assim que o limite
+de tamanho é atingido, sem decodificar partes enormes por inteiro.
+"""
+import base64
+import codecs
+import html
+import re
+
+from app.config import settings
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+
+# --- Conversão rápida de HTML para texto ---
+_HTML_DROP = re.compile(r"<(script|style|head)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK = re.compile(r"<(br|/p|/div|/li|/tr|/h[1-6]|/blockquote)\b[^>]*>", re.IGNORECASE)
+_HTML_INLINE = re.compile(r"</?(a|b|i|u|em|strong|span|font|small|big|sub|sup|mark|code)\b[^>]*>", re.IGNORECASE)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def html_to_text(markup: str) -> str:
+    """Converte HTML em texto simples: remove scripts/estilos e tags e preserva quebras de linha."""
+    text = _HTML_DROP.sub(" ", markup)
+    text = _HTML_BREAK.sub("\n", text)
+    text = _HTML_INLINE.sub("", text)  # tags inline não separam palavras
+    text = html.unescape(_HTML_TAG.sub(" ", text)).replace("\xa0", " ")
+    text = _SPACES.sub(" ", text)
+    return _BLANK_LINES.sub("\n\n", "\n".join(line.strip() for line in text.split("\n"))).strip()
+
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((h.get("value", "") for h in part.get("headers", []) if h.get("name", "").lower() == name), "")
+
+def _charset(part: dict) -> str:
+    match = _CHARSET.search(_header(part, "Content-Type"))
+    charset = match.group(1).lower() if match else "utf-8"
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return charset
+
+def _is_attachment(part: dict) -> bool:
+    return bool(part.get("filename")) or _header(part, "Content-Disposition").lower().startswith("attachment")
+
+def _decode_data(data: str, charset: str, max_bytes: int) -> str:
+    """
+    Decodifica o base64url de uma parte, lendo no máximo `max_bytes` bytes.
+    Apenas o prefixo necessário do base64 é decodificado; um caractere multibyte
+    cortado no fim é descartado em vez de virar lixo.
+    """
+    prefix_length = -(-max_bytes // 3) * 4  # 4 caracteres base64 para cada 3 bytes
+    truncated = len(data) > prefix_length
+    chunk = data[:prefix_length] if truncated else data
+    chunk += "=" * (-len(chunk) % 4)
+    raw = base64.urlsafe_b64decode(chunk)[:max_bytes]
+    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    return decoder.decode(raw, final=not truncated)
+
+
+def decode_message_body(payload: dict, max_chars: int | None = None) -> str:
+    """
+    Retorna o corpo em texto de uma mensagem, com no máximo `max_chars` caracteres
+    (padrão: settings.EMAIL_BODY_MAX_CHARS).
+
+    Percorre partes multipart aninhadas (mixed, related, alternative...), respeita o
+    charset declarado em cada parte e ignora anexos. As partes text/plain têm
+    preferência; se não houver nenhuma, o text/html é convertido para texto.
+    """
+    max_chars = max_chars or settings.EMAIL_BODY_MAX_CHARS
+    plain: list[str] = []
+    plain_size = 0
+    html_parts: list[str] = []
+    html_size = 0
+    # Marcação HTML costuma ser bem maior que o texto que ela contém
+    html_budget = max_chars * 4
+
+    stack = [payload]
+    while stack and plain_size < max_chars:
+        part = stack.pop()
+        mime_type = part.get("mimeType", "").lower()
+
+        if mime_type.startswith("multipart/"):
+            stack.extend(reversed(part.get("parts", [])))  # mantém a ordem do documento
+            continue
+
+        data = part.get("body", {}).get("data")
+        if not data or _is_attachment(part):
+            continue
+
+        if mime_type == "text/plain":
+            remaining = max_chars - plain_size
+            text = _decode_data(data, _charset(part), remaining * 4)[:remaining]
+            plain.append(text)
+            plain_size += len(text)
+        elif mime_type == "text/html" and not plain and html_size < html_budget:
+            markup = _decode_data(data, _charset(part), (html_budget - html_size) * 4)
+            html_parts.append(markup)
+            html_size += len(markup)
+
+    if plain:
+        return "".join(plain)
+    if html_parts:
+        return html_to_text("".join(html_parts))[:max_chars]
+    return ""
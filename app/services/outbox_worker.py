@@ -0,0 +1,157 @@
+"""
+Workers da fila de envio de e-mails (tabela outgoing_emails).
+
+Os workers podem rodar junto com a API (settings.OUTBOX_WORKERS) ou em processos
+separados, escalando horizontalmente:
+
+    python -m app.services.outbox_worker --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import random
+
+import httplib2
+from googleapiclient.errors import HttpError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import crud, metrics, models
+from app.config import settings
+from app.database import SessionLocal
+from app.logging_config import configure_logging
+from app.security import get_agent_gmail_service
+from app.services.email_service import send_new_email
+
+logger = logging.getLogger(__name__)
+
+
+# Status do Gmail que indicam falha temporária (cota ou indisponibilidade)
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _is_transient(error: BaseException | None) -> bool:
+    """
+    Erros temporários voltam para a fila com backoff; os demais marcam o e-mail como
+    'failed'. send_new_email embrulha o HttpError em um ConnectionError, por isso a
+    causa original (__cause__) é examinada antes do próprio erro.
+    """
+    if error is None:
+        return False
+    if isinstance(error, HttpError):
+        return getattr(error.resp, "status", None) in TRANSIENT_STATUS_CODES
+    if error.__cause__ is not None:
+        return _is_transient(error.__cause__)
+    if type(error) is ConnectionError:
+        return False
+    return isinstance(error, (TimeoutError, OSError, httplib2.HttpLib2Error))
+
+
+def retry_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter completo, limitado a settings.OUTBOX_BACKOFF_MAX."""
+    return random.uniform(0, min(settings.OUTBOX_BACKOFF_MAX, settings.OUTBOX_BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+def _send(email: models.OutgoingEmail) -> BaseException | None:
+    """Envia um e-mail reservado, fora de qualquer transação. Retorna o erro, se houver."""
+    try:
+        with metrics.agent_context(email.account_id), metrics.observe_stage("outbox_send"):
+            service = get_agent_gmail_service(agent=email.account)
+            send_new_email(service=service, to=email.recipient, subject=email.subject, body_text=email.body)
+        return None
+    except Exception as e:
+        return e
+
+
+def _record_result(db: Session, email: models.OutgoingEmail, error: BaseException | None):
+    if error is None:
+        crud.mark_outgoing_email_sent(email)
+    elif _is_transient(error) and email.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+        delay = retry_delay(email.attempts)
+        logger.warning("Falha temporária ao enviar o e-mail %s da fila (tentativa %d): %s. Nova tentativa em %.0fs.",
+                       email.id, email.attempts, error, delay,
+                       extra={"outgoing_email_id": email.id, "account_id": email.account_id})
+        crud.mark_outgoing_email_retry(email, str(error), delay)
+    else:
+        logger.error("Falha ao enviar o e-mail %s da fila: %s", email.id, error,
+                     extra={"outgoing_email_id": email.id, "account_id": email.account_id})
+        crud.mark_outgoing_email_failed(email, str(error))
+    db.add(email)
+    db.commit()
+
+
+def process_outbox_batch(session_factory: sessionmaker = SessionLocal, batch_size: int | None = None) -> int:
+    """
+    Reserva um lote de e-mails da fila (status 'sending', com prazo de
+    settings.OUTBOX_LEASE_SECONDS) em uma transação curta, envia cada um fora dela e
+    grava o resultado de cada envio assim que ele termina. Erros temporários (429/5xx,
+    falhas de rede) devolvem o e-mail à fila com backoff até settings.OUTBOX_MAX_ATTEMPTS;
+    os demais o marcam como 'failed'. Se o processo cair no meio do lote, a reserva
+    vence e outro worker reenvia os e-mails pendentes. Retorna o tamanho do lote.
+    """
+    with session_factory(expire_on_commit=False) as db:
+        emails = crud.claim_queued_emails(db, limit=batch_size or settings.OUTBOX_BATCH_SIZE,
+                                          lease_seconds=settings.OUTBOX_LEASE_SECONDS)
+        db.commit()
+
+    for email in emails:
+        error = _send(email)
+        with session_factory(expire_on_commit=False) as db:
+            _record_result(db, email, error)
+    return len(emails)
+
+
+def outbox_queue_depth(session_factory: sessionmaker = SessionLocal) -> float:
+    """Tamanho da fila de envio, lido a cada coleta do GET /metrics (NaN se o banco falhar)."""
+    try:
+        with session_factory() as db:
+            return crud.count_queued_emails(db)
+    except SQLAlchemyError as e:
+        logger.warning("Não foi possível medir a fila de envio: %s", e)
+        return float("nan")
+
+
+metrics.register_queue("outbox", outbox_queue_depth)
+
+
+async def run_outbox_worker(stop_event: asyncio.Event, session_factory: sessionmaker = SessionLocal):
+    """
+    Laço de um worker: processa lotes enquanto houver e-mails na fila e aguarda
+    settings.OUTBOX_POLL_INTERVAL quando ela esvazia. Termina quando `stop_event` é sinalizado.
+    """
+    while not stop_event.is_set():
+        try:
+            processed = await asyncio.to_thread(process_outbox_batch, session_factory)
+        except Exception as e:
+            logger.exception("Erro inesperado no worker da fila de envio: %s", e)
+            processed = 0
+        if processed:
+            continue
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox_workers(stop_event: asyncio.Event, count: int | None = None) -> list[asyncio.Task]:
+    """Inicia `count` workers (padrão: settings.OUTBOX_WORKERS) no event loop atual."""
+    count = settings.OUTBOX_WORKERS if count is None else count
+    return [asyncio.create_task(run_outbox_worker(stop_event)) for _ in range(max(0, count))]
+
+
+async def _run_forever(count: int):
+    stop_event = asyncio.Event()
+    workers = start_outbox_workers(stop_event, count)
+    logger.info("%d worker(s) da fila de envio iniciados.", len(workers))
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        stop_event.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workers da fila de envio de e-mails.")
+    parser.add_argument("--workers", type=int, default=settings.OUTBOX_WORKERS)
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(_run_forever(args.workers))
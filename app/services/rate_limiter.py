@@ -0,0 +1,147 @@
+"""
+Limitação de taxa do lado do cliente para chamadas a APIs externas (Gemini).
+
+- TokenBucket: limita requisições ou tokens por minuto; quem excede espera na fila.
+- AdaptiveConcurrencyLimiter: AIMD — cresce devagar a cada sucesso e cai pela metade
+  a cada sinal de sobrecarga (429/503).
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from app.config import settings
+
+
+class _LoopBound:
+    """
+    Base para objetos com primitivas asyncio criadas sob demanda. Instâncias de
+    módulo podem ser usadas por event loops diferentes (ex.: testes, scripts).
+    """
+
+    _loop: asyncio.AbstractEventLoop | None = None
+
+    def _bind_loop(self) -> bool:
+        """Retorna True se as primitivas precisaram ser (re)criadas para o loop atual."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return False
+        self._loop = loop
+        return True
+
+
+class TokenBucket(_LoopBound):
+    """
+    Balde de fichas com reposição contínua de `per_minute` fichas por minuto.
+    As chamadas a `acquire` são atendidas em ordem de chegada (FIFO).
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate_per_second = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock: asyncio.Lock | None = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        """Aguarda até haver `amount` fichas disponíveis e as consome."""
+        if self._bind_loop():
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Pedidos maiores que o balde esperam o balde encher e deixam o saldo negativo.
+            needed = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((needed - self._tokens) / self.rate_per_second)
+
+    def adjust(self, amount: float):
+        """Debita (positivo) ou devolve (negativo) fichas após saber o custo real."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrencyLimiter(_LoopBound):
+    """Limite de requisições simultâneas ajustado por AIMD (additive increase, multiplicative decrease)."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._condition: asyncio.Condition | None = None
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.minimum, math.floor(self.limit))
+
+    async def acquire(self):
+        if self._bind_loop():
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        # +1 no limite a cada "janela" completa de sucessos
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(float(self.minimum), self.limit / 2)
+
+
+class RateLimiter:
+    """Combina limites de requisições/minuto, tokens/minuto e concorrência adaptativa."""
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=max_concurrency, minimum=min_concurrency, maximum=max_concurrency
+        )
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """Reserva uma vaga para uma requisição, aguardando na fila se necessário."""
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+        await self.concurrency.acquire()
+        try:
+            yield self
+        finally:
+            await self.concurrency.release()
+
+
+gemini_rate_limiter = RateLimiter(
+    requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.GEMINI_TOKENS_PER_MINUTE,
+    max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+    min_concurrency=settings.GEMINI_MIN_CONCURRENCY,
+)
+
+# Resumos encaminhados aos webhooks (app/services/summary_forwarder.py): limitador próprio,
+# para que uma rajada de resumos nunca atrase as respostas do pipeline.
+summary_rate_limiter = RateLimiter(
+    requests_per_minute=settings.SUMMARY_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.SUMMARY_TOKENS_PER_MINUTE,
+    max_concurrency=settings.SUMMARY_MAX_CONCURRENCY,
+    min_concurrency=settings.GEMINI_MIN_CONCURRENCY,
+)
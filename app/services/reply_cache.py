@@ -0,0 +1,225 @@
+"""
+Cache de respostas da IA endereçado pelo conteúdo do e-mail.
+
+Mensagens idênticas (comunicados em massa, a mesma pergunta enviada a vários agentes)
+reaproveitam a resposta já gerada em vez de chamar o Gemini de novo. O cache tem dois
+níveis: um LRU em memória, por processo, e a tabela ai_reply_cache, compartilhada.
+O nível persistente abre as próprias sessões assíncronas, curtas, para que mensagens
+processadas em paralelo não disputem a mesma sessão.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import models
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_REPLY_PREFIXES = re.compile(r"^((re|res|fw|fwd|enc)\s*:\s*)+", re.IGNORECASE)
+
+
+def _normalize_text(text: str | None) -> str:
+    return _WHITESPACE.sub(" ", text or "").strip().lower()
+
+def reply_cache_key(sender: str, subject: str, body: str, model_name: str, prompt_version: str) -> str:
+    """
+    Chave do cache: SHA-256 de (remetente, assunto, corpo, modelo, versão do prompt),
+    com espaços colapsados, caixa baixa e prefixos como "Re:"/"Fwd:" removidos do assunto.
+    O remetente entra completo (nome e endereço), como aparece no prompt: a resposta pode
+    citá-lo, então nunca é reaproveitada para outra pessoa, mesmo do mesmo domínio.
+    """
+    subject = _REPLY_PREFIXES.sub("", _normalize_text(subject))
+    parts = (_normalize_text(sender), subject, _normalize_text(body), model_name, prompt_version)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """LRU em memória com TTL, apoiado pela tabela persistente ai_reply_cache."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.session_factory = session_factory
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    # --- Nível em memória ---
+    def _memory_get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            reply, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return reply
+
+    def _memory_put(self, key: str, reply: str, ttl_seconds: float):
+        with self._lock:
+            self._memory[key] = (reply, time.monotonic() + ttl_seconds)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # --- API pública ---
+    async def get(self, key: str) -> str | None:
+        """Busca a resposta em memória e, se não estiver lá, na tabela persistente."""
+        reply = self._memory_get(key)
+        if reply is not None:
+            self.memory_hits += 1
+            return reply
+
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as db:
+            row = await db.scalar(
+                select(models.AIReplyCache)
+                .where(models.AIReplyCache.cache_key == key, models.AIReplyCache.expires_at > now)
+            )
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.persistent_hits += 1
+        expires_at = row.expires_at if row.expires_at.tzinfo else row.expires_at.replace(tzinfo=timezone.utc)
+        self._memory_put(key, row.reply_text, (expires_at - now).total_seconds())
+        return row.reply_text
+
+    async def put(self, key: str, reply: str, model_name: str, prompt_version: str):
+        """Grava a resposta nos dois níveis do cache."""
+        self._memory_put(key, reply, self.ttl_seconds)
+        async with self.session_factory() as db:
+            await db.merge(models.AIReplyCache(
+                cache_key=key,
+                model_name=model_name,
+                prompt_version=prompt_version,
+                reply_text=reply,
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            ))
+            await db.commit()
+
+    async def get_or_generate(
+        self,
+        key: str,
+        generate: Callable[[], Awaitable[str]],
+        model_name: str,
+        prompt_version: str,
+    ) -> str:
+        """
+        Retorna a resposta em cache ou a gera com `generate`. Mensagens idênticas
+        processadas ao mesmo tempo aguardam uma única geração. Respostas vazias
+        (falha da IA) não são guardadas.
+        """
+        reply = await self.get(key)
+        if reply is not None:
+            return reply
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            reply = await generate()
+            if reply:
+                await self.put(key, reply, model_name, prompt_version)
+            future.set_result(reply)
+            return reply
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Evita o aviso de exceção não consumida quando ninguém aguarda
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def invalidate(
+        self,
+        key: str | None = None,
+        model_name: str | None = None,
+        prompt_version: str | None = None,
+    ) -> int:
+        """
+        Remove entradas do cache: uma chave específica, todas de um modelo e/ou versão
+        do prompt, ou tudo quando nenhum filtro é informado. Retorna as linhas removidas.
+        """
+        stmt = delete(models.AIReplyCache)
+        if key is not None:
+            stmt = stmt.where(models.AIReplyCache.cache_key == key)
+        if model_name is not None:
+            stmt = stmt.where(models.AIReplyCache.model_name == model_name)
+        if prompt_version is not None:
+            stmt = stmt.where(models.AIReplyCache.prompt_version == prompt_version)
+        async with self.session_factory() as db:
+            deleted = (await db.execute(stmt)).rowcount
+            await db.commit()
+
+        with self._lock:
+            if key is not None:
+                self._memory.pop(key, None)
+            else:
+                # O nível em memória não guarda modelo/versão: descarta tudo por segurança.
+                self._memory.clear()
+        return deleted
+
+    async def purge_expired(self) -> int:
+        """Remove da tabela persistente as entradas cujo TTL já venceu."""
+        stmt = delete(models.AIReplyCache).where(models.AIReplyCache.expires_at <= datetime.now(timezone.utc))
+        async with self.session_factory() as db:
+            deleted = (await db.execute(stmt)).rowcount
+            await db.commit()
+        return deleted
+
+    async def run_purger(self, stop_event: asyncio.Event):
+        """Laço em segundo plano que remove as entradas vencidas a cada settings.REPLY_CACHE_PURGE_INTERVAL."""
+        while not stop_event.is_set():
+            try:
+                deleted = await self.purge_expired()
+                if deleted:
+                    logger.info("%d resposta(s) vencida(s) removida(s) do cache.", deleted)
+            except Exception as e:
+                logger.exception("Erro inesperado ao limpar o cache de respostas: %s", e)
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=settings.REPLY_CACHE_PURGE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        """Contadores de acerto/erro desde o início do processo."""
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        hits = self.memory_hits + self.persistent_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+reply_cache = ReplyCache(
+    max_entries=settings.REPLY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.REPLY_CACHE_TTL,
+)
@@ -0,0 +1,173 @@
+"""
+Agendador que processa periodicamente as caixas de entrada de todos os agentes autorizados.
+
+Cada processo cuida apenas das contas do seu shard (crc32(account_id) % SCHEDULER_SHARD_COUNT),
+então a carga pode ser dividida entre vários processos:
+
+    python -m app.services.scheduler --shard-index 0 --shard-count 4
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud_async, models
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.logging_config import configure_logging
+from app.services.email_service import process_and_reply_to_emails
+
+logger = logging.getLogger(__name__)
+
+
+def account_shard(account_id: int, shard_count: int) -> int:
+    """Shard estável de uma conta (não depende da semente de hash do processo)."""
+    return zlib.crc32(str(account_id).encode()) % shard_count
+
+
+class _AgentSchedule:
+    """Estado de agendamento de uma conta: próxima execução e execuções ociosas seguidas."""
+
+    __slots__ = ("next_run_at", "idle_runs")
+
+    def __init__(self, next_run_at: float):
+        self.next_run_at = next_run_at
+        self.idle_runs = 0
+
+
+class PollingScheduler:
+    """
+    Dispara process_and_reply_to_emails para cada conta autorizada do shard.
+
+    - Divisão justa: as contas são atendidas pela ordem de vencimento, no máximo
+      `concurrency` ao mesmo tempo, e cada execução trata até `max_messages` mensagens,
+      para que uma caixa muito cheia não monopolize os workers.
+    - Jitter: cada intervalo varia aleatoriamente em ±`jitter` para evitar rajadas sincronizadas.
+    - Backoff: a cada execução sem respostas o intervalo da conta dobra, até `max_interval`.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        interval: float | None = None,
+        max_interval: float | None = None,
+        jitter: float | None = None,
+        concurrency: int | None = None,
+        max_messages: int | None = None,
+        shard_index: int | None = None,
+        shard_count: int | None = None,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval or settings.SCHEDULER_INTERVAL
+        self.max_interval = max(self.interval, max_interval or settings.SCHEDULER_MAX_INTERVAL)
+        self.jitter = settings.SCHEDULER_JITTER if jitter is None else jitter
+        self.concurrency = max(1, concurrency or settings.SCHEDULER_CONCURRENCY)
+        self.max_messages = max_messages or settings.SCHEDULER_MAX_MESSAGES_PER_RUN
+        self.shard_index = settings.SCHEDULER_SHARD_INDEX if shard_index is None else shard_index
+        self.shard_count = max(1, shard_count or settings.SCHEDULER_SHARD_COUNT)
+        self._schedules: dict[int, _AgentSchedule] = {}
+        self._running: set[int] = set()
+
+    def owns(self, account_id: int) -> bool:
+        return account_shard(account_id, self.shard_count) == self.shard_index
+
+    def next_delay(self, idle_runs: int) -> float:
+        """Intervalo até a próxima execução, com backoff exponencial e jitter."""
+        delay = min(self.max_interval, self.interval * (2 ** min(idle_runs, 16)))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _load_account_ids(self) -> list[int]:
+        async with self.session_factory() as db:
+            account_ids = await db.scalars(
+                select(models.Account.id).where(models.Account.encrypted_credentials.isnot(None))
+            )
+            return [account_id for account_id in account_ids if self.owns(account_id)]
+
+    async def reload_accounts(self):
+        """Sincroniza a lista de contas do shard; contas novas começam em um instante aleatório."""
+        account_ids = set(await self._load_account_ids())
+        now = time.monotonic()
+        for account_id in account_ids - self._schedules.keys():
+            self._schedules[account_id] = _AgentSchedule(now + random.uniform(0, self.interval))
+        for account_id in self._schedules.keys() - account_ids:
+            del self._schedules[account_id]
+
+    def due_accounts(self, now: float) -> list[int]:
+        """Contas vencidas que não estão em execução, das mais atrasadas para as mais recentes."""
+        due = [
+            (schedule.next_run_at, account_id)
+            for account_id, schedule in self._schedules.items()
+            if schedule.next_run_at <= now and account_id not in self._running
+        ]
+        return [account_id for _, account_id in sorted(due)]
+
+    async def _poll_account(self, account_id: int) -> int:
+        async with self.session_factory() as db:
+            agent = await crud_async.get_agent_by_id(db, agent_id=account_id)
+            if not agent or not agent.encrypted_credentials:
+                return 0
+            return await process_and_reply_to_emails(db=db, agent=agent, max_messages=self.max_messages)
+
+    async def run_account(self, account_id: int):
+        """Processa uma conta e reagenda a próxima execução conforme a atividade."""
+        replied = 0
+        try:
+            replied = await self._poll_account(account_id)
+        except ConnectionError as e:
+            logger.warning("Agendador: conta %s indisponível: %s", account_id, e, extra={"account_id": account_id})
+        except Exception as e:
+            logger.exception("Agendador: erro inesperado ao processar a conta %s: %s", account_id, e,
+                             extra={"account_id": account_id})
+        finally:
+            self._running.discard(account_id)
+
+        schedule = self._schedules.get(account_id)
+        if schedule is not None:
+            schedule.idle_runs = 0 if replied else schedule.idle_runs + 1
+            schedule.next_run_at = time.monotonic() + self.next_delay(schedule.idle_runs)
+
+    async def run(self, stop_event: asyncio.Event):
+        """Laço principal do agendador, até `stop_event` ser sinalizado."""
+        tasks: set[asyncio.Task] = set()
+        last_reload = float("-inf")
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if now - last_reload >= self.interval:
+                try:
+                    await self.reload_accounts()
+                except Exception as e:
+                    logger.exception("Agendador: erro ao carregar as contas: %s", e)
+                last_reload = now
+
+            for account_id in self.due_accounts(now)[:self.concurrency - len(self._running)]:
+                self._running.add(account_id)
+                task = asyncio.create_task(self.run_account(account_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_forever(scheduler: PollingScheduler):
+    stop_event = asyncio.Event()
+    logger.info("Agendador iniciado para o shard %d/%d.", scheduler.shard_index, scheduler.shard_count)
+    await scheduler.run(stop_event)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agendador de processamento de e-mails.")
+    parser.add_argument("--shard-index", type=int, default=settings.SCHEDULER_SHARD_INDEX)
+    parser.add_argument("--shard-count", type=int, default=settings.SCHEDULER_SHARD_COUNT)
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(_run_forever(PollingScheduler(shard_index=args.shard_index, shard_count=args.shard_count)))
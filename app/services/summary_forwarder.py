@@ -0,0 +1,339 @@
+"""
+Resumo dos e-mails recebidos e encaminhamento para o webhook do agente (Account.forward_url).
+
+O pipeline de respostas apenas enfileira os ids dos e-mails salvos (enqueue, sem
+esperar nada). Daqui em diante tudo roda em segundo plano:
+
+1. Os e-mails são resumidos pelo Gemini em lotes e os resumos são gravados como 'pending'.
+   Os resumos usam um limitador de taxa próprio (summary_rate_limiter), separado do
+   das respostas. A fila em memória é só o caminho rápido: a varredura periódica
+   resume os e-mails recentes que continuam sem resumo (fila cheia, reinício do
+   processo ou resumo vazio, este com backoff entre as tentativas).
+2. Cada resumo é entregue por POST ao webhook, pelo cliente HTTP compartilhado dos
+   webhooks, com no máximo settings.WEBHOOK_MAX_CONCURRENCY_PER_HOST entregas
+   simultâneas por host: um webhook lento só atrasa as entregas para ele mesmo.
+   429/5xx e falhas de rede são repetidos com backoff exponencial.
+3. Os resultados (success/failed) são gravados em lote a cada
+   settings.WEBHOOK_FLUSH_INTERVAL segundos.
+
+Resumos que continuam 'pending' (ex.: o processo reiniciou no meio da entrega) são
+reenviados pela varredura periódica. A entrega é "pelo menos uma vez": o cabeçalho
+Idempotency-Key permite ao destino descartar repetições.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud_async, metrics, models
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.services.gemini_client import GeminiUnavailableError, candidate_text, generate_content, retry_after_seconds
+from app.services.http_clients import get_webhook_client
+from app.services.rate_limiter import summary_rate_limiter
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+async def _generate_summary_with_ai(email: models.ReceivedEmail) -> str:
+    """Resumo curto do e-mail gerado pelo Gemini (vazio se a API não devolver conteúdo)."""
+    if not email.body:
+        return ""
+    prompt = (
+        "Resuma o e-mail abaixo em até três frases, em português, destacando pedidos, "
+        "prazos e próximos passos. Responda apenas com o resumo.\n\n"
+        f"--- E-mail ---\n"
+        f"De: {email.sender}\n"
+        f"Assunto: {email.subject}\n"
+        f"Corpo: {email.body}\n"
+        f"--- Fim do E-mail ---"
+    )
+    try:
+        with metrics.agent_context(email.account_id):
+            return candidate_text(await generate_content(prompt, limiter=summary_rate_limiter)).strip()
+    except (GeminiUnavailableError, httpx.HTTPStatusError) as e:
+        logger.warning("Não foi possível resumir o e-mail %s: %s", email.id, e,
+                       extra={"received_email_id": email.id, "account_id": email.account_id})
+        return ""
+
+
+def _webhook_payload(delivery: dict) -> dict:
+    return {
+        "summary_id": delivery["id"],
+        "account_id": delivery["account_id"],
+        "summary": delivery["summary_text"],
+        "created_at": delivery["created_at"].isoformat() if delivery["created_at"] else None,
+        "email": {
+            "gmail_message_id": delivery["gmail_message_id"],
+            "sender": delivery["sender"],
+            "subject": delivery["subject"],
+            "received_at": delivery["received_at"].isoformat() if delivery["received_at"] else None,
+        },
+    }
+
+
+class SummaryForwarder:
+    """Fila de resumos e entregas aos webhooks de um processo (ver a descrição do módulo)."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        client: httpx.AsyncClient | None = None,
+        per_host_concurrency: int | None = None,
+        max_retries: int | None = None,
+        flush_interval: float | None = None,
+        sweep_interval: float | None = None,
+    ):
+        self.session_factory = session_factory
+        self.client = client
+        self.per_host_concurrency = max(1, per_host_concurrency or settings.WEBHOOK_MAX_CONCURRENCY_PER_HOST)
+        self.max_retries = settings.WEBHOOK_MAX_RETRIES if max_retries is None else max_retries
+        self.flush_interval = flush_interval or settings.WEBHOOK_FLUSH_INTERVAL
+        self.sweep_interval = sweep_interval or settings.WEBHOOK_SWEEP_INTERVAL
+        self._queue: asyncio.Queue[int] = asyncio.Queue(maxsize=settings.SUMMARY_QUEUE_SIZE)
+        self._summarizing: set[int] = set()  # Na fila em memória ou sendo resumidos
+        self._summary_retries: dict[int, tuple[int, float]] = {}  # Resumos vazios: (tentativas, próxima tentativa)
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._deliveries: set[asyncio.Task] = set()
+        self._in_flight: set[int] = set()
+        self._results: list[dict] = []
+
+    # --- Resumos ---
+    def enqueue(self, received_email_ids: list[int]):
+        """Agenda o resumo dos e-mails informados. Nunca bloqueia quem chama."""
+        if not settings.FORWARDING_ENABLED:
+            return
+        for received_email_id in received_email_ids:
+            if received_email_id in self._summarizing:
+                continue
+            try:
+                self._queue.put_nowait(received_email_id)
+            except asyncio.QueueFull:
+                logger.warning("Fila de resumos cheia: o e-mail %s fica para a próxima varredura.", received_email_id,
+                               extra={"received_email_id": received_email_id})
+            else:
+                self._summarizing.add(received_email_id)
+
+    async def summarize(self, received_email_ids: list[int]) -> list[int]:
+        """
+        Resume os e-mails ainda sem resumo de agentes com forward_url, grava os resumos
+        e agenda as entregas. Retorna os ids dos resumos criados.
+        """
+        try:
+            async with self.session_factory() as db:
+                emails = await crud_async.get_emails_to_summarize(db, received_email_ids)
+            texts = await asyncio.gather(*(_generate_summary_with_ai(email) for email, _ in emails))
+            summaries = []
+            for (email, forward_url), text in zip(emails, texts):
+                if text:
+                    self._summary_retries.pop(email.id, None)
+                    summaries.append({"received_email_id": email.id, "account_id": email.account_id,
+                                      "summary_text": text, "forward_url": forward_url})
+                else:
+                    self._schedule_summary_retry(email.id)
+            async with self.session_factory() as db:
+                summary_ids = await crud_async.create_email_summaries(db, summaries)
+                deliveries = await crud_async.list_pending_summary_deliveries(db, summary_ids=summary_ids)
+        finally:
+            self._summarizing.difference_update(received_email_ids)
+        for delivery in deliveries:
+            self.schedule_delivery(delivery)
+        return summary_ids
+
+    def _schedule_summary_retry(self, received_email_id: int):
+        """Adia a próxima tentativa de um resumo que veio vazio (backoff exponencial)."""
+        attempts = self._summary_retries.get(received_email_id, (0, 0.0))[0] + 1
+        delay = min(settings.SUMMARY_RETRY_MAX, settings.SUMMARY_RETRY_BASE * (2 ** (attempts - 1)))
+        self._summary_retries[received_email_id] = (attempts, asyncio.get_running_loop().time() + delay)
+        logger.info("Resumo vazio para o e-mail %s; nova tentativa em %.0fs.", received_email_id, delay,
+                    extra={"received_email_id": received_email_id})
+
+    async def resume_missing_summaries(self) -> int:
+        """
+        Enfileira os e-mails recentes que continuam sem resumo (a fila em memória estava
+        cheia, o processo reiniciou ou o resumo veio vazio). Retorna quantos foram enfileirados.
+        """
+        capacity = self._queue.maxsize - self._queue.qsize() if self._queue.maxsize else settings.SUMMARY_QUEUE_SIZE
+        if capacity <= 0:
+            return 0
+        received_after = datetime.now(timezone.utc) - timedelta(seconds=settings.SUMMARY_SWEEP_LOOKBACK)
+        async with self.session_factory() as db:
+            missing = await crud_async.list_emails_missing_summary(
+                db, received_after=received_after, limit=capacity + len(self._summarizing)
+            )
+        # Esquece o backoff de e-mails que já ganharam resumo ou saíram da janela
+        found = set(missing)
+        self._summary_retries = {i: retry for i, retry in self._summary_retries.items() if i in found}
+        now = asyncio.get_running_loop().time()
+        ready = [
+            received_email_id for received_email_id in missing
+            if received_email_id not in self._summarizing
+            and self._summary_retries.get(received_email_id, (0, now))[1] <= now
+        ][:capacity]
+        self.enqueue(ready)
+        return len(ready)
+
+    async def _next_batch(self, timeout: float) -> list[int]:
+        try:
+            batch = [await asyncio.wait_for(self._queue.get(), timeout=timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < settings.SUMMARY_BATCH_SIZE and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    # --- Entregas ---
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return semaphore
+
+    def _backoff_delay(self, attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(retry_after, settings.WEBHOOK_BACKOFF_MAX)
+        return random.uniform(0, min(settings.WEBHOOK_BACKOFF_MAX, settings.WEBHOOK_BACKOFF_BASE * (2 ** attempt)))
+
+    async def deliver(self, delivery: dict) -> tuple[models.ForwardStatusEnum, str | None]:
+        """
+        Envia um resumo ao webhook, repetindo em 429/5xx e falhas de rede.
+        Retorna o status final e a mensagem de erro, se houver.
+        """
+        client = self.client or get_webhook_client()
+        url = delivery["forward_url"]
+        headers = {"Idempotency-Key": f"email-summary-{delivery['id']}"}
+        payload = _webhook_payload(delivery)
+        last_error = "sem resposta"
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            # O semáforo do host é liberado durante o backoff
+            async with self._host_semaphore(url):
+                try:
+                    with metrics.observe_call("webhook", "summary.post") as call:
+                        response = await client.post(url, json=payload, headers=headers)
+                        if response.is_error:
+                            call.failed()
+                except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+                    return models.ForwardStatusEnum.failed, f"URL de webhook inválida: {e}"
+                except httpx.TransportError as e:
+                    last_error = f"erro de rede: {e!r}"
+                else:
+                    if response.is_success:
+                        return models.ForwardStatusEnum.success, None
+                    last_error = f"HTTP {response.status_code}"
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        return models.ForwardStatusEnum.failed, last_error
+                    retry_after = retry_after_seconds(response)
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+
+        return models.ForwardStatusEnum.failed, f"Falha após {self.max_retries + 1} tentativas ({last_error})."
+
+    async def _deliver_and_record(self, delivery: dict):
+        # O id só sai de _in_flight depois que o resultado é gravado (ver flush), para
+        # que a varredura não reenvie um resumo já entregue.
+        try:
+            with metrics.agent_context(delivery["account_id"]):
+                forward_status, message = await self.deliver(delivery)
+        except BaseException as e:
+            self._in_flight.discard(delivery["id"])
+            if not isinstance(e, Exception):
+                raise
+            logger.exception("Erro inesperado ao encaminhar o resumo %s: %s", delivery["id"], e,
+                             extra={"summary_id": delivery["id"]})
+        else:
+            self._results.append({"id": delivery["id"], "forward_status": forward_status, "status_message": message})
+
+    def schedule_delivery(self, delivery: dict):
+        """Inicia a entrega de um resumo em uma tarefa própria (sem efeito se já está em andamento)."""
+        if delivery["id"] in self._in_flight:
+            return
+        self._in_flight.add(delivery["id"])
+        task = asyncio.create_task(self._deliver_and_record(delivery))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def flush(self) -> int:
+        """Grava em lote os resultados das entregas concluídas. Retorna quantos foram gravados."""
+        if not self._results:
+            return 0
+        results, self._results = self._results, []
+        try:
+            async with self.session_factory() as db:
+                await crud_async.bulk_update_summary_statuses(db, results)
+        finally:
+            # Se a gravação falhar, os resumos continuam 'pending' e serão reenviados
+            self._in_flight.difference_update(result["id"] for result in results)
+        return len(results)
+
+    async def resume_pending(self) -> int:
+        """Agenda a entrega dos resumos que ficaram 'pending' (ex.: após um reinício)."""
+        capacity = settings.WEBHOOK_MAX_IN_FLIGHT - len(self._in_flight)
+        if capacity <= 0:
+            return 0
+        created_before = datetime.now(timezone.utc) - timedelta(seconds=self.sweep_interval)
+        async with self.session_factory() as db:
+            deliveries = await crud_async.list_pending_summary_deliveries(
+                db, created_before=created_before, limit=capacity
+            )
+        deliveries = [delivery for delivery in deliveries if delivery["id"] not in self._in_flight]
+        for delivery in deliveries:
+            self.schedule_delivery(delivery)
+        return len(deliveries)
+
+    async def drain(self):
+        """Aguarda as entregas em andamento e grava os resultados."""
+        while self._deliveries:
+            await asyncio.gather(*list(self._deliveries), return_exceptions=True)
+        await self.flush()
+
+    # --- Laços em segundo plano ---
+    async def _summarize_loop(self, stop_event: asyncio.Event):
+        while not stop_event.is_set():
+            batch = await self._next_batch(timeout=1.0)
+            if batch:
+                try:
+                    await self.summarize(batch)
+                except Exception as e:
+                    logger.exception("Erro ao resumir %d e-mail(s): %s", len(batch), e)
+
+    async def _flush_loop(self, stop_event: asyncio.Event):
+        last_sweep = float("-inf")
+        loop = asyncio.get_running_loop()
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if loop.time() - last_sweep >= self.sweep_interval:
+                    last_sweep = loop.time()
+                    await self.resume_pending()
+                    if settings.FORWARDING_ENABLED:
+                        await self.resume_missing_summaries()
+            except Exception as e:
+                logger.exception("Erro ao gravar as entregas de resumos: %s", e)
+
+    async def run(self, stop_event: asyncio.Event):
+        """Executa o resumo e as entregas até `stop_event` ser sinalizado."""
+        await asyncio.gather(self._summarize_loop(stop_event), self._flush_loop(stop_event))
+        # Entregas interrompidas continuam 'pending' e são retomadas pela varredura
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*list(self._deliveries), return_exceptions=True)
+        await self.flush()
+
+
+summary_forwarder = SummaryForwarder()
+metrics.register_queue("summaries", lambda: summary_forwarder._queue.qsize())
+metrics.register_queue("webhook_deliveries", lambda: len(summary_forwarder._in_flight))
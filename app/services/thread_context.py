@@ -0,0 +1,230 @@
+"""
+Contexto das conversas (threads do Gmail) incluído no prompt de resposta.
+
+Para cada thread, o cache guarda as últimas mensagens na íntegra (truncadas) e um
+resumo compacto das anteriores, limitado a settings.THREAD_CONTEXT_MAX_CHARS. O
+contexto é atualizado de forma incremental conforme o pipeline processa as mensagens
+e envia as respostas, então uma conversa longa não é buscada nem reenviada inteira ao
+Gemini a cada e-mail. A thread é carregada (threads.get, só metadados e snippets) na
+primeira vez que aparece neste processo.
+
+Cada entrada guarda os ids das mensagens incluídas, que nunca são adicionadas duas
+vezes. A thread pode mudar por fora deste processo (ex.: alguém respondeu pelo próprio
+Gmail); a sincronização incremental da caixa (users.history.list) já traz o threadId de
+cada mensagem nova, e apply_history descarta as entradas das threads que ganharam
+mensagens desconhecidas, sem nenhuma chamada extra ao Gmail. O cache também guarda até
+qual historyId acompanhou cada conta: se a janela da sincronização não começa ali (outro
+processo sincronizou a conta no meio tempo) ou se houve sincronização completa, as
+entradas da conta são descartadas.
+"""
+import asyncio
+import html
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+
+from googleapiclient.errors import HttpError
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+AGENT_AUTHOR = "Agente (você)"
+# Caracteres guardados de cada mensagem recente e de cada linha do resumo
+RECENT_MESSAGE_CHARS = 600
+SUMMARY_LINE_CHARS = 160
+THREAD_FIELDS = "messages(id,snippet,payload/headers)"
+
+_WHITESPACE = re.compile(r"\s+")
+# Início do texto citado em respostas ("Em ... escreveu:", "On ... wrote:", "-----Original Message-----")
+_QUOTE_MARKERS = re.compile(
+    r"^\s*(em .+ escreveu:|on .+ wrote:|-+\s*(original message|mensagem original)\s*-+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def compact_message_text(text: str | None, max_chars: int) -> str:
+    """Remove o histórico citado e linhas com '>' e colapsa os espaços, truncando em `max_chars`."""
+    text = text or ""
+    marker = _QUOTE_MARKERS.search(text)
+    if marker:
+        text = text[:marker.start()]
+    text = "\n".join(line for line in text.splitlines() if not line.lstrip().startswith(">"))
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+
+def _history_id(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _ThreadEntry:
+    __slots__ = ("message_ids", "recent", "summary", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.message_ids: set[str] = set()
+        self.recent: deque[tuple[str, str, str]] = deque()  # (message_id, autor, texto)
+        self.summary: deque[str] = deque()
+        self.expires_at = expires_at
+
+
+class ThreadContextCache:
+    """LRU em memória, por processo, do contexto de cada thread (chave: conta + threadId)."""
+
+    def __init__(
+        self,
+        max_threads: int | None = None,
+        max_chars: int | None = None,
+        recent_messages: int | None = None,
+        ttl_seconds: float | None = None,
+    ):
+        self.max_threads = max_threads or settings.THREAD_CONTEXT_MAX_THREADS
+        self.max_chars = max_chars or settings.THREAD_CONTEXT_MAX_CHARS
+        self.recent_messages = max(1, recent_messages or settings.THREAD_CONTEXT_RECENT_MESSAGES)
+        self.ttl_seconds = ttl_seconds or settings.THREAD_CONTEXT_TTL
+        self._entries: OrderedDict[tuple[int, str], _ThreadEntry] = OrderedDict()
+        self._seeding: dict[tuple[int, str], asyncio.Task] = {}
+        # historyId até o qual as entradas de cada conta acompanharam a caixa
+        self._synced_history_ids: dict[int, int | None] = {}
+        self.hits = 0
+        self.seeds = 0
+        self.refreshes = 0
+
+    def _get(self, key: tuple[int, str]) -> _ThreadEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _get_or_create(self, key: tuple[int, str]) -> _ThreadEntry:
+        entry = self._get(key)
+        if entry is None:
+            entry = self._entries[key] = _ThreadEntry(time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_threads:
+                self._entries.popitem(last=False)
+        return entry
+
+    def record(self, account_id: int, thread_id: str, message_id: str | None, author: str, text: str | None):
+        """
+        Adiciona uma mensagem ao contexto da thread (mensagens já incluídas são
+        ignoradas). As mais antigas que as `recent_messages` últimas viram uma linha
+        do resumo.
+        """
+        entry = self._get_or_create((account_id, thread_id))
+        if message_id is not None:
+            if message_id in entry.message_ids:
+                return
+            entry.message_ids.add(message_id)
+
+        text = compact_message_text(text, RECENT_MESSAGE_CHARS)
+        if not text:
+            return
+        entry.recent.append((message_id or "", author, text))
+        while len(entry.recent) > self.recent_messages:
+            _, old_author, old_text = entry.recent.popleft()
+            entry.summary.append(f"- {old_author}: {compact_message_text(old_text, SUMMARY_LINE_CHARS)}")
+        # O resumo fica com no máximo metade do limite; as linhas mais antigas saem primeiro
+        while entry.summary and sum(len(line) + 1 for line in entry.summary) > self.max_chars // 2:
+            entry.summary.popleft()
+
+    def render(self, account_id: int, thread_id: str, exclude_message_id: str | None = None) -> str:
+        """Texto do contexto da thread para o prompt, com no máximo `max_chars` caracteres."""
+        entry = self._get((account_id, thread_id))
+        if entry is None:
+            return ""
+        recent = [f"De {author}: {text}" for message_id, author, text in entry.recent
+                  if not exclude_message_id or message_id != exclude_message_id]
+        if not recent and not entry.summary:
+            return ""
+        parts = []
+        if entry.summary:
+            parts.append("Resumo das mensagens anteriores:\n" + "\n".join(entry.summary))
+        if recent:
+            parts.append("Mensagens mais recentes:\n" + "\n".join(recent))
+        context = "\n\n".join(parts)
+        # Se passar do limite, preserva o fim (as mensagens mais recentes)
+        return context if len(context) <= self.max_chars else "..." + context[-(self.max_chars - 3):]
+
+    async def _seed(self, service, account_id: int, thread_id: str, execute):
+        """Carrega uma thread já existente com uma única chamada threads.get (só metadados)."""
+        self.seeds += 1
+        thread = await execute(service.users().threads().get(
+            userId='me', id=thread_id, format='metadata', metadataHeaders=['From'], fields=THREAD_FIELDS
+        ))
+        for message in thread.get("messages", []):
+            headers = message.get("payload", {}).get("headers", [])
+            author = next((h["value"] for h in headers if h["name"] == "From"), "Desconhecido")
+            self.record(account_id, thread_id, message["id"], author,
+                        html.unescape(message.get("snippet", "")))
+
+    def forget_account(self, account_id: int):
+        """Descarta as entradas da conta (elas serão carregadas de novo quando preciso)."""
+        for key in [key for key in self._entries if key[0] == account_id]:
+            del self._entries[key]
+
+    def apply_history(self, account_id: int, start_history_id, latest_history_id,
+                      thread_messages: dict[str, set[str]], pending_ids=()):
+        """
+        Aplica uma sincronização incremental da conta (de `start_history_id` a
+        `latest_history_id`): descarta as entradas das threads de `thread_messages`
+        (threadId -> ids das mensagens adicionadas) que ganharam mensagens que o contexto
+        não inclui. `pending_ids` são as mensagens que o pipeline ainda vai processar,
+        e que entram no contexto por ele.
+        """
+        if self._synced_history_ids.get(account_id) != _history_id(start_history_id):
+            self.forget_account(account_id)
+        else:
+            pending_ids = set(pending_ids)
+            for thread_id, message_ids in thread_messages.items():
+                key = (account_id, thread_id)
+                entry = self._entries.get(key)
+                if entry is not None and message_ids - entry.message_ids - pending_ids:
+                    del self._entries[key]
+                    self.refreshes += 1
+        self._synced_history_ids[account_id] = _history_id(latest_history_id)
+
+    def reset_account(self, account_id: int, history_id):
+        """Após uma sincronização completa, recomeça o acompanhamento da conta em `history_id`."""
+        self.forget_account(account_id)
+        self._synced_history_ids[account_id] = _history_id(history_id)
+
+    async def context_for(self, service, account_id: int, msg: dict, sender: str, body: str | None, execute) -> str:
+        """
+        Contexto da conversa anterior à mensagem `msg`, que passa a fazer parte do contexto.
+        `execute` executa uma requisição da API do Google (ex.: email_service._execute).
+        Falhas ao buscar a thread apenas deixam a resposta sem contexto.
+        """
+        thread_id, message_id = msg["threadId"], msg["id"]
+        key = (account_id, thread_id)
+        if self._get(key) is not None:
+            self.hits += 1
+        # O id da primeira mensagem de uma thread é o próprio threadId: nada a buscar
+        elif message_id != thread_id:
+            task = self._seeding.get(key)
+            if task is None:
+                task = self._seeding[key] = asyncio.create_task(self._seed(service, account_id, thread_id, execute))
+                task.add_done_callback(lambda _: self._seeding.pop(key, None))
+            try:
+                await asyncio.shield(task)
+            except HttpError as e:
+                logger.warning("Não foi possível carregar o contexto da thread %s: %s", thread_id, e,
+                               extra={"thread_id": thread_id})
+
+        context = self.render(account_id, thread_id, exclude_message_id=message_id)
+        self.record(account_id, thread_id, message_id, sender, body)
+        return context
+
+    def clear(self):
+        self._entries.clear()
+        self._synced_history_ids.clear()
+
+
+thread_context_cache = ThreadContextCache()
@@ -1,22 +1,83 @@
+import os
+import tempfile
+
+from cryptography.fernet import Fernet
+
+# Valores mínimos para o Settings, lidos no primeiro uso: a suíte roda sem .env e sem
+# PostgreSQL (os testes usam SQLite e nenhum módulo abre conexões na importação).
+for _name, _value in {
+    "POSTGRES_DB": "test", "POSTGRES_USER": "test", "POSTGRES_PASSWORD": "test",
+    "ENCRYPTION_KEY": Fernet.generate_key().decode(), "GOOGLE_API_KEY": "test-key",
+}.items():
+    os.environ.setdefault(_name, _value)
+
 import pytest
-from sqlalchemy import create_engine
+import pytest_asyncio
+from sqlalchemy import DDL, create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
 
+from app import body_store, models
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_async_db, get_db
+from app.services.job_runner import job_runner
+from app.services.reply_cache import reply_cache
 
-# Usa um banco de dados SQLite em memória para os testes
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# Usa um banco de dados SQLite em arquivo temporário para os testes. Um arquivo (e não
+# ":memory:") permite que os engines síncrono e assíncrono (aiosqlite) vejam os mesmos dados.
+_DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{_DATABASE_PATH}"
+SQLALCHEMY_ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{_DATABASE_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False}, # Necessário para SQLite
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# NullPool: cada teste roda em um event loop próprio, então conexões não são reaproveitadas
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Espelho FTS5 da busca textual do Postgres (coluna search_vector + GIN): tabela
+# sincronizada por triggers, usada por crud_async.search_received_emails. O corpo vem
+# de email_bodies, descomprimido pela função email_body_text registrada em cada conexão.
+_FTS5_CREATE = (
+    """CREATE VIRTUAL TABLE received_emails_fts USING fts5(
+        subject, body, tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER received_emails_fts_ai AFTER INSERT ON received_emails BEGIN
+        INSERT INTO received_emails_fts(rowid, subject, body) VALUES (
+            new.id, new.subject,
+            (SELECT email_body_text(data) FROM email_bodies WHERE content_hash = new.body_hash)
+        );
+    END""",
+    """CREATE TRIGGER received_emails_fts_ad AFTER DELETE ON received_emails BEGIN
+        DELETE FROM received_emails_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER received_emails_fts_au AFTER UPDATE OF subject, body_hash ON received_emails BEGIN
+        DELETE FROM received_emails_fts WHERE rowid = old.id;
+        INSERT INTO received_emails_fts(rowid, subject, body) VALUES (
+            new.id, new.subject,
+            (SELECT email_body_text(data) FROM email_bodies WHERE content_hash = new.body_hash)
+        );
+    END""",
+)
+for _statement in _FTS5_CREATE:
+    event.listen(models.ReceivedEmail.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+def _register_body_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function(
+        "email_body_text", 1, lambda data: None if data is None else body_store.decompress(data), deterministic=True
+    )
+
+event.listen(engine, "connect", _register_body_functions)
+event.listen(async_engine.sync_engine, "connect", _register_body_functions)
+event.listen(models.ReceivedEmail.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS received_emails_fts").execute_if(dialect="sqlite"))
+
 @pytest.fixture(scope="function")
 def db_session():
     """Fixture para criar e limpar o banco de dados para cada teste."""
@@ -29,7 +90,17 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 @pytest.fixture(scope="function")
-def test_client(db_session):
+def async_session_factory(db_session):
+    """Fábrica de AsyncSession apontando para o mesmo banco da fixture db_session."""
+    return TestingAsyncSessionLocal
+
+@pytest_asyncio.fixture(scope="function")
+async def async_db_session(async_session_factory):
+    async with async_session_factory() as db:
+        yield db
+
+@pytest.fixture(scope="function")
+def test_client(db_session, async_session_factory, monkeypatch):
     """
     Fixture para criar um cliente de teste com o banco de dados de teste.
     Usa a fixture db_session para garantir que o banco de dados é criado e limpo.
@@ -37,8 +108,15 @@ def test_client(db_session):
     def _override_get_db():
         yield db_session
 
+    async def _override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
     app.dependency_overrides[get_db] = _override_get_db
+    app.dependency_overrides[get_async_db] = _override_get_async_db
+    monkeypatch.setattr(reply_cache, "session_factory", async_session_factory)
+    monkeypatch.setattr(job_runner, "session_factory", async_session_factory)
     client = TestClient(app)
     yield client
     # Limpa o override após o teste
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
@@ -1,5 +1,14 @@
+from datetime import datetime, timedelta, timezone
+
+import httplib2
 import pytest
-from unittest.mock import MagicMock, AsyncMock
+from unittest.mock import MagicMock
+
+from googleapiclient.errors import HttpError
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.services import outbox_worker
 
 # --- Testes para POST /agents/register ---
 
@@ -48,6 +57,18 @@ def test_register_agent_invalid_email(test_client):
     assert response.status_code == 422  # Unprocessable Entity
 
 
+def test_register_agent_retention_days(test_client):
+    """A retenção da conta é opcional e não aceita valores negativos."""
+    payload = {"email": "retention@example.com", "password": "password123", "name": "Agent"}
+
+    response = test_client.post("/agents/register", json={**payload, "retention_days": 90})
+    invalid = test_client.post("/agents/register", json={**payload, "email": "x@example.com", "retention_days": -1})
+
+    assert response.status_code == 201
+    assert response.json()["retention_days"] == 90
+    assert invalid.status_code == 422
+
+
 # --- Testes para POST /agents/login ---
 
 
@@ -129,7 +150,7 @@ def test_google_auth_callback_success(test_client, mocker, registered_agent):
     # Simula as funções do fluxo e do CRUD
     mock_flow = MagicMock()
     mocker.patch("app.routers.agents.security.create_google_auth_flow", return_value=mock_flow)
-    mock_update_creds = mocker.patch("app.routers.agents.crud.update_agent_credentials")
+    mock_update_creds = mocker.patch("app.routers.agents.crud_async.update_agent_credentials")
 
     response = test_client.get(f"/agents/auth/google/callback?code=fake_code&state={agent_id}")
 
@@ -140,24 +161,93 @@ def test_google_auth_callback_success(test_client, mocker, registered_agent):
     mock_update_creds.assert_called_once()
 
 
-def test_trigger_email_processing_success(test_client, mocker, registered_agent):
-    """Testa o acionamento do processamento de e-mails."""
+def test_trigger_email_processing_enqueues_a_job(test_client, db_session, mocker, registered_agent):
+    """O acionamento apenas cria o job e responde na hora; um segundo pedido reaproveita o job ativo."""
     agent_id = registered_agent["id"]
+    agent = db_session.get(models.Account, agent_id)
+    agent.encrypted_credentials = b"credenciais-criptografadas"
+    db_session.commit()
 
-    # Simula a função de processamento para não executar a lógica real
-    mock_process = mocker.patch(
-        "app.routers.agents.process_and_reply_to_emails",
-        new_callable=AsyncMock, # Usa AsyncMock para funções async
-        return_value=3 # Simula que 3 e-mails foram processados
-    )
+    # Simula o executor de jobs para não rodar o pipeline real
+    mock_submit = mocker.patch("app.routers.agents.job_runner.submit")
 
     response = test_client.post(f"/agents/{agent_id}/process-emails")
 
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+    assert job["processed_messages"] == 0
+    assert response.headers["Location"] == f"/agents/{agent_id}/jobs/{job['id']}"
+    mock_submit.assert_called_once_with(job["id"])
+
+    again = test_client.post(f"/agents/{agent_id}/process-emails")
+    assert again.json()["id"] == job["id"]
+    mock_submit.assert_called_once()
+
+    status_response = test_client.get(f"/agents/{agent_id}/jobs/{job['id']}")
+    assert status_response.status_code == 200
+    assert status_response.json()["status"] == "queued"
+
+    cancelled = test_client.post(f"/agents/{agent_id}/jobs/{job['id']}/cancel")
+    assert cancelled.status_code == 202
+    assert cancelled.json()["status"] == "cancelled"
+
+
+def test_trigger_email_processing_requires_authorization(test_client, registered_agent):
+    response = test_client.post(f"/agents/{registered_agent['id']}/process-emails")
+    assert response.status_code == 401
+
+
+def test_job_messages_are_paginated(test_client, db_session, registered_agent):
+    agent_id = registered_agent["id"]
+    job = models.ProcessingJob(account_id=agent_id, status=models.JobStatusEnum.completed)
+    db_session.add(job)
+    db_session.commit()
+    now = datetime.now(timezone.utc)
+    db_session.add_all([
+        models.ProcessingJobMessage(job_id=job.id, gmail_message_id=f"m{i}", outcome=models.MessageOutcomeEnum.replied,
+                                    started_at=now - timedelta(seconds=2), finished_at=now)
+        for i in range(3)
+    ])
+    db_session.commit()
+
+    first = test_client.get(f"/agents/{agent_id}/jobs/{job.id}/messages?limit=2").json()
+    assert [item["gmail_message_id"] for item in first["items"]] == ["m0", "m1"]
+    assert first["items"][0]["duration_seconds"] == pytest.approx(2)
+
+    second = test_client.get(
+        f"/agents/{agent_id}/jobs/{job.id}/messages?limit=2&after_id={first['next_after_id']}"
+    ).json()
+    assert [item["gmail_message_id"] for item in second["items"]] == ["m2"]
+    assert second["next_after_id"] is None
+
+    assert test_client.get(f"/agents/999/jobs/{job.id}").status_code == 404
+
+
+def test_stream_email_processing_emits_server_sent_events(test_client, mocker, registered_agent):
+    """O endpoint de streaming repassa cada evento do pipeline e termina com 'completed'."""
+    async def _fake_process(db, agent, on_event, stream_replies):
+        on_event({"event": "listed", "count": 1})
+        on_event({"event": "fetched", "message_id": "m1", "subject": "Olá"})
+        on_event({"event": "sent", "message_id": "m1", "to": "a@example.com"})
+        return 1
+
+    mocker.patch("app.routers.agents.process_and_reply_to_emails", side_effect=_fake_process)
+
+    response = test_client.post(f"/agents/{registered_agent['id']}/process-emails/stream")
+
     assert response.status_code == 200
-    assert response.json() == {
-        "message": "Processamento concluído. 3 e-mails foram processados e respondidos."
-    }
-    mock_process.assert_awaited_once() # Verifica se a função async foi chamada
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    assert [lines[0] for lines in events] == [
+        "event: listed", "event: fetched", "event: sent", "event: completed"
+    ]
+    assert events[-1][1] == 'data: {"replied": 1}'
+
+
+def test_stream_email_processing_agent_not_found(test_client):
+    response = test_client.post("/agents/999/process-emails/stream")
+    assert response.status_code == 404
 
 
 def test_trigger_email_processing_agent_not_found(test_client):
@@ -167,13 +257,15 @@ def test_trigger_email_processing_agent_not_found(test_client):
     assert response.json()["detail"] == "Agente não encontrado."
 
 
-def test_send_simple_email_success(test_client, mocker, registered_agent):
-    """Testa o envio de um e-mail simples."""
+def test_send_simple_email_success(test_client, db_session, mocker, registered_agent):
+    """Testa que o envio de um e-mail simples apenas o coloca na fila."""
     agent_id = registered_agent["id"]
+    agent = db_session.get(models.Account, agent_id)
+    agent.encrypted_credentials = b"credenciais-criptografadas"
+    db_session.commit()
 
-    # Simula os serviços de segurança e e-mail
-    mock_get_service = mocker.patch("app.routers.agents.security.get_agent_gmail_service")
-    mock_send_email = mocker.patch("app.routers.agents.send_new_email")
+    # O endpoint não deve falar com o Gmail: isso é tarefa dos workers da fila
+    mock_get_service = mocker.patch("app.security.get_agent_gmail_service")
 
     email_data = {
         "receiver": "destinatario@example.com",
@@ -183,13 +275,212 @@ def test_send_simple_email_success(test_client, mocker, registered_agent):
     response = test_client.post(f"/agents/{agent_id}/emails/send", json=email_data)
 
     assert response.status_code == 202
-    assert response.json() == {"message": f"E-mail para {email_data['receiver']} foi enviado para a fila de envio."}
-
-    # Verifica se os mocks foram chamados corretamente
-    mock_get_service.assert_called_once()
-    mock_send_email.assert_called_once_with(
-        service=mock_get_service.return_value,
-        to=email_data["receiver"],
-        subject=email_data["subject"],
-        body_text=email_data["body"]
-    )
\ No newline at end of file
+    data = response.json()
+    assert data["message"] == f"E-mail para {email_data['receiver']} foi enviado para a fila de envio."
+
+    queued = db_session.get(models.OutgoingEmail, data["email_id"])
+    assert queued.status == models.EmailStatusEnum.queued
+    assert queued.recipient == email_data["receiver"]
+    mock_get_service.assert_not_called()
+
+
+def test_send_simple_email_requires_authorization(test_client, registered_agent):
+    """Um agente sem credenciais do Gmail não pode enfileirar e-mails."""
+    response = test_client.post(
+        f"/agents/{registered_agent['id']}/emails/send",
+        json={"receiver": "destinatario@example.com", "subject": "Teste", "body": "Corpo"},
+    )
+    assert response.status_code == 401
+
+
+def test_outbox_worker_sends_queued_emails(db_session, mocker):
+    """O worker reserva os e-mails da fila, envia e registra o resultado de cada um."""
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    ok = models.OutgoingEmail(account_id=agent.id, recipient="ok@example.com", subject="A", body="1",
+                              status=models.EmailStatusEnum.queued)
+    bad = models.OutgoingEmail(account_id=agent.id, recipient="bad@example.com", subject="B", body="2",
+                               status=models.EmailStatusEnum.queued)
+    draft = models.OutgoingEmail(account_id=agent.id, recipient="draft@example.com", subject="C", body="3",
+                                 status=models.EmailStatusEnum.draft)
+    db_session.add_all([ok, bad, draft])
+    db_session.commit()
+
+    def _send(service, to, subject, body_text):
+        if to == "bad@example.com":
+            raise ConnectionError("Falha ao enviar e-mail: recusado")
+
+    mocker.patch.object(outbox_worker, "get_agent_gmail_service")
+    mock_send = mocker.patch.object(outbox_worker, "send_new_email", side_effect=_send)
+
+    session_factory = sessionmaker(bind=db_session.get_bind())
+    assert outbox_worker.process_outbox_batch(session_factory, batch_size=10) == 2
+    assert outbox_worker.process_outbox_batch(session_factory, batch_size=10) == 0
+
+    db_session.expire_all()
+    assert mock_send.call_count == 2
+    assert ok.status == models.EmailStatusEnum.sent and ok.sent_at is not None
+    assert bad.status == models.EmailStatusEnum.failed and "recusado" in bad.error_message
+    assert draft.status == models.EmailStatusEnum.draft
+
+
+def test_outbox_worker_requeues_transient_failures(db_session, mocker):
+    """Um 503 do Gmail devolve o e-mail à fila com backoff; esgotadas as tentativas, ele falha."""
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    email = models.OutgoingEmail(account_id=agent.id, recipient="a@example.com", subject="A", body="1",
+                                 status=models.EmailStatusEnum.queued)
+    db_session.add(email)
+    db_session.commit()
+
+    def _send(service, to, subject, body_text):
+        error = HttpError(httplib2.Response({"status": 503}), b"indisponivel")
+        raise ConnectionError(f"Falha ao enviar e-mail: {error}") from error
+
+    mocker.patch.object(outbox_worker, "get_agent_gmail_service")
+    mocker.patch.object(outbox_worker, "send_new_email", side_effect=_send)
+    mocker.patch.object(outbox_worker.settings, "OUTBOX_MAX_ATTEMPTS", 2)
+
+    session_factory = sessionmaker(bind=db_session.get_bind())
+    assert outbox_worker.process_outbox_batch(session_factory) == 1
+    db_session.expire_all()
+    assert email.status == models.EmailStatusEnum.queued
+    assert email.attempts == 1 and email.next_attempt_at is not None and email.lease_expires_at is None
+
+    # Antes de next_attempt_at o e-mail não é reservado de novo
+    assert outbox_worker.process_outbox_batch(session_factory) == 0
+
+    email.next_attempt_at = None
+    db_session.commit()
+    assert outbox_worker.process_outbox_batch(session_factory) == 1
+    db_session.expire_all()
+    assert email.status == models.EmailStatusEnum.failed and email.attempts == 2
+
+
+# --- Testes para GET /agents/{agent_id}/emails/search ---
+
+
+@pytest.fixture
+def searchable_emails(db_session, registered_agent):
+    other = models.Account(email="other@example.com", password_hash="x", name="Other")
+    db_session.add(other)
+    db_session.commit()
+    now = datetime.now(timezone.utc)
+    emails = [
+        (registered_agent["id"], "Fatura de outubro", "Segue a fatura do mês. Pagamento até sexta."),
+        (registered_agent["id"], "Reunião", "Podemos falar sobre a fatura amanhã?"),
+        (registered_agent["id"], "Almoço", "Vamos almoçar na sexta?"),
+        (other.id, "Fatura", "Fatura de outra conta."),
+    ]
+    db_session.add_all([
+        models.ReceivedEmail(gmail_message_id=f"g{i}", account_id=account_id, sender="a@example.com",
+                             subject=subject, body=body, received_at=now)
+        for i, (account_id, subject, body) in enumerate(emails)
+    ])
+    db_session.commit()
+
+
+def test_search_ranks_and_highlights_only_the_agent_emails(test_client, registered_agent, searchable_emails):
+    response = test_client.get(f"/agents/{registered_agent['id']}/emails/search", params={"q": "fatura"})
+
+    assert response.status_code == 200
+    items = response.json()["items"]
+    # O termo no assunto pesa mais que no corpo; o e-mail da outra conta não aparece
+    assert [item["gmail_message_id"] for item in items] == ["g0", "g1"]
+    assert items[0]["rank"] > items[1]["rank"]
+    assert items[0]["subject_highlight"] == "<mark>Fatura</mark> de outubro"
+    assert "<mark>fatura</mark>" in items[1]["snippet"]
+    assert response.json()["next_offset"] is None
+
+
+def test_search_escapes_the_email_html(test_client, registered_agent, db_session):
+    """Só os <mark> da busca chegam como HTML; o conteúdo do e-mail vem escapado."""
+    db_session.add(models.ReceivedEmail(
+        gmail_message_id="x1", account_id=registered_agent["id"], sender="a@example.com",
+        subject="<img src=x onerror=alert(1)> fatura", body="<script>alert('fatura')</script>",
+        received_at=datetime.now(timezone.utc),
+    ))
+    db_session.commit()
+
+    response = test_client.get(f"/agents/{registered_agent['id']}/emails/search", params={"q": "fatura"})
+
+    item = response.json()["items"][0]
+    assert item["subject_highlight"] == "&lt;img src=x onerror=alert(1)&gt; <mark>fatura</mark>"
+    assert "<script>" not in item["snippet"] and "&lt;script&gt;" in item["snippet"]
+    assert "<mark>fatura</mark>" in item["snippet"]
+
+
+def test_search_is_paginated(test_client, registered_agent, searchable_emails):
+    url = f"/agents/{registered_agent['id']}/emails/search"
+    first = test_client.get(url, params={"q": "fatura", "limit": 1}).json()
+    assert [item["gmail_message_id"] for item in first["items"]] == ["g0"]
+    assert first["next_offset"] == 1
+
+    second = test_client.get(url, params={"q": "fatura", "limit": 1, "offset": first["next_offset"]}).json()
+    assert [item["gmail_message_id"] for item in second["items"]] == ["g1"]
+    assert second["next_offset"] is None
+
+
+def test_search_treats_the_query_as_plain_terms(test_client, registered_agent, searchable_emails):
+    """Caracteres especiais do FTS5 na busca não geram erro de sintaxe."""
+    response = test_client.get(f"/agents/{registered_agent['id']}/emails/search", params={"q": 'sexta" OR ('})
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+
+# --- Testes das listagens paginadas por cursor ---
+
+
+def test_received_emails_are_listed_with_keyset_pagination(test_client, db_session, registered_agent):
+    agent_id = registered_agent["id"]
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db_session.add_all([
+        models.ReceivedEmail(gmail_message_id=f"g{i}", account_id=agent_id, sender=f"s{i % 2}@example.com",
+                             subject=f"Assunto {i}", body="Corpo", received_at=base + timedelta(minutes=i // 2))
+        for i in range(5)  # Horários repetidos: o id desempata
+    ])
+    db_session.commit()
+    url = f"/agents/{agent_id}/emails/received"
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = test_client.get(url, params=params).json()
+        seen += [item["gmail_message_id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ["g4", "g3", "g2", "g1", "g0"]
+
+    filtered = test_client.get(url, params={"sender": "s1@example.com"}).json()
+    assert [item["gmail_message_id"] for item in filtered["items"]] == ["g3", "g1"]
+    # O corpo vem de email_bodies, com o mesmo texto gravado
+    assert [item["body"] for item in filtered["items"]] == ["Corpo", "Corpo"]
+
+    assert test_client.get(url, params={"cursor": "invalido"}).status_code == 400
+
+
+def test_outgoing_emails_and_summaries_filter_by_status(test_client, db_session, registered_agent):
+    agent_id = registered_agent["id"]
+    db_session.add_all([
+        models.OutgoingEmail(account_id=agent_id, recipient="a@example.com", subject="1",
+                             status=models.EmailStatusEnum.sent),
+        models.OutgoingEmail(account_id=agent_id, recipient="b@example.com", subject="2",
+                             status=models.EmailStatusEnum.queued),
+    ])
+    email = models.ReceivedEmail(gmail_message_id="g1", account_id=agent_id, sender="a@example.com", subject="Oi")
+    db_session.add(email)
+    db_session.commit()
+    summary = crud.create_email_summary(db_session, schemas.EmailSummaryCreate(
+        received_email_id=email.id, summary_text="Resumo", forward_url="https://example.com/hook"
+    ))
+    assert summary.account_id == agent_id
+
+    outgoing = test_client.get(f"/agents/{agent_id}/emails/outgoing", params={"status": "queued"}).json()
+    assert [item["recipient"] for item in outgoing["items"]] == ["b@example.com"]
+
+    summaries = test_client.get(f"/agents/{agent_id}/summaries", params={"status": "pending"}).json()
+    assert [item["summary_text"] for item in summaries["items"]] == ["Resumo"]
+    assert test_client.get(f"/agents/{agent_id}/summaries", params={"status": "success"}).json()["items"] == []
@@ -0,0 +1,100 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from app import models
+from app.config import settings
+from app.services import archiver
+from app.services.archiver import ReceivedEmailArchiver
+
+NOW = datetime(2026, 10, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def _agent(db_session, email: str, retention_days: int | None = None) -> models.Account:
+    agent = models.Account(email=email, password_hash="x", name="Agent", retention_days=retention_days)
+    db_session.add(agent)
+    db_session.commit()
+    return agent
+
+
+def _received(db_session, agent: models.Account, gmail_id: str, days_ago: int) -> models.ReceivedEmail:
+    email = models.ReceivedEmail(gmail_message_id=gmail_id, account_id=agent.id, sender="a@example.com",
+                                 subject=f"Assunto {gmail_id}", body=f"Corpo {gmail_id}",
+                                 received_at=NOW - timedelta(days=days_ago))
+    db_session.add(email)
+    db_session.commit()
+    return email
+
+
+def _archived_rows(path) -> list[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return [json.loads(line) for line in archive]
+
+
+def test_month_helpers():
+    month = archiver.month_start(datetime(2026, 12, 31, 23, 59, tzinfo=timezone.utc))
+
+    assert month == datetime(2026, 12, 1, tzinfo=timezone.utc)
+    assert archiver.add_months(month, 1) == datetime(2027, 1, 1, tzinfo=timezone.utc)
+    assert archiver.add_months(month, -12) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+    assert archiver.partition_name(month) == "received_emails_p2026_12"
+    assert archiver.partition_month("received_emails_p2026_12") == month
+    assert archiver.partition_month("received_emails_default") is None
+
+
+@pytest.mark.asyncio
+async def test_expired_emails_are_archived_then_deleted(async_session_factory, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RECEIVED_EMAIL_RETENTION_DAYS", 30)
+    agent = _agent(db_session, "agent@example.com")
+    keeper = _agent(db_session, "keeper@example.com", retention_days=0)  # Nunca arquiva
+    short = _agent(db_session, "short@example.com", retention_days=5)
+    old = [_received(db_session, agent, f"old{i}", days_ago=40 + i) for i in range(3)]
+    _received(db_session, agent, "recent", days_ago=10)
+    _received(db_session, keeper, "keeper-old", days_ago=400)
+    _received(db_session, short, "short-old", days_ago=10)
+    db_session.add(models.EmailSummary(received_email_id=old[0].id, account_id=agent.id, summary_text="Resumo",
+                                       forward_url="https://hooks.example.com"))
+    db_session.commit()
+
+    service = ReceivedEmailArchiver(session_factory=async_session_factory, archive_dir=tmp_path, batch_size=2)
+    archived = await service.run_once(now=NOW)
+
+    assert archived == 4
+    async with async_session_factory() as db:
+        remaining = set((await db.execute(select(models.ReceivedEmail.gmail_message_id))).scalars())
+        summaries = await db.scalar(select(func.count()).select_from(models.EmailSummary))
+    assert remaining == {"recent", "keeper-old"}
+    assert summaries == 0
+
+    # 40 a 42 dias antes de 15/10: setembro de 2026
+    rows = _archived_rows(tmp_path / f"account_{agent.id}" / "received_emails_2026_09.jsonl.gz")
+    assert sorted(row["gmail_message_id"] for row in rows) == ["old0", "old1", "old2"]
+    assert rows[0]["body"].startswith("Corpo old")
+    assert [row["gmail_message_id"] for row in
+            _archived_rows(tmp_path / f"account_{short.id}" / "received_emails_2026_10.jsonl.gz")] == ["short-old"]
+
+    # Nada mais a arquivar na rodada seguinte
+    assert await service.run_once(now=NOW) == 0
+
+
+@pytest.mark.asyncio
+async def test_bodies_left_without_emails_are_deleted(async_session_factory, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RECEIVED_EMAIL_RETENTION_DAYS", 30)
+    agent = _agent(db_session, "agent@example.com")
+    _received(db_session, agent, "old", days_ago=40)
+    shared = models.ReceivedEmail(gmail_message_id="old-shared", account_id=agent.id, sender="a@example.com",
+                                  subject="Assunto", body="Corpo compartilhado", received_at=NOW - timedelta(days=40))
+    db_session.add_all([shared, models.OutgoingEmail(account_id=agent.id, recipient="b@example.com",
+                                                     subject="Fwd", body="Corpo compartilhado")])
+    db_session.commit()
+
+    service = ReceivedEmailArchiver(session_factory=async_session_factory, archive_dir=tmp_path)
+    assert await service.run_once(now=NOW) == 2
+
+    async with async_session_factory() as db:
+        bodies = (await db.execute(select(models.EmailBody))).scalars().all()
+    # O corpo ainda usado pelo e-mail enviado fica; o do e-mail arquivado sai
+    assert [body.text for body in bodies] == ["Corpo compartilhado"]
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app import body_store, crud, crud_async, models, schemas
+
+
+def _email(agent_id: int, gmail_id: str) -> schemas.ReceivedEmailCreate:
+    return schemas.ReceivedEmailCreate(
+        gmail_message_id=gmail_id, account_id=agent_id, sender="a@example.com",
+        subject=f"Assunto {gmail_id}", body="Corpo", received_at=datetime(2024, 1, 1),
+    )
+
+
+def test_bulk_create_received_emails_skips_existing_rows(db_session):
+    """A ingestão em lote insere só o que é novo e devolve o id de todos os e-mails."""
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    existing = crud.create_received_email(db_session, _email(agent.id, "g1"))
+
+    ids = crud.bulk_create_received_emails(
+        db_session, [_email(agent.id, "g1"), _email(agent.id, "g2"), _email(agent.id, "g3"), _email(agent.id, "g2")]
+    )
+
+    assert set(ids) == {"g1", "g2", "g3"}
+    assert ids["g1"] == existing.id
+    assert db_session.query(models.ReceivedEmail).count() == 3
+
+
+def test_bulk_create_received_emails_uses_a_single_commit(db_session):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+
+    commits = []
+
+    def _on_commit(session):
+        commits.append(session)
+
+    event.listen(db_session, "after_commit", _on_commit)
+    crud.bulk_create_received_emails(db_session, [_email(agent.id, f"g{i}") for i in range(50)])
+    event.remove(db_session, "after_commit", _on_commit)
+
+    assert len(commits) == 1
+    assert crud.bulk_create_received_emails(db_session, []) == {}
+
+
+def test_bodies_are_stored_once_and_compressed(db_session):
+    """Corpos iguais ocupam uma linha de email_bodies; o texto volta igual ao gravado."""
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    newsletter = "Novidades da semana. " * 200
+
+    ids = crud.bulk_create_received_emails(db_session, [
+        schemas.ReceivedEmailCreate(gmail_message_id=f"g{i}", account_id=agent.id, sender="a@example.com",
+                                    subject="Newsletter", body=newsletter, received_at=datetime(2024, 1, 1))
+        for i in range(3)
+    ])
+    outgoing = models.OutgoingEmail(account_id=agent.id, recipient="b@example.com", subject="Fwd", body=newsletter)
+    db_session.add(outgoing)
+    db_session.commit()
+
+    stored = db_session.query(models.EmailBody).one()
+    assert stored.content_hash == body_store.content_hash(newsletter) == outgoing.body_hash
+    assert stored.size == len(newsletter.encode("utf-8")) > len(stored.data)
+    assert stored.text == newsletter
+    db_session.expire_all()
+    hashes = db_session.query(models.ReceivedEmail.body_hash).filter(models.ReceivedEmail.id.in_(ids.values()))
+    assert {body_hash for body_hash, in hashes} == {stored.content_hash}
+
+
+@pytest.mark.asyncio
+async def test_async_crud_shares_the_bulk_ingestion_and_watermark(async_db_session, db_session):
+    """As versões assíncronas gravam no mesmo banco e com a mesma semântica das síncronas."""
+    agent = await crud_async.create_agent(
+        async_db_session, schemas.AgentCreate(email="agent@example.com", password="password", name="Agent")
+    )
+    assert await crud_async.get_agent_by_email(async_db_session, "agent@example.com") is agent
+
+    ids = await crud_async.bulk_create_received_emails(
+        async_db_session, [_email(agent.id, "g1"), _email(agent.id, "g2")]
+    )
+    await crud_async.update_agent_history_id(async_db_session, agent, "42")
+
+    assert set(ids) == {"g1", "g2"}
+    assert db_session.query(models.ReceivedEmail).count() == 2
+    assert db_session.get(models.Account, agent.id).gmail_history_id == "42"
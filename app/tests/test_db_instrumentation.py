@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app import crud, models
+from app.config import settings
+from app.db_instrumentation import TimedQueuePool, db_metrics, instrument_engine, track_queries
+
+
+@pytest.fixture
+def instrumented(db_session, async_session_factory):
+    """Instrumenta os engines de teste e zera as métricas agregadas."""
+    instrument_engine(db_session.get_bind())
+    instrument_engine(async_session_factory.kw["bind"])
+    db_metrics.reset()
+    yield
+    db_metrics.reset()
+
+
+def test_track_queries_counts_statements_and_repeats(db_session, instrumented):
+    """Cada comando é contado e o mesmo comando repetido aparece como suspeito de N+1."""
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    agent_id = agent.id
+
+    with track_queries() as stats:
+        for _ in range(3):
+            db_session.execute(text("SELECT id FROM accounts WHERE id = :id"), {"id": agent_id}).all()
+
+    assert stats.query_count == 3
+    assert stats.db_time > 0
+    assert stats.slowest_statement == "SELECT id FROM accounts WHERE id = ?"
+    assert stats.repeated_statements(threshold=3) == [("SELECT id FROM accounts WHERE id = ?", 3)]
+    assert stats.repeated_statements(threshold=4) == []
+
+
+def test_update_summary_status_runs_a_single_update(db_session, instrumented):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    email = models.ReceivedEmail(gmail_message_id="g1", account_id=agent.id, sender="a@example.com")
+    db_session.add(email)
+    db_session.commit()
+    summary = models.EmailSummary(received_email_id=email.id, account_id=agent.id, summary_text="Resumo",
+                                  forward_url="https://x")
+    db_session.add(summary)
+    db_session.commit()
+    summary_id = summary.id
+
+    with track_queries() as stats:
+        updated = crud.update_summary_status(db_session, summary_id, models.ForwardStatusEnum.success)
+
+    assert updated is True
+    assert stats.query_count == 1
+    assert crud.update_summary_status(db_session, 999, models.ForwardStatusEnum.failed) is False
+
+
+def test_pool_wait_is_measured(tmp_path):
+    """O tempo esperando por uma conexão livre do pool entra nas estatísticas."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0)
+    held = engine.connect()
+    threading.Timer(0.1, held.close).start()
+
+    with track_queries() as stats:
+        with engine.connect():
+            pass
+
+    assert stats.pool_wait >= 0.05
+    engine.dispose()
+
+
+def test_debug_headers_and_aggregated_metrics(test_client, instrumented, monkeypatch):
+    monkeypatch.setattr(settings, "DEBUG", True)
+    response = test_client.post(
+        "/agents/register",
+        json={"email": "agent@example.com", "password": "password", "name": "Agent"},
+    )
+
+    assert response.status_code == 201
+    assert int(response.headers["X-DB-Query-Count"]) >= 2  # SELECT do e-mail + INSERT
+    assert float(response.headers["X-DB-Time-Ms"]) > 0
+    assert "X-DB-Pool-Wait-Ms" in response.headers
+
+    metrics = test_client.get("/db-metrics/stats").json()
+    assert metrics["requests"] == 1
+    assert metrics["routes"]["/agents/register"]["avg_queries"] >= 2
+    assert metrics["slowest_statements"]
+
+
+def test_headers_are_hidden_outside_debug_mode(test_client, instrumented):
+    response = test_client.get("/")
+    assert "X-DB-Query-Count" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_async_writes_skip_the_refresh_round_trip(async_db_session, instrumented):
+    """O INSERT devolve os valores gerados pelo banco; não há SELECT extra depois do commit."""
+    with track_queries() as stats:
+        agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+        async_db_session.add(agent)
+        await async_db_session.commit()
+
+    assert "created_at" not in inspect(agent).unloaded
+    assert not any(statement.startswith("SELECT") for statement in stats.statements)
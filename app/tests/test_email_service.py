@@ -0,0 +1,443 @@
+import asyncio
+import base64
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+from unittest.mock import MagicMock
+
+import httplib2
+from googleapiclient.errors import HttpError
+from prometheus_client import REGISTRY
+from sqlalchemy import func, select
+
+from app import crud_async, models
+from app.config import settings
+from app.services import email_service, http_clients
+from app.services.reply_cache import ReplyCache
+from app.services.thread_context import ThreadContextCache
+
+
+@pytest.fixture(autouse=True)
+def empty_reply_cache(mocker, async_session_factory):
+    """Cada teste começa com um cache de respostas vazio."""
+    cache = ReplyCache(max_entries=100, ttl_seconds=60, session_factory=async_session_factory)
+    mocker.patch.object(email_service, "reply_cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def empty_thread_context_cache(mocker):
+    """Cada teste começa sem contexto de conversas."""
+    cache = ThreadContextCache(max_threads=100, max_chars=2000, recent_messages=3, ttl_seconds=60)
+    mocker.patch.object(email_service, "thread_context_cache", cache)
+    return cache
+
+
+def _gmail_message(message_id: str) -> dict:
+    """Monta uma mensagem no formato retornado por messages().get(format='full')."""
+    data = base64.urlsafe_b64encode(f"Corpo da mensagem {message_id}".encode()).decode()
+    return {
+        "id": message_id,
+        "threadId": message_id,  # Cada mensagem inicia a própria conversa
+        "internalDate": "1700000000000",
+        "labelIds": ["UNREAD", "INBOX"],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "Subject", "value": f"Assunto {message_id}"},
+                {"name": "From", "value": "remetente@example.com"},
+            ],
+            "body": {"data": data},
+        },
+    }
+
+
+def _fake_request(result):
+    request = MagicMock()
+    request.http = None
+    request.execute.return_value = result
+    return request
+
+
+class _FakeBatch:
+    """Simula um BatchHttpRequest: executa cada requisição e chama o callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        for request_id, request in self.requests:
+            self.callback(request_id, request.execute(), None)
+
+
+def _marked_read(messages) -> list[str]:
+    """Ids marcados como lidos, em todas as chamadas batchModify."""
+    ids = []
+    for call in messages.batchModify.call_args_list:
+        assert call.kwargs["body"]["removeLabelIds"] == ["UNREAD"]
+        ids += call.kwargs["body"]["ids"]
+    return ids
+
+
+async def _new_agent(db, history_id=None):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent", gmail_history_id=history_id)
+    db.add(agent)
+    await db.commit()
+    return agent
+
+
+@pytest.fixture
+def fake_gmail_service():
+    """Serviço do Gmail simulado com três mensagens não lidas."""
+    ids = ["m1", "m2", "m3"]
+    service = MagicMock()
+    service.batches = []
+
+    def _new_batch(callback):
+        batch = _FakeBatch(callback)
+        service.batches.append(batch)
+        return batch
+
+    service.new_batch_http_request.side_effect = _new_batch
+    users = service.users.return_value
+    users.getProfile.return_value = _fake_request({"historyId": "500"})
+    messages = users.messages.return_value
+    messages.list.return_value = _fake_request({"messages": [{"id": i} for i in ids]})
+    messages.get.side_effect = lambda userId, id, format, fields: _fake_request(_gmail_message(id))
+    messages.send.side_effect = lambda userId, body: _fake_request({"id": "sent"})
+    messages.batchModify.side_effect = lambda userId, body: _fake_request({})
+    return service
+
+
+@pytest.mark.asyncio
+async def test_process_and_reply_to_emails_replies_to_every_message(async_db_session, mocker, fake_gmail_service):
+    """Cada mensagem não lida é salva, respondida e marcada como lida."""
+    agent = await _new_agent(async_db_session)
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    messages = fake_gmail_service.users.return_value.messages.return_value
+    assert replied == 3
+    assert messages.send.call_count == 3
+    # Uma única requisição batch para buscar; cada mensagem é marcada como lida ao terminar
+    assert len(fake_gmail_service.batches) == 1
+    assert sorted(_marked_read(messages)) == ["m1", "m2", "m3"]
+    assert await async_db_session.scalar(select(func.count()).select_from(models.ReceivedEmail)) == 3
+    # Primeira execução: listagem completa, e o watermark passa a ser o historyId do perfil
+    assert agent.gmail_history_id == "500"
+
+
+@pytest.mark.asyncio
+async def test_process_and_reply_to_emails_records_metrics_per_agent(async_db_session, mocker, fake_gmail_service):
+    """Contadores de mensagens e histogramas por etapa levam o id do agente."""
+    agent = await _new_agent(async_db_session)
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    labels = {"agent": str(agent.id)}
+    before = REGISTRY.get_sample_value("gmail_agent_messages_total", {**labels, "outcome": "replied"}) or 0
+    await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    assert REGISTRY.get_sample_value("gmail_agent_messages_total", {**labels, "outcome": "replied"}) == before + 3
+    for stage in ("list", "fetch", "db_save", "generate", "send", "mark_read", "run"):
+        assert REGISTRY.get_sample_value("gmail_agent_pipeline_stage_seconds_count", {**labels, "stage": stage})
+    assert REGISTRY.get_sample_value("gmail_agent_queue_depth", {**labels, "queue": "pipeline_messages"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_process_and_reply_to_emails_respects_concurrency_limit(async_db_session, mocker, fake_gmail_service):
+    """As mensagens avançam em paralelo, mas nunca acima do limite configurado."""
+    agent = await _new_agent(async_db_session)
+
+    in_flight = 0
+    peak = 0
+
+    async def _slow_reply(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return "Resposta gerada"
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", side_effect=_slow_reply)
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent, concurrency=2)
+
+    assert replied == 3
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_process_and_reply_to_emails_does_not_mark_failed_messages_as_read(async_db_session, mocker, fake_gmail_service):
+    """Uma mensagem que falha no pipeline continua não lida para a próxima execução."""
+    agent = await _new_agent(async_db_session)
+
+    async def _reply(original_body, sender, subject):
+        if subject == "Assunto m2":
+            raise RuntimeError("falha simulada")
+        return "Resposta gerada"
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", side_effect=_reply)
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    messages = fake_gmail_service.users.return_value.messages.return_value
+    assert replied == 2
+    assert sorted(_marked_read(messages)) == ["m1", "m3"]
+    # O watermark avança mesmo assim; a mensagem que falhou fica registrada para a próxima execução
+    assert agent.gmail_history_id == "500"
+    assert await crud_async.get_message_attempts(async_db_session, agent.id) == {"m2": 1}
+
+
+@pytest.mark.asyncio
+async def test_rejected_reply_is_not_counted_nor_marked_as_read(async_db_session, mocker, fake_gmail_service):
+    """Se o Gmail recusa o envio, a mensagem não conta como respondida e continua não lida."""
+    agent = await _new_agent(async_db_session)
+    messages = fake_gmail_service.users.return_value.messages.return_value
+
+    def _send(userId, body):
+        request = _fake_request({"id": "sent"})
+        if body["threadId"] == "m2":
+            request.execute.side_effect = HttpError(httplib2.Response({"status": 500}), b"erro")
+        return request
+
+    messages.send.side_effect = _send
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+    events = []
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent, on_event=events.append)
+
+    assert replied == 2
+    assert sorted(_marked_read(messages)) == ["m1", "m3"]
+    assert agent.gmail_history_id == "500"
+    assert [event["message_id"] for event in events if event["event"] == "failed"] == ["m2"]
+
+@pytest.mark.asyncio
+async def test_failed_message_is_retried_after_the_watermark_moves_until_the_cap(
+    async_db_session, mocker, fake_gmail_service, monkeypatch
+):
+    """Uma mensagem que sempre falha é tentada nas execuções seguintes, até o limite, sem prender o watermark."""
+    monkeypatch.setattr(settings, "GMAIL_MESSAGE_MAX_ATTEMPTS", 2)
+    agent = await _new_agent(async_db_session, history_id="100")
+    users = fake_gmail_service.users.return_value
+    history = iter([
+        {"history": [{"messagesAdded": [{"message": {"id": "m2", "labelIds": ["UNREAD"]}}]}], "historyId": "150"},
+        {"historyId": "160"},
+        {"historyId": "170"},
+    ])
+    users.history.return_value.list.side_effect = lambda **kwargs: _fake_request(next(history))
+
+    async def _reply(original_body, sender, subject):
+        raise RuntimeError("falha simulada")
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", side_effect=_reply)
+    fetched = []
+    users.messages.return_value.get.side_effect = (
+        lambda userId, id, format, fields: fetched.append(id) or _fake_request(_gmail_message(id))
+    )
+
+    for history_id in ("150", "160", "170"):
+        await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+        assert agent.gmail_history_id == history_id
+
+    # Tentada na primeira execução e de novo na segunda (fora da janela do histórico); depois, deixada de lado
+    assert fetched == ["m2", "m2"]
+    assert await crud_async.get_message_attempts(async_db_session, agent.id) == {"m2": 2}
+
+@pytest.mark.asyncio
+async def test_runs_for_the_same_mailbox_never_overlap(async_db_session, mocker):
+    """Job, stream e agendador podem disparar a mesma conta: as execuções são serializadas."""
+    agent = await _new_agent(async_db_session)
+    in_flight = 0
+    peak = 0
+
+    async def _slow_run(*args):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return 0
+
+    mocker.patch.object(email_service, "_reply_to_pending_emails", side_effect=_slow_run)
+
+    await asyncio.gather(*(email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+                           for _ in range(3)))
+
+    assert peak == 1
+
+def test_parse_message_keeps_internal_date_in_utc():
+    """internalDate é um instante em UTC; a data salva não depende do fuso do servidor."""
+    email = email_service._parse_message(models.Account(id=1), _gmail_message("m1"))
+    assert email.received_at == datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_generate_reply_with_ai_uses_shared_client():
+    """O cliente HTTP compartilhado pode ser trocado por um transporte local."""
+    requests = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": " Olá! "}]}}]})
+
+    await http_clients.init_gemini_client(transport=httpx.MockTransport(_handler))
+    try:
+        first = await email_service._generate_reply_with_ai("Corpo", "a@example.com", "Assunto")
+        second = await email_service._generate_reply_with_ai("Corpo", "b@example.com", "Assunto")
+    finally:
+        await http_clients.close_gemini_client()
+
+    assert first == second == "Olá!"
+    assert len(requests) == 2
+    assert ":generateContent" in requests[0].url.path
+
+
+@pytest.mark.asyncio
+async def test_full_sync_follows_every_page(async_db_session, mocker, fake_gmail_service):
+    """A listagem completa percorre o nextPageToken até a última página."""
+    agent = await _new_agent(async_db_session)
+    pages = {
+        None: {"messages": [{"id": "m1"}, {"id": "m2"}], "nextPageToken": "p2"},
+        "p2": {"messages": [{"id": "m3"}]},
+    }
+    messages = fake_gmail_service.users.return_value.messages.return_value
+    messages.list.side_effect = lambda pageToken=None, **kwargs: _fake_request(pages[pageToken])
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    assert replied == 3
+    assert messages.list.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_incremental_sync_only_processes_history_changes(async_db_session, mocker, fake_gmail_service):
+    """Com um watermark salvo, apenas as mensagens do histórico são processadas."""
+    agent = await _new_agent(async_db_session, history_id="100")
+    users = fake_gmail_service.users.return_value
+    users.history.return_value.list.return_value = _fake_request({
+        "history": [
+            {"messagesAdded": [{"message": {"id": "m2", "labelIds": ["UNREAD", "INBOX"]}}]},
+            {"messagesAdded": [{"message": {"id": "sent-reply", "labelIds": ["SENT"]}}]},
+        ],
+        "historyId": "150",
+    })
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    assert replied == 1
+    users.messages.return_value.list.assert_not_called()
+    users.history.return_value.list.assert_called_once()
+    assert users.history.return_value.list.call_args.kwargs["startHistoryId"] == "100"
+    assert agent.gmail_history_id == "150"
+
+
+@pytest.mark.asyncio
+async def test_expired_watermark_falls_back_to_full_sync(async_db_session, mocker, fake_gmail_service):
+    """Um historyId expirado (404) leva à listagem completa e a um novo watermark."""
+    agent = await _new_agent(async_db_session, history_id="1")
+    users = fake_gmail_service.users.return_value
+    expired = MagicMock()
+    expired.execute.side_effect = HttpError(httplib2.Response({"status": 404}), b"")
+    users.history.return_value.list.return_value = expired
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent)
+
+    assert replied == 3
+    assert agent.gmail_history_id == "500"
+
+
+@pytest.mark.asyncio
+async def test_max_messages_leaves_the_rest_for_the_next_run(async_db_session, mocker, fake_gmail_service):
+    """Com limite por execução, o excedente fica para depois e a próxima execução refaz a listagem."""
+    agent = await _new_agent(async_db_session, history_id="100")
+    users = fake_gmail_service.users.return_value
+    users.history.return_value.list.return_value = _fake_request({
+        "history": [{"messagesAdded": [{"message": {"id": i, "labelIds": ["UNREAD"]}}]} for i in ("m1", "m2", "m3")],
+        "historyId": "150",
+    })
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta gerada")
+
+    replied = await email_service.process_and_reply_to_emails(db=async_db_session, agent=agent, max_messages=2)
+
+    assert replied == 2
+    assert agent.gmail_history_id is None
+
+
+@pytest.mark.asyncio
+async def test_progress_events_are_emitted_per_message(async_db_session, mocker, fake_gmail_service):
+    """Em modo streaming, cada mensagem passa por fetched -> generating -> generated -> sent."""
+    agent = await _new_agent(async_db_session)
+
+    async def _streamed_reply(original_body, sender, subject, on_chunk):
+        on_chunk("Resposta ")
+        on_chunk("gerada")
+        return "Resposta gerada"
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", side_effect=_streamed_reply)
+
+    events = []
+    replied = await email_service.process_and_reply_to_emails(
+        db=async_db_session, agent=agent, on_event=events.append, stream_replies=True
+    )
+
+    assert replied == 3
+    assert events[0] == {"event": "listed", "count": 3}
+    for message_id in ("m1", "m2", "m3"):
+        steps = [event["event"] for event in events if event.get("message_id") == message_id]
+        assert steps == ["fetched", "generating", "generating", "generated", "sent"]
+    marked = [event["message_ids"] for event in events if event["event"] == "marked_read"]
+    assert sorted(sum(marked, [])) == ["m1", "m2", "m3"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_run_keeps_sent_replies_marked_as_read(async_db_session, mocker, fake_gmail_service):
+    """Uma execução cancelada no meio do bloco não deixa não lida uma mensagem já respondida."""
+    agent = await _new_agent(async_db_session)
+    messages = fake_gmail_service.users.return_value.messages.return_value
+    blocked = asyncio.Event()
+
+    async def _reply(original_body, sender, subject):
+        if subject != "Assunto m1":
+            await blocked.wait()  # m2 e m3 ficam presas na geração
+        return "Resposta gerada"
+
+    mocker.patch.object(email_service, "get_agent_gmail_service", return_value=fake_gmail_service)
+    mocker.patch.object(email_service, "_generate_reply_with_ai", side_effect=_reply)
+
+    run = asyncio.create_task(email_service.process_and_reply_to_emails(db=async_db_session, agent=agent))
+    for _ in range(200):
+        if messages.batchModify.called:
+            break
+        await asyncio.sleep(0.01)
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+
+    assert messages.send.call_count == 1
+    assert _marked_read(messages) == ["m1"]
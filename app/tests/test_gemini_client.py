@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app.services import gemini_client
+from app.services.gemini_client import (
+    GeminiUnavailableError, generate_content, retry_after_seconds, stream_generate_content,
+)
+from app.services.rate_limiter import AdaptiveConcurrencyLimiter, RateLimiter, TokenBucket
+
+OK_BODY = {"candidates": [{"content": {"parts": [{"text": "Olá"}]}}], "usageMetadata": {"totalTokenCount": 10}}
+
+
+def _limiter() -> RateLimiter:
+    return RateLimiter(requests_per_minute=6000, tokens_per_minute=10**6, max_concurrency=4)
+
+
+def _client(responses: list[httpx.Response]) -> httpx.AsyncClient:
+    """Cliente cujo transporte devolve as respostas da lista, em ordem."""
+    pending = list(responses)
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: pending.pop(0)))
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(mocker):
+    mocker.patch.object(gemini_client.settings, "GEMINI_BACKOFF_BASE", 0.0)
+    mocker.patch.object(gemini_client.settings, "GEMINI_MAX_RETRIES", 3)
+
+
+@pytest.mark.asyncio
+async def test_throttled_requests_are_retried_and_shrink_concurrency():
+    limiter = _limiter()
+    client = _client([
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(503),
+        httpx.Response(200, json=OK_BODY),
+    ])
+
+    result = await generate_content("prompt", client=client, limiter=limiter)
+
+    assert result == OK_BODY
+    # Dois sinais de sobrecarga (4 -> 2 -> 1) e um sucesso (1 -> 2)
+    assert limiter.concurrency.current_limit == 2
+
+
+@pytest.mark.asyncio
+async def test_exhausted_retries_raise_instead_of_returning_empty():
+    client = _client([httpx.Response(503)] * 4)
+    with pytest.raises(GeminiUnavailableError):
+        await generate_content("prompt", client=client, limiter=_limiter())
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    client = _client([httpx.Response(400)])
+    with pytest.raises(httpx.HTTPStatusError):
+        await generate_content("prompt", client=client, limiter=_limiter())
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert retry_after_seconds(httpx.Response(429, headers={"Retry-After": "7"})) == 7
+    assert retry_after_seconds(httpx.Response(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert retry_after_seconds(httpx.Response(429)) is None
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_makes_bursts_wait():
+    bucket = TokenBucket(per_minute=600, capacity=2)  # 10 fichas por segundo
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(4)))
+    assert time.monotonic() - started >= 0.15
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_grows_on_success_and_caps_in_flight():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=3)
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.current_limit == 3
+
+    peak = 0
+
+    async def _work():
+        nonlocal peak
+        await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.release()
+
+    await asyncio.gather(*(_work() for _ in range(8)))
+    assert peak == 3
+
+
+def _sse_body(*events: dict) -> bytes:
+    return "".join(f"data: {json.dumps(event)}\r\n\r\n" for event in events).encode()
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_chunks_and_retries_before_the_first_one():
+    requests = []
+    responses = [
+        httpx.Response(503),
+        httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=_sse_body(
+            {"candidates": [{"content": {"parts": [{"text": "Olá, "}]}}]},
+            {"candidates": [{"content": {"parts": [{"text": "mundo"}]}}], "usageMetadata": {"totalTokenCount": 9}},
+        )),
+    ]
+
+    def _handler(request):
+        requests.append(request)
+        return responses.pop(0)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+    chunks = [chunk async for chunk in stream_generate_content("prompt", client=client, limiter=_limiter())]
+
+    assert chunks == ["Olá, ", "mundo"]
+    assert len(requests) == 2
+    assert ":streamGenerateContent" in requests[1].url.path
+    assert requests[1].url.params["alt"] == "sse"
+
+
+@pytest.mark.asyncio
+async def test_stream_client_errors_are_not_retried():
+    client = _client([httpx.Response(400, json={"error": "bad request"})])
+    with pytest.raises(httpx.HTTPStatusError):
+        async for _ in stream_generate_content("prompt", client=client, limiter=_limiter()):
+            pass
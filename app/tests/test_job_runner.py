@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from app import models
+from app.services.job_runner import JobRunner
+
+
+@pytest.fixture
+def job(db_session):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent", encrypted_credentials=b"creds")
+    db_session.add(agent)
+    db_session.commit()
+    db_job = models.ProcessingJob(account_id=agent.id, status=models.JobStatusEnum.queued)
+    db_session.add(db_job)
+    db_session.commit()
+    return db_job
+
+
+def _reload(db_session, db_job):
+    db_session.expire_all()
+    return db_session.get(models.ProcessingJob, db_job.id)
+
+
+@pytest.mark.asyncio
+async def test_job_records_counters_and_message_outcomes(async_session_factory, db_session, job, mocker):
+    async def _fake_process(db, agent, on_event):
+        on_event({"event": "listed", "count": 3})
+        for message_id in ("m1", "m2", "m3"):
+            on_event({"event": "fetched", "message_id": message_id})
+        on_event({"event": "sent", "message_id": "m1", "to": "a@example.com"})
+        on_event({"event": "failed", "message_id": "m2", "error": "Gmail indisponível"})
+        on_event({"event": "marked_read", "message_ids": ["m1", "m3"]})
+        return 1
+
+    mocker.patch("app.services.job_runner.process_and_reply_to_emails", side_effect=_fake_process)
+
+    await JobRunner(async_session_factory, progress_interval=0.01).run_job(job.id)
+
+    saved = _reload(db_session, job)
+    assert saved.status == models.JobStatusEnum.completed
+    assert (saved.total_messages, saved.processed_messages, saved.replied_messages, saved.failed_messages) == (3, 3, 1, 1)
+    assert saved.finished_at is not None
+    outcomes = {message.gmail_message_id: (message.outcome, message.error_message) for message in saved.messages}
+    assert outcomes == {
+        "m1": (models.MessageOutcomeEnum.replied, None),
+        "m2": (models.MessageOutcomeEnum.failed, "Gmail indisponível"),
+        "m3": (models.MessageOutcomeEnum.no_reply, None),
+    }
+
+
+@pytest.mark.asyncio
+async def test_pipeline_errors_mark_the_job_as_failed(async_session_factory, db_session, job, mocker):
+    mocker.patch("app.services.job_runner.process_and_reply_to_emails",
+                 side_effect=ConnectionError("Credenciais inválidas"))
+
+    await JobRunner(async_session_factory, progress_interval=0.01).run_job(job.id)
+
+    saved = _reload(db_session, job)
+    assert saved.status == models.JobStatusEnum.failed
+    assert saved.error_message == "Credenciais inválidas"
+
+
+@pytest.mark.asyncio
+async def test_cancel_interrupts_a_running_job(async_session_factory, db_session, job, mocker):
+    started = asyncio.Event()
+
+    async def _slow_process(db, agent, on_event):
+        on_event({"event": "listed", "count": 10})
+        started.set()
+        await asyncio.Event().wait()
+
+    mocker.patch("app.services.job_runner.process_and_reply_to_emails", side_effect=_slow_process)
+    runner = JobRunner(async_session_factory, progress_interval=0.01)
+    task = runner.submit(job.id)
+    await asyncio.wait_for(started.wait(), timeout=5)
+
+    async with async_session_factory() as db:
+        running = await db.get(models.ProcessingJob, job.id)
+        assert running.status == models.JobStatusEnum.running
+        running.cancel_requested = True
+        await db.commit()
+
+    await asyncio.wait_for(task, timeout=5)
+    saved = _reload(db_session, job)
+    assert saved.status == models.JobStatusEnum.cancelled
+    assert saved.total_messages == 10
+
+
+@pytest.mark.asyncio
+async def test_stale_jobs_are_resumed_and_shutdown_requeues(async_session_factory, db_session, job, mocker):
+    """Um job sem heartbeat recente é retomado; ao encerrar o processo, ele volta para a fila."""
+    job.status = models.JobStatusEnum.running
+    job.heartbeat_at = datetime.now(timezone.utc) - timedelta(minutes=10)
+    db_session.commit()
+    started = asyncio.Event()
+
+    async def _slow_process(db, agent, on_event):
+        started.set()
+        await asyncio.Event().wait()
+
+    mocker.patch("app.services.job_runner.process_and_reply_to_emails", side_effect=_slow_process)
+    runner = JobRunner(async_session_factory, progress_interval=0.01, stale_after=60)
+
+    assert await runner.resume_pending() == [job.id]
+    await asyncio.wait_for(started.wait(), timeout=5)
+    assert await runner.resume_pending() == []  # Já em execução neste processo
+
+    await runner.shutdown()
+    assert _reload(db_session, job).status == models.JobStatusEnum.queued
@@ -0,0 +1,72 @@
+import json
+import logging
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics, models
+from app.logging_config import JsonFormatter
+from app.services.outbox_worker import outbox_queue_depth
+
+
+def _sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_metrics_endpoint_exposes_prometheus_text(test_client):
+    with metrics.agent_context(42):
+        metrics.record_messages("replied")
+        with metrics.observe_stage("generate"):
+            pass
+
+    response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'gmail_agent_messages_total{agent="42",outcome="replied"}' in response.text
+    assert 'gmail_agent_pipeline_stage_seconds_count{agent="42",stage="generate"}' in response.text
+    assert 'gmail_agent_queue_depth{agent="all",queue="summaries"}' in response.text
+
+
+def test_failed_calls_are_labeled_with_the_agent_and_outcome():
+    labels = {"agent": "7", "service": "gemini", "operation": "generateContent"}
+    before_ok = _sample("gmail_agent_external_call_seconds_count", {**labels, "outcome": "ok"})
+    before_error = _sample("gmail_agent_external_call_seconds_count", {**labels, "outcome": "error"})
+
+    with metrics.agent_context(7):
+        with metrics.observe_call("gemini", "generateContent"):
+            pass
+        with metrics.observe_call("gemini", "generateContent") as call:
+            call.failed()
+        with pytest.raises(ConnectionError), metrics.observe_call("gemini", "generateContent"):
+            raise ConnectionError("sem rede")
+
+    assert _sample("gmail_agent_external_call_seconds_count", {**labels, "outcome": "ok"}) == before_ok + 1
+    assert _sample("gmail_agent_external_call_seconds_count", {**labels, "outcome": "error"}) == before_error + 2
+    assert metrics.current_agent() == metrics.NO_AGENT
+
+
+def test_json_logs_include_the_agent_and_extra_fields():
+    record = logging.LogRecord("app.services.email_service", logging.WARNING, __file__, 1,
+                               "Falha ao buscar o e-mail %s", ("m1",), None)
+    record.agent = "3"
+    record.message_id = "m1"
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "WARNING"
+    assert entry["message"] == "Falha ao buscar o e-mail m1"
+    assert entry["agent"] == "3"
+    assert entry["message_id"] == "m1"
+
+
+def test_outbox_queue_depth_counts_only_queued_emails(db_session):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent")
+    db_session.add(agent)
+    db_session.commit()
+    for status in (models.EmailStatusEnum.queued, models.EmailStatusEnum.queued, models.EmailStatusEnum.sent):
+        db_session.add(models.OutgoingEmail(account_id=agent.id, recipient="a@example.com", status=status))
+    db_session.commit()
+
+    assert outbox_queue_depth(sessionmaker(bind=db_session.get_bind())) == 2
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect
+
+from app import migrate
+
+
+def test_split_statements_keeps_dollar_quoted_blocks_and_strings():
+    script = """-- Comentário; com ponto e vírgula
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'x;y') THEN
+        CREATE TYPE x AS ENUM ('a');
+    END IF;
+END
+$$;
+ALTER TYPE x ADD VALUE IF NOT EXISTS 'b';
+"""
+
+    statements = migrate.split_statements(script)
+
+    assert len(statements) == 2
+    assert statements[0].startswith("DO $$") and statements[0].endswith("$$")
+    assert "'x;y'" in statements[0]
+    assert statements[1] == "ALTER TYPE x ADD VALUE IF NOT EXISTS 'b'"
+
+
+def test_every_migration_file_splits_into_statements():
+    files = migrate.migration_files()
+
+    assert files
+    for path in files:
+        assert migrate.split_statements(path.read_text(encoding="utf-8")), path.name
+
+
+def test_migrate_creates_missing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+
+    migrate.migrate(engine)
+    migrate.migrate(engine)  # Rodar de novo não altera nada
+
+    tables = set(inspect(engine).get_table_names())
+    assert {"accounts", "received_emails", "outgoing_emails", "email_summaries"} <= tables
+    engine.dispose()
+
+
+def test_importing_the_app_opens_no_connection_and_skips_heavy_imports():
+    """A importação de app.main não cria engines nem carrega os módulos do OAuth/discovery."""
+    code = (
+        "import sys\n"
+        "import app.main\n"
+        "from app import database\n"
+        "assert database._engine is None and database._async_engine is None\n"
+        "assert 'google_auth_oauthlib' not in sys.modules\n"
+        "assert 'googleapiclient.discovery' not in sys.modules\n"
+    )
+    # Um host que não existe: qualquer tentativa de conexão falharia
+    env = {**os.environ, "POSTGRES_HOST": "db.invalid"}
+
+    result = subprocess.run([sys.executable, "-c", code], env=env, cwd=Path(migrate.__file__).parent.parent,
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
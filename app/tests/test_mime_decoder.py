@@ -0,0 +1,57 @@
+import base64
+
+from app.services.mime_decoder import decode_message_body, html_to_text
+
+
+def _part(mime_type: str, text: str, charset: str = "utf-8", **extra) -> dict:
+    data = base64.urlsafe_b64encode(text.encode(charset)).decode().rstrip("=")
+    headers = [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}]
+    return {"mimeType": mime_type, "headers": headers, "body": {"data": data}, **extra}
+
+
+def _multipart(mime_type: str, *parts: dict) -> dict:
+    return {"mimeType": mime_type, "body": {"size": 0}, "parts": list(parts)}
+
+
+def test_nested_multipart_prefers_plain_text_in_document_order():
+    payload = _multipart(
+        "multipart/mixed",
+        _multipart(
+            "multipart/related",
+            _multipart("multipart/alternative", _part("text/plain", "Olá, "), _part("text/html", "<p>Olá</p>")),
+        ),
+        _part("text/plain", "mundo"),
+        _part("text/plain", "anexo", filename="nota.txt"),
+    )
+    assert decode_message_body(payload) == "Olá, mundo"
+
+
+def test_declared_charset_is_honored():
+    payload = _part("text/plain", "Atenção: reunião às 10h", charset="iso-8859-1")
+    assert decode_message_body(payload) == "Atenção: reunião às 10h"
+
+
+def test_unknown_charset_falls_back_to_utf8():
+    payload = _part("text/plain", "Olá")
+    payload["headers"] = [{"name": "Content-Type", "value": "text/plain; charset=x-desconhecido"}]
+    assert decode_message_body(payload) == "Olá"
+
+
+def test_html_only_messages_are_converted_to_text():
+    markup = (
+        "<html><head><style>p {color: red}</style></head><body>"
+        "<p>Promoção&nbsp;de <b>verão</b></p><script>alert(1)</script><div>Até logo</div></body></html>"
+    )
+    payload = _multipart("multipart/alternative", _part("text/html", markup))
+    assert decode_message_body(payload) == "Promoção de verão\nAté logo"
+
+
+def test_body_is_truncated_at_the_configured_size():
+    payload = _multipart("multipart/mixed", _part("text/plain", "ç" * 5000), _part("text/plain", "fim"))
+    body = decode_message_body(payload, max_chars=100)
+    assert body == "ç" * 100
+
+
+def test_html_to_text_unescapes_entities_and_keeps_inline_words_together():
+    assert html_to_text("<p>a &amp; b</p><br>c") == "a & b\n\nc"
+    assert html_to_text("<p>pala<b>vra</b> <td>x</td><td>y</td></p>") == "palavra x y"
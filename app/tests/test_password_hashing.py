@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from argon2 import PasswordHasher
+
+from app import models
+from app.password_hashing import PasswordHashingBusyError, PasswordHashingPool, password_hashing_pool, ph
+
+
+@pytest.mark.asyncio
+async def test_pool_hashes_in_worker_processes_and_applies_backpressure():
+    """Pedidos além de max_pending são recusados na hora, sem entrar na fila."""
+    pool = PasswordHashingPool(workers=1, max_pending=1)
+    try:
+        results = await asyncio.gather(pool.hash("senha"), pool.hash("outra"), return_exceptions=True)
+        assert isinstance(results[1], PasswordHashingBusyError)
+        assert await pool.verify_and_rehash(results[0], "senha") == (True, None)
+        assert await pool.verify_and_rehash(results[0], "errada") == (False, None)
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+def test_login_rehashes_passwords_created_with_old_parameters(test_client, db_session):
+    """Um hash com parâmetros antigos do Argon2 é refeito de forma transparente no login."""
+    response = test_client.post(
+        "/agents/register",
+        json={"email": "agent@example.com", "password": "password", "name": "Agent"},
+    )
+    agent = db_session.get(models.Account, response.json()["id"])
+    old_hash = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1).hash("password")
+    agent.password_hash = old_hash
+    db_session.commit()
+
+    response = test_client.post("/agents/login", json={"email": "agent@example.com", "password": "password"})
+
+    assert response.status_code == 200
+    db_session.expire_all()
+    assert agent.password_hash != old_hash
+    assert not ph.check_needs_rehash(agent.password_hash)
+
+
+def test_login_returns_503_when_the_pool_is_saturated(test_client, mocker):
+    test_client.post(
+        "/agents/register",
+        json={"email": "agent@example.com", "password": "password", "name": "Agent"},
+    )
+    mocker.patch.object(password_hashing_pool, "verify_and_rehash", side_effect=PasswordHashingBusyError("cheio"))
+
+    response = test_client.post("/agents/login", json={"email": "agent@example.com", "password": "password"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app import models
+from app.services.reply_cache import ReplyCache, reply_cache_key
+
+
+def test_cache_key_normalizes_equivalent_messages():
+    """Mensagens equivalentes geram a mesma chave; modelo e prompt fazem parte dela."""
+    key = reply_cache_key("Ana <ana@Empresa.com>", "Aviso  geral", "Olá,\n\n  todos", "gemini", "1")
+
+    assert key == reply_cache_key("ana  <ana@empresa.com>", "RE: aviso geral", "olá, todos", "gemini", "1")
+    assert key != reply_cache_key("Ana <ana@Empresa.com>", "Aviso geral", "Olá, todos", "gemini", "2")
+    assert key != reply_cache_key("Ana <ana@Empresa.com>", "Aviso geral", "Olá, todos", "outro-modelo", "1")
+
+
+def test_cache_key_never_shares_a_reply_between_senders():
+    """O prompt inclui o remetente completo, então remetentes do mesmo domínio não compartilham respostas."""
+    key = reply_cache_key("Ana <ana@empresa.com>", "Aviso geral", "Olá, todos", "gemini", "1")
+
+    assert key != reply_cache_key("Bruno <bruno@empresa.com>", "Aviso geral", "Olá, todos", "gemini", "1")
+    assert key != reply_cache_key("Bruno <ana@empresa.com>", "Aviso geral", "Olá, todos", "gemini", "1")
+
+
+@pytest.mark.asyncio
+async def test_identical_messages_trigger_a_single_generation(async_session_factory):
+    """Gerações concorrentes para a mesma chave são unificadas e depois servidas da memória."""
+    cache = ReplyCache(max_entries=10, ttl_seconds=60, session_factory=async_session_factory)
+    calls = 0
+
+    async def _generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "Resposta"
+
+    replies = await asyncio.gather(*(
+        cache.get_or_generate("k", _generate, model_name="gemini", prompt_version="1")
+        for _ in range(5)
+    ))
+    again = await cache.get_or_generate("k", _generate, model_name="gemini", prompt_version="1")
+
+    assert replies == ["Resposta"] * 5 and again == "Resposta"
+    assert calls == 1
+    assert cache.stats()["memory_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_persistent_tier_survives_a_new_process(async_session_factory):
+    """Um processo novo (LRU vazio) encontra a resposta na tabela e a promove para a memória."""
+    await ReplyCache(10, 60, async_session_factory).put("k", "Resposta", "gemini", "1")
+
+    fresh = ReplyCache(max_entries=10, ttl_seconds=60, session_factory=async_session_factory)
+    assert await fresh.get("k") == "Resposta"
+    assert await fresh.get("k") == "Resposta"
+    assert fresh.stats()["persistent_hits"] == 1
+    assert fresh.stats()["memory_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_empty_and_expired_replies_are_not_served(async_session_factory):
+    cache = ReplyCache(max_entries=10, ttl_seconds=-1, session_factory=async_session_factory)
+    await cache.put("k", "Resposta", "gemini", "1")
+
+    assert await cache.get("k") is None
+    assert await cache.purge_expired() == 1
+
+
+@pytest.mark.asyncio
+async def test_purger_removes_expired_entries_in_the_background(db_session, async_session_factory):
+    cache = ReplyCache(max_entries=10, ttl_seconds=-1, session_factory=async_session_factory)
+    await cache.put("k", "Resposta", "gemini", "1")
+    stop_event = asyncio.Event()
+
+    purger = asyncio.create_task(cache.run_purger(stop_event))
+    await asyncio.sleep(0.05)
+    stop_event.set()
+    await asyncio.wait_for(purger, timeout=1)
+
+    assert db_session.query(models.AIReplyCache).count() == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidate_by_prompt_version(db_session, async_session_factory):
+    cache = ReplyCache(max_entries=10, ttl_seconds=60, session_factory=async_session_factory)
+    await cache.put("old", "Resposta antiga", "gemini", "1")
+    await cache.put("new", "Resposta nova", "gemini", "2")
+
+    assert await cache.invalidate(prompt_version="1") == 1
+    assert await cache.get("old") is None
+    assert await cache.get("new") == "Resposta nova"
+    assert db_session.query(models.AIReplyCache).count() == 1
+
+
+def test_reply_cache_endpoints(test_client):
+    response = test_client.delete("/reply-cache")
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 0}
+
+    response = test_client.get("/reply-cache/stats")
+    assert response.status_code == 200
+    assert {"memory_hits", "persistent_hits", "misses", "hit_ratio"} <= response.json().keys()
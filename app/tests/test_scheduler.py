@@ -0,0 +1,73 @@
+import pytest
+from app import models
+from app.services import scheduler as scheduler_module
+from app.services.scheduler import PollingScheduler, account_shard
+
+
+@pytest.fixture
+def accounts(db_session):
+    """Cria seis contas autorizadas e uma sem credenciais."""
+    agents = [
+        models.Account(email=f"agent{i}@example.com", password_hash="x", name=f"Agent {i}",
+                       encrypted_credentials=b"creds")
+        for i in range(6)
+    ]
+    agents.append(models.Account(email="pending@example.com", password_hash="x", name="Pending"))
+    db_session.add_all(agents)
+    db_session.commit()
+    return agents
+
+
+@pytest.mark.asyncio
+async def test_shards_split_authorized_accounts(async_session_factory, accounts):
+    """Cada conta autorizada pertence a exatamente um shard; contas sem credenciais ficam de fora."""
+    seen = []
+    for shard_index in range(3):
+        scheduler = PollingScheduler(async_session_factory, shard_index=shard_index, shard_count=3)
+        await scheduler.reload_accounts()
+        assert all(account_shard(account_id, 3) == shard_index for account_id in scheduler._schedules)
+        seen.extend(scheduler._schedules)
+
+    assert sorted(seen) == sorted(agent.id for agent in accounts if agent.encrypted_credentials)
+
+
+def test_idle_backoff_grows_until_max_interval():
+    scheduler = PollingScheduler(interval=10, max_interval=60, jitter=0)
+    assert [scheduler.next_delay(idle) for idle in range(5)] == [10, 20, 40, 60, 60]
+
+
+def test_jitter_stays_within_bounds():
+    scheduler = PollingScheduler(interval=100, max_interval=100, jitter=0.2)
+    delays = [scheduler.next_delay(0) for _ in range(200)]
+    assert all(80 <= delay <= 120 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.asyncio
+async def test_run_account_backs_off_idle_mailboxes(async_session_factory, accounts, mocker):
+    """Execuções sem respostas aumentam o intervalo; uma execução ativa o reinicia."""
+    scheduler = PollingScheduler(async_session_factory, interval=10, max_interval=80, jitter=0, max_messages=5)
+    await scheduler.reload_accounts()
+    account_id = accounts[0].id
+
+    process = mocker.patch.object(scheduler_module, "process_and_reply_to_emails", return_value=0)
+    await scheduler.run_account(account_id)
+    await scheduler.run_account(account_id)
+    assert scheduler._schedules[account_id].idle_runs == 2
+    assert process.call_args.kwargs["max_messages"] == 5
+
+    process.return_value = 3
+    await scheduler.run_account(account_id)
+    assert scheduler._schedules[account_id].idle_runs == 0
+
+
+def test_due_accounts_are_served_oldest_first():
+    scheduler = PollingScheduler(interval=10)
+    scheduler._schedules = {
+        1: scheduler_module._AgentSchedule(next_run_at=30),
+        2: scheduler_module._AgentSchedule(next_run_at=10),
+        3: scheduler_module._AgentSchedule(next_run_at=20),
+        4: scheduler_module._AgentSchedule(next_run_at=99),
+    }
+    scheduler._running = {3}
+    assert scheduler.due_accounts(now=50) == [2, 1]
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.auth.exceptions import TransportError
+
+from app import models, security
+
+
+def _utcnow() -> datetime:
+    """Horário UTC sem fuso, no mesmo formato usado pelo google-auth."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _expired_credentials_dict() -> dict:
+    return {
+        "token": "old-token",
+        "refresh_token": "refresh-token",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "client_id": "client-id",
+        "client_secret": "client-secret",
+        "scopes": ["https://mail.google.com/"],
+        "expiry": (_utcnow() - timedelta(minutes=5)).isoformat(),
+    }
+
+
+@pytest.fixture
+def agent():
+    security.credential_cache.invalidate()
+    yield models.Account(
+        id=1, email="agent@example.com",
+        encrypted_credentials=security.encrypt_data(_expired_credentials_dict()),
+    )
+    security.credential_cache.invalidate()
+
+
+@pytest.fixture
+def fake_refresh(mocker):
+    """Simula a renovação do token no Google e a gravação no banco."""
+    calls = []
+
+    def _refresh(creds, request):
+        calls.append(creds)
+        time.sleep(0.05)
+        creds.token = "new-token"
+        creds.expiry = _utcnow() + timedelta(hours=1)
+
+    mocker.patch.object(security.Credentials, "refresh", autospec=True, side_effect=_refresh)
+    mocker.patch.object(security, "_save_credentials")
+    return calls
+
+
+def test_cached_credentials_skip_decryption(agent, fake_refresh, mocker):
+    """Depois da primeira chamada, as credenciais vêm do cache sem descriptografar."""
+    decrypt = mocker.spy(security, "decrypt_data")
+
+    first = security._get_valid_credentials(agent)
+    second = security._get_valid_credentials(agent)
+
+    assert first is second
+    assert first.token == "new-token"
+    assert decrypt.call_count == 1
+    assert len(fake_refresh) == 1
+
+
+def test_concurrent_refresh_is_single_flight(agent, fake_refresh):
+    """Várias threads com o token expirado resultam em uma única renovação."""
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(security._get_valid_credentials(agent).token))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["new-token"] * 5
+    assert len(fake_refresh) == 1
+    security._save_credentials.assert_called_once()
+
+
+def test_background_refresher_renews_tokens_close_to_expiry(agent, fake_refresh):
+    """O renovador proativo renova tokens em cache que expiram dentro da margem."""
+    creds = security.Credentials.from_authorized_user_info(_expired_credentials_dict())
+    creds.expiry = _utcnow() + timedelta(seconds=30)
+    security.credential_cache.put(agent.id, creds)
+
+    assert security.refresh_expiring_credentials(margin_seconds=60) == 1
+    assert security.credential_cache.get(agent.id).token == "new-token"
+    assert security.refresh_expiring_credentials(margin_seconds=60) == 0
+
+
+@pytest.mark.parametrize("error, wiped", [
+    (security.RefreshError("invalid_grant: Token has been expired or revoked."), True),
+    (TransportError("Falha de DNS"), False),
+])
+def test_refresh_failure_only_wipes_revoked_credentials(agent, mocker, error, wiped):
+    """Só um refresh_token recusado apaga as credenciais; uma falha de rede mantém tudo para a próxima tentativa."""
+    mocker.patch.object(security.Credentials, "refresh", autospec=True, side_effect=error)
+    save = mocker.patch.object(security, "_save_credentials")
+    creds = security.Credentials.from_authorized_user_info(_expired_credentials_dict())
+    creds.expiry = _utcnow() + timedelta(seconds=30)
+    security.credential_cache.put(agent.id, creds)
+
+    assert security.refresh_expiring_credentials(margin_seconds=60) == 0
+
+    if wiped:
+        save.assert_called_once_with(agent.id, None)
+        assert security.credential_cache.get(agent.id) is None
+    else:
+        save.assert_not_called()
+        assert security.credential_cache.get(agent.id) is creds
+
+
+def test_credential_cache_evicts_least_recently_used():
+    cache = security.CredentialCache(ttl_seconds=60, max_size=2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    cache.get(1)
+    cache.put(3, "c")
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+
+
+def test_google_auth_flow_reads_client_secrets_once(tmp_path, monkeypatch):
+    """O credentials.json é lido uma vez; cada chamada ainda recebe um fluxo novo."""
+    credentials_path = tmp_path / "credentials.json"
+    client_config = {"web": {
+        "client_id": "client-id", "client_secret": "client-secret",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }}
+    credentials_path.write_text(json.dumps(client_config), encoding="utf-8")
+    monkeypatch.setattr(security.settings, "GMAIL_CREDENTIALS_PATH", str(credentials_path))
+    security._client_secrets_config.cache_clear()
+
+    first = security.create_google_auth_flow()
+    credentials_path.unlink()
+    second = security.create_google_auth_flow()
+
+    assert first is not second
+    assert second.client_config["client_id"] == "client-id"
+    assert security._client_secrets_config.cache_info().misses == 1
+    security._client_secrets_config.cache_clear()
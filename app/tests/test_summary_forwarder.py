@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from app import crud_async, models
+from app.config import settings
+from app.services.rate_limiter import summary_rate_limiter
+from app.services.summary_forwarder import SummaryForwarder
+
+_SUMMARY_RESPONSE = {"candidates": [{"content": {"parts": [{"text": "Pedido de orçamento até sexta."}]}}]}
+
+
+@pytest.fixture
+def received_email(db_session):
+    agent = models.Account(email="agent@example.com", password_hash="x", name="Agent",
+                           forward_url="https://hooks.example.com/resumos")
+    db_session.add(agent)
+    db_session.commit()
+    email = models.ReceivedEmail(gmail_message_id="g1", account_id=agent.id, sender="cliente@example.com",
+                                 subject="Orçamento", body="Preciso de um orçamento até sexta.")
+    db_session.add(email)
+    db_session.commit()
+    return email
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_BACKOFF_BASE", 0.0)
+
+
+def _delivery(summary_id: int, url: str) -> dict:
+    return {"id": summary_id, "account_id": 1, "summary_text": "Resumo", "forward_url": url, "created_at": None,
+            "gmail_message_id": f"g{summary_id}", "sender": "a@example.com", "subject": "Oi", "received_at": None}
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_created_delivered_and_recorded(async_session_factory, db_session, received_email, mocker):
+    mocker.patch("app.services.summary_forwarder.generate_content", return_value=_SUMMARY_RESPONSE)
+    requests = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as client:
+        forwarder = SummaryForwarder(async_session_factory, client=client)
+        summary_ids = await forwarder.summarize([received_email.id])
+        await forwarder.drain()
+        # Um e-mail que já tem resumo não é resumido de novo
+        assert await forwarder.summarize([received_email.id]) == []
+
+    assert len(summary_ids) == 1
+    payload = json.loads(requests[0].content)
+    assert payload["summary"] == "Pedido de orçamento até sexta."
+    assert payload["email"]["gmail_message_id"] == "g1"
+    assert requests[0].headers["Idempotency-Key"] == f"email-summary-{summary_ids[0]}"
+
+    summary = db_session.get(models.EmailSummary, summary_ids[0])
+    assert summary.forward_status == models.ForwardStatusEnum.success
+    assert summary.account_id == received_email.account_id
+
+
+@pytest.mark.asyncio
+async def test_retryable_errors_are_retried_and_client_errors_are_not():
+    calls = {"flaky.example.com": 0, "broken.example.com": 0}
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        calls[request.url.host] += 1
+        if request.url.host == "broken.example.com":
+            return httpx.Response(404)
+        return httpx.Response(503 if calls["flaky.example.com"] == 1 else 204)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as client:
+        forwarder = SummaryForwarder(client=client, max_retries=2)
+        assert await forwarder.deliver(_delivery(1, "https://flaky.example.com/hook")) == (
+            models.ForwardStatusEnum.success, None
+        )
+        assert await forwarder.deliver(_delivery(2, "https://broken.example.com/hook")) == (
+            models.ForwardStatusEnum.failed, "HTTP 404"
+        )
+
+    assert calls == {"flaky.example.com": 2, "broken.example.com": 1}
+
+
+async def _no_flush() -> int:
+    """Mantém os resultados em memória (as entregas deste teste não existem no banco)."""
+    return 0
+
+
+@pytest.mark.asyncio
+async def test_a_slow_webhook_does_not_stall_other_hosts():
+    release_slow = asyncio.Event()
+    fast_delivered = asyncio.Event()
+
+    async def _handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow.example.com":
+            await release_slow.wait()
+        else:
+            fast_delivered.set()
+        return httpx.Response(200)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as client:
+        forwarder = SummaryForwarder(client=client, per_host_concurrency=1)
+        forwarder.flush = _no_flush
+        for summary_id in range(3):
+            forwarder.schedule_delivery(_delivery(summary_id, "https://slow.example.com/hook"))
+        forwarder.schedule_delivery(_delivery(10, "https://fast.example.com/hook"))
+
+        await asyncio.wait_for(fast_delivered.wait(), timeout=5)
+        assert forwarder._results == [{"id": 10, "forward_status": models.ForwardStatusEnum.success,
+                                       "status_message": None}]
+        release_slow.set()
+        await forwarder.drain()
+
+    assert len(forwarder._results) == 4
+
+
+@pytest.mark.asyncio
+async def test_emails_left_without_summary_are_picked_up_by_the_sweep(async_session_factory, db_session,
+                                                                     received_email, mocker):
+    """E-mails fora da fila em memória (ou com resumo vazio) são resumidos pela varredura."""
+    generate = mocker.patch("app.services.summary_forwarder.generate_content",
+                            side_effect=[{"candidates": []}, _SUMMARY_RESPONSE])
+    forwarder = SummaryForwarder(async_session_factory, client=mocker.AsyncMock())
+
+    # O e-mail nunca entrou na fila (ex.: fila cheia ou reinício): a varredura o encontra
+    assert await forwarder.resume_missing_summaries() == 1
+    assert await forwarder.summarize(await forwarder._next_batch(timeout=0.1)) == []
+
+    # Resumo vazio: não é tentado de novo antes do backoff
+    assert await forwarder.resume_missing_summaries() == 0
+    attempts, _ = forwarder._summary_retries[received_email.id]
+    forwarder._summary_retries[received_email.id] = (attempts, 0.0)
+    assert await forwarder.resume_missing_summaries() == 1
+    summary_ids = await forwarder.summarize(await forwarder._next_batch(timeout=0.1))
+    await forwarder.drain()
+
+    assert len(summary_ids) == 1
+    assert generate.call_args.kwargs["limiter"] is summary_rate_limiter
+    assert forwarder._summary_retries == {}
+    assert await forwarder.resume_missing_summaries() == 0
+
+
+@pytest.mark.asyncio
+async def test_a_second_summary_for_the_same_email_is_ignored(async_db_session, db_session, received_email):
+    summary = {"received_email_id": received_email.id, "account_id": received_email.account_id,
+               "summary_text": "Resumo", "forward_url": "https://hooks.example.com/resumos"}
+
+    assert len(await crud_async.create_email_summaries(async_db_session, [summary])) == 1
+    assert await crud_async.create_email_summaries(async_db_session, [summary]) == []
+    assert db_session.query(models.EmailSummary).count() == 1
@@ -0,0 +1,143 @@
+from unittest.mock import MagicMock
+
+import pytest
+from app.services import email_service
+from app.services.thread_context import AGENT_AUTHOR, ThreadContextCache, compact_message_text
+
+
+def _cache(**kwargs) -> ThreadContextCache:
+    options = {"max_threads": 10, "max_chars": 2000, "recent_messages": 2, "ttl_seconds": 60}
+    options.update(kwargs)
+    return ThreadContextCache(**options)
+
+
+async def _execute(request):
+    return request.execute()
+
+
+def _gmail_service(thread: dict) -> MagicMock:
+    service = MagicMock()
+    request = MagicMock()
+    request.http = None
+    request.execute.return_value = thread
+    service.users.return_value.threads.return_value.get.return_value = request
+    return service
+
+
+def test_compact_message_text_drops_quoted_history():
+    text = "Pode ser na sexta?\n\nEm seg., 1 de jan., Ana escreveu:\n> Vamos marcar a reunião"
+    assert compact_message_text(text, 100) == "Pode ser na sexta?"
+    assert compact_message_text("a " * 100, 20).endswith("...")
+
+
+def test_old_messages_are_summarized_and_context_stays_bounded():
+    cache = _cache(max_chars=400)
+    for index in range(20):
+        cache.record(1, "t1", f"m{index}", "cliente@example.com", f"Mensagem número {index} " + "texto " * 30)
+
+    context = cache.render(1, "t1")
+    assert len(context) <= 400
+    assert "Mensagem número 19" in context
+    assert "Mensagem número 0 " not in context
+    # Uma mensagem já incluída não é adicionada de novo
+    cache.record(1, "t1", "m19", "cliente@example.com", "Mensagem número 19")
+    assert cache.render(1, "t1") == context
+
+
+@pytest.mark.asyncio
+async def test_existing_thread_is_fetched_once_and_then_updated_incrementally():
+    cache = _cache()
+    service = _gmail_service({
+        "messages": [
+            {"id": "t1", "snippet": "Preciso de um orçamento",
+             "payload": {"headers": [{"name": "From", "value": "cliente@example.com"}]}},
+            {"id": "m2", "snippet": "Segue o orçamento &amp; prazo",
+             "payload": {"headers": [{"name": "From", "value": "agent@example.com"}]}},
+        ],
+    })
+    cache.reset_account(1, "900")
+
+    context = await cache.context_for(service, 1, {"id": "m3", "threadId": "t1"},
+                                      sender="cliente@example.com", body="Pode fechar?", execute=_execute)
+    assert "Preciso de um orçamento" in context
+    assert "Segue o orçamento & prazo" in context
+    assert "Pode fechar?" not in context
+
+    cache.record(1, "t1", "r1", AGENT_AUTHOR, "Fechado, obrigado!")
+    # A próxima sincronização traz a resposta enviada (já conhecida) e a nova mensagem
+    cache.apply_history(1, "900", "950", {"t1": {"r1", "m4"}}, pending_ids=["m4"])
+    context = await cache.context_for(service, 1, {"id": "m4", "threadId": "t1"},
+                                      sender="cliente@example.com", body="Ótimo", execute=_execute)
+
+    # A segunda mensagem usa o contexto do cache, sem nenhuma chamada ao Gmail
+    get = service.users.return_value.threads.return_value.get
+    assert [call.kwargs["format"] for call in get.call_args_list] == ["metadata"]
+    assert cache.seeds == 1 and cache.hits == 1 and cache.refreshes == 0
+    assert "Pode fechar?" in context and "Fechado, obrigado!" in context
+
+
+@pytest.mark.asyncio
+async def test_thread_that_moved_past_the_cache_is_loaded_again():
+    """Uma mensagem desconhecida na sincronização (ex.: resposta manual pelo Gmail) recarrega o contexto."""
+    cache = _cache()
+    cache.reset_account(1, "800")
+    cache.record(1, "t1", "t1", "cliente@example.com", "Preciso de um orçamento")
+    service = _gmail_service({
+        "messages": [
+            {"id": "t1", "snippet": "Preciso de um orçamento",
+             "payload": {"headers": [{"name": "From", "value": "cliente@example.com"}]}},
+            {"id": "m2", "snippet": "Respondi pelo celular: sai por R$ 500",
+             "payload": {"headers": [{"name": "From", "value": "agent@example.com"}]}},
+            {"id": "m3", "snippet": "Pode fechar?",
+             "payload": {"headers": [{"name": "From", "value": "cliente@example.com"}]}},
+        ],
+    })
+
+    cache.apply_history(1, "800", "960", {"t1": {"m2", "m3"}}, pending_ids=["m3"])
+    context = await cache.context_for(service, 1, {"id": "m3", "threadId": "t1"},
+                                      sender="cliente@example.com", body="Pode fechar?", execute=_execute)
+
+    assert "Respondi pelo celular" in context
+    assert cache.refreshes == 1 and cache.seeds == 1 and cache.hits == 0
+
+
+def test_history_gap_or_full_sync_drops_the_account_entries():
+    """Se outro processo sincronizou a conta no meio tempo, as entradas podem estar desatualizadas."""
+    cache = _cache()
+    cache.reset_account(1, "800")
+    cache.record(1, "t1", "t1", "cliente@example.com", "Preciso de um orçamento")
+    cache.record(2, "t9", "t9", "outro@example.com", "Olá")
+
+    cache.apply_history(1, "900", "950", {})
+
+    assert cache.render(1, "t1") == "" and cache.render(2, "t9") != ""
+    cache.record(1, "t1", "t1", "cliente@example.com", "Preciso de um orçamento")
+    cache.apply_history(1, "950", "990", {"t5": {"m7"}})
+    assert cache.render(1, "t1") != ""
+    cache.reset_account(1, "1000")
+    assert cache.render(1, "t1") == ""
+
+
+@pytest.mark.asyncio
+async def test_first_message_of_a_thread_does_not_fetch_anything():
+    cache = _cache()
+    service = _gmail_service({})
+
+    context = await cache.context_for(service, 1, {"id": "t2", "threadId": "t2"},
+                                      sender="cliente@example.com", body="Olá", execute=_execute)
+
+    assert context == ""
+    service.users.return_value.threads.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_replies_with_thread_context_skip_the_reply_cache(mocker):
+    generate = mocker.patch.object(email_service, "_generate_reply_with_ai", return_value="Resposta")
+    get_or_generate = mocker.patch.object(email_service.reply_cache, "get_or_generate")
+
+    reply = await email_service._get_reply("Pode fechar?", "cliente@example.com", "Re: Orçamento",
+                                           thread_context="De cliente@example.com: Preciso de um orçamento")
+
+    assert reply == "Resposta"
+    get_or_generate.assert_not_called()
+    assert generate.call_args.kwargs["thread_context"].startswith("De cliente@example.com")
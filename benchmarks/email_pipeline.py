@@ -0,0 +1,319 @@
+"""
+Benchmark do pipeline de e-mails (process_and_reply_to_emails) e dos endpoints de
+listagem, com o Gmail e o Gemini substituídos por versões locais (benchmarks/fakes.py).
+
+Para cada tamanho de caixa de entrada (padrão: 10, 1.000 e 100.000 mensagens não
+lidas), o benchmark cria um banco novo, processa a caixa inteira e depois mede os
+endpoints de listagem sobre os e-mails gravados. Cada cenário informa a vazão, a
+latência p50/p99 (por mensagem no pipeline, por requisição nos endpoints) e o pico de
+memória alocada (tracemalloc, ligado em todas as execuções para que os números sejam
+comparáveis entre si).
+
+    python -m benchmarks.email_pipeline --sizes 10 1000
+    python -m benchmarks.email_pipeline --gemini-latency 0.2 --gemini-error-rate 0.05
+    python -m benchmarks.email_pipeline --check            # compara com benchmarks/baseline.json
+    python -m benchmarks.email_pipeline --update-baseline  # grava os resultados como referência
+
+Com --check, o processo termina com código 1 se algum cenário ficou mais lento, com p99
+maior (só cenários com ao menos P99_MIN_SAMPLES medições) ou com mais memória que a
+referência além da tolerância (--tolerance). A
+referência depende da máquina: gere-a de novo (--update-baseline) no ambiente onde as
+comparações serão feitas.
+
+Por padrão usa um SQLite temporário (aiosqlite). --database-url aceita um PostgreSQL
+(postgresql+asyncpg://...), mas as tabelas são apagadas e recriadas: use um banco descartável.
+As variáveis obrigatórias de Settings (.env) precisam estar definidas.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import models
+from app.config import settings
+from app.database import get_async_db
+from app.logging_config import configure_logging
+from app.routers import agents
+from app.services import email_service, gemini_client, http_clients
+from app.services.rate_limiter import RateLimiter
+from app.services.reply_cache import reply_cache
+from app.services.thread_context import thread_context_cache
+from benchmarks.fakes import FakeGmailService, gemini_transport
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+# Variações de p99 menores que isso (ms) são ruído, mesmo acima da tolerância relativa
+P99_NOISE_FLOOR_MS = 10.0
+# Com menos amostras o p99 é só o pior caso da execução: não entra na comparação
+P99_MIN_SAMPLES = 100
+SQLITE_BUSY_TIMEOUT = 30.0  # Segundos
+
+
+def _percentile(samples: list[float], percent: float) -> float:
+    """Percentil pelo método nearest-rank (0 se não houver amostras)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _result(scenario: str, size: int, count: int, elapsed: float, latencies: list[float], peak: int) -> dict:
+    return {
+        "scenario": scenario,
+        "size": size,
+        "count": count,
+        "seconds": round(elapsed, 4),
+        "throughput": round(count / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "peak_mib": round(peak / 2 ** 20, 2),
+    }
+
+
+def _key(result: dict) -> str:
+    return f"{result['scenario']}@{result['size']}"
+
+
+# --- Cenários ---
+async def _bench_pipeline(session_factory: async_sessionmaker, size: int, args) -> tuple[dict, int]:
+    """Processa uma caixa com `size` mensagens não lidas. Retorna o resultado e o id do agente."""
+    service = FakeGmailService(size, seed=args.seed, latency=args.gmail_latency)
+    email_service.get_agent_gmail_service = lambda agent: service
+    reply_cache.session_factory = session_factory
+    reply_cache._memory.clear()
+    thread_context_cache.clear()
+
+    async with session_factory() as db:
+        agent = models.Account(email=f"bench-{size}@example.com", password_hash="x", name="Benchmark")
+        db.add(agent)
+        await db.commit()
+
+        started: dict[str, float] = {}
+        latencies: list[float] = []
+
+        def _on_event(event: dict):
+            kind = event["event"]
+            if kind == "fetched":
+                started[event["message_id"]] = time.perf_counter()
+            elif kind in ("sent", "failed") or (kind == "generated" and not event["has_reply"]):
+                started_at = started.pop(event.get("message_id"), None)
+                if started_at is not None:
+                    latencies.append(time.perf_counter() - started_at)
+
+        tracemalloc.start()
+        began = time.perf_counter()
+        await email_service.process_and_reply_to_emails(db, agent, on_event=_on_event)
+        elapsed = time.perf_counter() - began
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if len(latencies) < size:
+        logging.warning("%d de %d mensagens não terminaram o pipeline.", size - len(latencies), size)
+    return _result("pipeline", size, size, elapsed, latencies, peak), agent.id
+
+
+def _api(session_factory: async_sessionmaker) -> FastAPI:
+    """Aplicação só com as rotas dos agentes, sem o lifespan (workers, agendador)."""
+    app = FastAPI()
+    app.include_router(agents.router)
+
+    async def _get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = _get_async_db
+    return app
+
+
+async def _timed_requests(client: httpx.AsyncClient, urls) -> tuple[int, float, list[float]]:
+    latencies = []
+    began = time.perf_counter()
+    for url in urls:
+        started_at = time.perf_counter()
+        response = await client.get(url)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started_at)
+    return len(latencies), time.perf_counter() - began, latencies
+
+
+async def _bench_endpoints(session_factory: async_sessionmaker, size: int, agent_id: int, args) -> list[dict]:
+    """Listagens paginadas sobre os e-mails gravados pelo pipeline."""
+    results = []
+    base = f"/agents/{agent_id}/emails/received"
+    transport = httpx.ASGITransport(app=_api(session_factory))
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        scenarios = {
+            "api.received.first_page": [f"{base}?limit=50"] * args.requests,
+            "api.received.by_sender": [f"{base}?limit=50&sender=Cliente 1 <cliente1@example.com>"] * args.requests,
+        }
+        for scenario, urls in scenarios.items():
+            # Fora da medição: a primeira requisição compila e guarda em cache as consultas
+            (await client.get(urls[0])).raise_for_status()
+            tracemalloc.start()
+            count, elapsed, latencies = await _timed_requests(client, urls)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(_result(scenario, size, count, elapsed, latencies, peak))
+
+        # Percorre todas as páginas: o custo de uma página profunda deve ser o mesmo da primeira
+        tracemalloc.start()
+        latencies = []
+        began = time.perf_counter()
+        cursor = None
+        while True:
+            started_at = time.perf_counter()
+            response = await client.get(base, params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started_at)
+            cursor = response.json()["next_cursor"]
+            if not cursor:
+                break
+        elapsed = time.perf_counter() - began
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append(_result("api.received.walk", size, len(latencies), elapsed, latencies, peak))
+    return results
+
+
+async def run(args) -> list[dict]:
+    # Sem cotas do lado do cliente e com backoff curto: mede o pipeline, não o limitador
+    gemini_client.gemini_rate_limiter = RateLimiter(
+        requests_per_minute=1e9, tokens_per_minute=1e12,
+        max_concurrency=args.gemini_concurrency, min_concurrency=args.gemini_concurrency,
+    )
+    settings.GEMINI_BACKOFF_BASE = args.gemini_backoff
+    settings.REPLY_CACHE_ENABLED = not args.no_reply_cache
+    await http_clients.init_gemini_client(
+        transport=gemini_transport(args.gemini_latency, args.gemini_error_rate, seed=args.seed)
+    )
+
+    results = []
+    try:
+        for size in args.sizes:
+            directory = tempfile.mkdtemp(prefix="email-pipeline-bench-")
+            if args.database_url:
+                engine = create_async_engine(args.database_url)
+            else:
+                # Espera o lock de escrita em vez de falhar: o pipeline grava de várias tarefas ao mesmo tempo
+                engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}",
+                                             connect_args={"timeout": SQLITE_BUSY_TIMEOUT})
+            async with engine.begin() as conn:
+                await conn.run_sync(models.Base.metadata.drop_all)
+                await conn.run_sync(models.Base.metadata.create_all)
+            session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+            try:
+                pipeline, agent_id = await _bench_pipeline(session_factory, size, args)
+                results.append(pipeline)
+                _print_result(pipeline)
+                for result in await _bench_endpoints(session_factory, size, agent_id, args):
+                    results.append(result)
+                    _print_result(result)
+            finally:
+                await engine.dispose()
+                shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        await http_clients.close_gemini_client()
+    return results
+
+
+# --- Relatório e referência ---
+def _print_header():
+    print(f"{'cenário':<26}{'tamanho':>9}{'itens':>9}{'itens/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'pico MiB':>10}")
+
+def _print_result(result: dict):
+    print(f"{result['scenario']:<26}{result['size']:>9}{result['count']:>9}{result['throughput']:>11.1f}"
+          f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['peak_mib']:>10.1f}")
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Regressões de cada cenário em relação à referência (lista vazia se não houver)."""
+    regressions = []
+    for result in results:
+        reference = baseline.get(_key(result))
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"{_key(result)}: vazão {result['throughput']:.1f}/s "
+                               f"(referência {reference['throughput']:.1f}/s)")
+        if (result["count"] >= P99_MIN_SAMPLES
+                and result["p99_ms"] > reference["p99_ms"] * (1 + tolerance)
+                and result["p99_ms"] - reference["p99_ms"] > P99_NOISE_FLOOR_MS):
+            regressions.append(f"{_key(result)}: p99 {result['p99_ms']:.2f} ms "
+                               f"(referência {reference['p99_ms']:.2f} ms)")
+        if result["peak_mib"] > reference["peak_mib"] * (1 + tolerance):
+            regressions.append(f"{_key(result)}: pico de memória {result['peak_mib']:.1f} MiB "
+                               f"(referência {reference['peak_mib']:.1f} MiB)")
+    return regressions
+
+
+def _load_baseline(path: Path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+def _save_baseline(path: Path, results: list[dict], args):
+    document = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": "sqlite" if not args.database_url else args.database_url.split(":", 1)[0],
+            "gemini_latency": args.gemini_latency,
+            "gemini_error_rate": args.gemini_error_rate,
+            "gmail_latency": args.gmail_latency,
+        },
+        "results": {_key(result): result for result in results},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de e-mails e dos endpoints, sem rede.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--requests", type=int, default=200, help="Requisições por cenário de endpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gmail-latency", type=float, default=0.0, help="Segundos por chamada ao Gmail falso")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="Segundos por chamada ao Gemini falso")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fração das chamadas que devolvem 503")
+    parser.add_argument("--gemini-concurrency", type=int, default=settings.GEMINI_MAX_CONCURRENCY)
+    parser.add_argument("--gemini-backoff", type=float, default=0.01, help="GEMINI_BACKOFF_BASE durante o benchmark")
+    parser.add_argument("--no-reply-cache", action="store_true")
+    parser.add_argument("--database-url", help="URL assíncrona de um banco descartável (padrão: SQLite temporário)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--check", action="store_true", help="Compara com a referência e falha se houver regressão")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Piora relativa tolerada (0.3 = 30%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    configure_logging(level="WARNING", log_format="text")
+    _print_header()
+    results = asyncio.run(run(args))
+
+    if args.update_baseline:
+        _save_baseline(args.baseline, results, args)
+        print(f"Referência gravada em {args.baseline}.")
+    if args.check:
+        regressions = compare(results, _load_baseline(args.baseline), args.tolerance)
+        if regressions:
+            print("\nRegressões em relação à referência:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nSem regressões em relação à referência (tolerância de {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,261 @@
+"""
+Substitutos locais do Gmail e do Gemini para os benchmarks (nenhuma chamada de rede).
+
+- FakeGmailService imita o recurso do googleapiclient usado pelo pipeline
+  (users().messages()/history()/threads(), getProfile e new_batch_http_request) sobre
+  uma caixa de entrada sintética. As mensagens são geradas sob demanda a partir do
+  índice, com árvores MIME realistas (texto puro, alternative, anexos, HTML em
+  iso-8859-1, imagens inline), então uma caixa de 100 mil mensagens não ocupa memória
+  até ser lida. Parte das mensagens responde a uma thread anterior e parte é um boletim
+  idêntico enviado a todos.
+- gemini_transport devolve um httpx.MockTransport com latência e taxa de erros (503)
+  configuráveis, para o cliente compartilhado de app/services/http_clients.py.
+"""
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+
+import httpx
+
+NEWSLETTER_EVERY = 10  # Uma a cada N mensagens é o mesmo boletim (exercita o cache de respostas)
+THREAD_REPLY_RATE = 0.2  # Fração das mensagens que respondem a uma thread anterior
+BASE_HISTORY_ID = 1_000_000
+BASE_INTERNAL_DATE_MS = 1_700_000_000_000
+
+_WORDS = (
+    "orçamento prazo reunião contrato proposta fatura pagamento entrega pedido cliente "
+    "projeto relatório amanhã sexta semana equipe dúvida valor desconto atraso suporte"
+).split()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _part(mime_type: str, data: bytes | None = None, charset: str = "utf-8",
+          filename: str = "", parts: list[dict] | None = None, size: int | None = None) -> dict:
+    content_type = mime_type if mime_type.startswith("multipart/") or data is None else f"{mime_type}; charset={charset}"
+    part = {"mimeType": mime_type, "filename": filename, "headers": [{"name": "Content-Type", "value": content_type}]}
+    if parts is not None:
+        part["body"] = {"size": 0}
+        part["parts"] = parts
+    elif data is not None:
+        part["body"] = {"data": _b64(data), "size": len(data)}
+    else:
+        # Anexos grandes vêm só com attachmentId; o conteúdo nunca é baixado pelo pipeline
+        part["headers"].append({"name": "Content-Disposition", "value": f'attachment; filename="{filename}"'})
+        part["body"] = {"attachmentId": f"att-{filename}", "size": size or 0}
+    return part
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _payload(index: int, rng: random.Random) -> tuple[dict, str, str]:
+    """Árvore MIME, remetente e assunto da mensagem `index`."""
+    if index % NEWSLETTER_EVERY == 0:
+        body = "Confira as novidades da semana e as ofertas exclusivas para clientes. " * 20
+        markup = f"<html><body><h1>Boletim</h1><p>{body}</p><a href='#'>Descadastrar</a></body></html>"
+        payload = _part("multipart/alternative", parts=[
+            _part("text/plain", body.encode()), _part("text/html", markup.encode()),
+        ])
+        return payload, "Boletim <boletim@news.example.com>", "Novidades da semana"
+
+    paragraphs = [_text(rng, rng.randint(20, 80)) for _ in range(rng.randint(1, 6))]
+    plain = "\n\n".join(paragraphs)
+    markup = "<html><body>" + "".join(f"<p>{p}</p>" for p in paragraphs) + "</body></html>"
+    sender = f"Cliente {index % 997} <cliente{index % 997}@example.com>"
+    subject = f"{rng.choice(_WORDS).capitalize()} {rng.choice(_WORDS)} #{index}"
+    kind = index % 5
+    if kind == 0:
+        payload = _part("text/plain", plain.encode())
+    elif kind == 1:
+        payload = _part("multipart/alternative", parts=[
+            _part("text/plain", plain.encode()), _part("text/html", markup.encode()),
+        ])
+    elif kind == 2:
+        payload = _part("multipart/mixed", parts=[
+            _part("multipart/alternative", parts=[
+                _part("text/plain", plain.encode()), _part("text/html", markup.encode()),
+            ]),
+            _part("application/pdf", filename=f"proposta-{index}.pdf", size=rng.randint(50_000, 5_000_000)),
+        ])
+    elif kind == 3:
+        payload = _part("text/html", markup.encode("iso-8859-1", errors="replace"), charset="iso-8859-1")
+    else:
+        payload = _part("multipart/related", parts=[
+            _part("multipart/alternative", parts=[
+                _part("text/plain", plain.encode()), _part("text/html", markup.encode()),
+            ]),
+            _part("image/png", filename=f"logo-{index}.png", size=rng.randint(2_000, 40_000)),
+        ])
+    return payload, sender, subject
+
+
+class FakeRequest:
+    """Requisição com a interface usada pelo pipeline (execute, http e methodId)."""
+
+    def __init__(self, service: "FakeGmailService", method_id: str, handler):
+        self.service = service
+        self.methodId = f"gmail.users.{method_id}"
+        self.http = None
+        self._handler = handler
+
+    def execute(self, http=None):
+        self.service.simulate_latency()
+        return self._handler()
+
+
+class FakeBatch:
+    """new_batch_http_request: uma única "requisição HTTP" para várias mensagens."""
+
+    def __init__(self, service: "FakeGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self._requests: list[tuple[str, FakeRequest]] = []
+
+    def add(self, request: FakeRequest, request_id: str):
+        self._requests.append((request_id, request))
+
+    def execute(self, http=None):
+        self.service.simulate_latency()
+        for request_id, request in self._requests:
+            self.callback(request_id, request._handler(), None)
+
+
+class _Resource:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailService:
+    """Caixa de entrada sintética com `size` mensagens não lidas."""
+
+    def __init__(self, size: int, seed: int = 0, latency: float = 0.0):
+        self.size = size
+        self.seed = seed
+        self.latency = latency
+        self.history_id = BASE_HISTORY_ID + size
+        self.sent = 0
+        self._unread = set(range(size))
+        self._thread_messages: dict[int, list[int]] = {}
+        self._lock = threading.Lock()
+        for index in range(size):
+            self._thread_messages.setdefault(self._thread_of(index), []).append(index)
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    # --- Caixa sintética ---
+    def _thread_of(self, index: int) -> int:
+        rng = random.Random(self.seed * 1_000_003 + index)
+        if index and index % NEWSLETTER_EVERY and rng.random() < THREAD_REPLY_RATE:
+            return self._thread_of(rng.randrange(max(0, index - 50), index))
+        return index
+
+    def message(self, message_id: str, fields: str | None = None) -> dict:
+        index = int(message_id.removeprefix("m"))
+        rng = random.Random(self.seed * 1_000_003 + index)
+        payload, sender, subject = _payload(index, rng)
+        payload["headers"] = payload["headers"] + [
+            {"name": "From", "value": sender},
+            {"name": "Subject", "value": subject},
+        ]
+        with self._lock:
+            labels = ["INBOX", "UNREAD"] if index in self._unread else ["INBOX"]
+        return {
+            "id": message_id,
+            "threadId": f"m{self._thread_of(index)}",
+            "historyId": str(BASE_HISTORY_ID + index),
+            "internalDate": str(BASE_INTERNAL_DATE_MS + index * 1000),
+            "labelIds": labels,
+            "snippet": subject,
+            "payload": payload,
+        }
+
+    # --- Recursos da API ---
+    def users(self):
+        return _Resource(
+            messages=lambda: _Resource(
+                list=self._list, get=self._get, batchModify=self._batch_modify, send=self._send,
+            ),
+            history=lambda: _Resource(list=self._history_list),
+            threads=lambda: _Resource(get=self._thread_get),
+            getProfile=lambda userId, fields=None: FakeRequest(
+                self, "getProfile", lambda: {"historyId": str(self.history_id)}
+            ),
+        )
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def _list(self, userId, q=None, maxResults=100, pageToken=None, fields=None):
+        def _handler():
+            with self._lock:
+                unread = sorted(self._unread)
+            start = int(pageToken or 0)
+            page = unread[start:start + maxResults]
+            result = {"messages": [{"id": f"m{index}"} for index in page]}
+            if start + maxResults < len(unread):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+        return FakeRequest(self, "messages.list", _handler)
+
+    def _get(self, userId, id, format="full", fields=None):
+        return FakeRequest(self, "messages.get", lambda: self.message(id, fields))
+
+    def _batch_modify(self, userId, body):
+        def _handler():
+            if "UNREAD" in body.get("removeLabelIds", []):
+                with self._lock:
+                    self._unread.difference_update(int(message_id.removeprefix("m")) for message_id in body["ids"])
+            return {}
+        return FakeRequest(self, "messages.batchModify", _handler)
+
+    def _send(self, userId, body):
+        def _handler():
+            with self._lock:
+                self.sent += 1
+                self.history_id += 1
+                return {"id": f"sent{self.sent}", "threadId": body.get("threadId")}
+        return FakeRequest(self, "messages.send", _handler)
+
+    def _history_list(self, userId, startHistoryId, historyTypes=None, pageToken=None, fields=None):
+        return FakeRequest(self, "history.list", lambda: {"history": [], "historyId": str(self.history_id)})
+
+    def _thread_get(self, userId, id, format="metadata", metadataHeaders=None, fields=None):
+        def _handler():
+            indexes = self._thread_messages.get(int(id.removeprefix("m")), [])
+            messages = []
+            for index in indexes:
+                message = self.message(f"m{index}")
+                messages.append({
+                    "id": message["id"], "snippet": message["snippet"],
+                    "payload": {"headers": [h for h in message["payload"]["headers"] if h["name"] == "From"]},
+                })
+            return {"messages": messages}
+        return FakeRequest(self, "threads.get", _handler)
+
+
+def gemini_transport(latency: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> httpx.MockTransport:
+    """Gemini local: responde após `latency` segundos e devolve 503 em `error_rate` das chamadas."""
+    rng = random.Random(seed)
+
+    async def _handler(request: httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        if error_rate and rng.random() < error_rate:
+            return httpx.Response(503, json={"error": {"message": "indisponível (simulado)"}})
+        prompt = json.loads(request.content)["contents"][0]["parts"][0]["text"]
+        reply = "Olá! Recebemos sua mensagem e retornaremos em breve. Atenciosamente, Equipe."
+        return httpx.Response(200, json={
+            "candidates": [{"content": {"parts": [{"text": reply}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"totalTokenCount": len(prompt) // 4 + len(reply) // 4},
+        })
+
+    return httpx.MockTransport(_handler)
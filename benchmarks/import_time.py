@@ -0,0 +1,99 @@
+"""
+Relatório do tempo de importação da aplicação (cold start), com orçamento.
+
+Importa o módulo (padrão: app.main) em interpretadores novos com `python -X importtime`,
+repetindo algumas vezes e ficando com o menor tempo de cada módulo (descarta o ruído de
+disco e CPU). Mostra o total, os pacotes mais caros (tempo próprio somado) e os módulos
+da aplicação (tempo acumulado, incluindo o que cada um importa).
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --top 25
+    python -m benchmarks.import_time --budget-ms 1200   # termina com código 1 acima do orçamento
+
+O tempo depende da máquina: calibre o orçamento (IMPORT_BUDGET_MS) no ambiente onde a
+verificação roda. As variáveis obrigatórias de Settings (.env) precisam estar definidas.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+IMPORT_BUDGET_MS = 1500.0  # Orçamento padrão para importar app.main (cerca de 1,1 s medido)
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def profile_once(module: str) -> dict[str, tuple[int, int]]:
+    """{módulo: (tempo próprio, tempo acumulado)} em microssegundos, de um interpretador novo."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, env=os.environ.copy(), capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}:\n{result.stderr[-2000:]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return timings
+
+
+def profile(module: str, runs: int) -> dict[str, tuple[int, int]]:
+    """Menor tempo próprio e acumulado de cada módulo entre `runs` execuções."""
+    best: dict[str, tuple[int, int]] = {}
+    for _ in range(runs):
+        for name, (own, cumulative) in profile_once(module).items():
+            previous = best.get(name)
+            best[name] = (own, cumulative) if previous is None else (min(previous[0], own), min(previous[1], cumulative))
+    return best
+
+
+def by_package(timings: dict[str, tuple[int, int]]) -> dict[str, int]:
+    """Tempo próprio somado por pacote de primeiro nível."""
+    totals: dict[str, int] = defaultdict(int)
+    for name, (own, _) in timings.items():
+        totals[name.split(".", 1)[0]] += own
+    return dict(totals)
+
+
+def _print_table(title: str, rows: list[tuple[str, int]]):
+    print(f"\n{title}")
+    for name, microseconds in rows:
+        print(f"  {microseconds / 1000:>9.1f} ms  {name}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Tempo de importação da aplicação, com orçamento.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Linhas em cada tabela")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    timings = profile(args.module, args.runs)
+    total = timings[args.module][1]
+
+    packages = sorted(by_package(timings).items(), key=lambda item: item[1], reverse=True)
+    _print_table("Pacotes (tempo próprio somado):", packages[:args.top])
+    project = args.module.split(".", 1)[0]
+    modules = sorted(
+        ((name, cumulative) for name, (_, cumulative) in timings.items() if name.split(".", 1)[0] == project),
+        key=lambda item: item[1], reverse=True,
+    )
+    _print_table(f"Módulos de {project} (tempo acumulado):", modules[:args.top])
+
+    print(f"\nimport {args.module}: {total / 1000:.1f} ms (melhor de {args.runs}), "
+          f"{len(timings)} módulos; orçamento {args.budget_ms:.0f} ms.")
+    if total / 1000 > args.budget_ms:
+        print("Acima do orçamento.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,59 @@
+"""
+Benchmark da vazão de logins (verificações Argon2) por núcleo.
+
+Compara a verificação feita direto no event loop (como os endpoints faziam antes) com o
+pool de processos de app/password_hashing.py, usando os custos do Argon2 definidos em
+Settings. Não acessa o banco: mede apenas o custo do hashing.
+
+    python -m benchmarks.login_throughput --logins 200 --workers 1 2 4
+
+As variáveis obrigatórias de Settings (.env) precisam estar definidas.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.config import settings
+from app.password_hashing import PasswordHashingPool, hash_password, verify_and_rehash
+
+
+async def _inline(hashed: str, logins: int) -> float:
+    """Verificações no próprio event loop: cada login bloqueia todos os outros."""
+    started_at = time.perf_counter()
+    for _ in range(logins):
+        verify_and_rehash(hashed, "senha-de-teste")
+        await asyncio.sleep(0)
+    return time.perf_counter() - started_at
+
+async def _pooled(hashed: str, logins: int, workers: int) -> float:
+    pool = PasswordHashingPool(workers=workers, max_pending=logins)
+    try:
+        await pool.verify_and_rehash(hashed, "senha-de-teste")  # Aquece os processos
+        started_at = time.perf_counter()
+        await asyncio.gather(*(pool.verify_and_rehash(hashed, "senha-de-teste") for _ in range(logins)))
+        return time.perf_counter() - started_at
+    finally:
+        pool.shutdown()
+
+async def main(logins: int, workers_options: list[int]):
+    hashed = hash_password("senha-de-teste")
+    print(
+        f"Argon2: time_cost={settings.ARGON2_TIME_COST} memory_cost={settings.ARGON2_MEMORY_COST} KiB "
+        f"parallelism={settings.ARGON2_PARALLELISM} | {logins} logins | {os.cpu_count()} núcleos"
+    )
+    print(f"{'modo':<18}{'logins/s':>12}{'logins/s/núcleo':>18}")
+
+    elapsed = await _inline(hashed, logins)
+    print(f"{'event loop':<18}{logins / elapsed:>12.1f}{logins / elapsed:>18.1f}")
+    for workers in workers_options:
+        elapsed = await _pooled(hashed, logins, workers)
+        print(f"{f'pool ({workers} proc.)':<18}{logins / elapsed:>12.1f}{logins / elapsed / workers:>18.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão de logins (Argon2) por núcleo.")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.workers))
@@ -6,23 +6,66 @@ CREATE TABLE accounts (
     password_hash VARCHAR(255) NOT NULL, -- Senha encriptada pelo Backend
     forward_url VARCHAR(2048), -- URL de webhook específica do agente
     encrypted_credentials BYTEA, -- Credenciais criptografadas do Google
+    gmail_history_id VARCHAR(32), -- Último historyId sincronizado (sincronização incremental)
+    retention_days INTEGER, -- Dias até o arquivamento dos e-mails recebidos (NULL: padrão do servidor; 0: nunca)
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP -- Carimbo Data/Hora de Criação
 );
--- Tabela de Mensagens Recebidas
+-- Corpos de e-mail, um por conteúdo: chave SHA-256 do texto, dados comprimidos (zlib)
+-- pela aplicação (app/body_store.py)
+CREATE TABLE email_bodies (
+    content_hash VARCHAR(64) PRIMARY KEY,
+    data BYTEA NOT NULL, -- Texto UTF-8 comprimido
+    size INTEGER NOT NULL, -- Tamanho do texto sem compressão, em bytes
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tabela de Mensagens Recebidas, particionada por mês de recebimento. As restrições
+-- únicas incluem a chave de partição (received_at vem do internalDate do Gmail, então
+-- cada mensagem cai sempre na mesma partição)
 CREATE TABLE received_emails (
-    id SERIAL PRIMARY KEY,
-    gmail_message_id VARCHAR(255) UNIQUE, -- ID único do provedor
+    id SERIAL,
+    gmail_message_id VARCHAR(255), -- ID único do provedor
     account_id INTEGER NOT NULL,
     sender VARCHAR(255) NOT NULL, -- Endereço de e-mail do remetente
     subject TEXT, -- Assunto do e-mail
-    body TEXT, -- Conteúdo do e-mail
-    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- Carimbo Data/Hora de Recebimento
+    body_hash VARCHAR(64), -- Conteúdo do e-mail (email_bodies)
+    received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Carimbo Data/Hora de Recebimento
     is_read BOOLEAN DEFAULT FALSE, -- Indica se o e-mail foi lido ou não
-    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-);
+    search_vector tsvector, -- Busca textual, gravada pela aplicação (ver abaixo)
+    PRIMARY KEY (id, received_at),
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE,
+    FOREIGN KEY (body_hash) REFERENCES email_bodies(content_hash)
+) PARTITION BY RANGE (received_at);
+
+CREATE UNIQUE INDEX uq_received_emails_gmail_message ON received_emails(gmail_message_id, received_at);
+CREATE INDEX ix_received_emails_gmail_message_id ON received_emails(gmail_message_id);
+CREATE INDEX ix_received_emails_body_hash ON received_emails(body_hash);
+
+-- Partição padrão (meses sem partição própria) e as do mês atual e dos três seguintes.
+-- As próximas são criadas pelo arquivador (app/services/archiver.py)
+CREATE TABLE received_emails_default PARTITION OF received_emails DEFAULT;
+DO $$
+DECLARE
+    partition_start timestamptz;
+BEGIN
+    FOR partition_start IN
+        SELECT generate_series(
+            date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+            date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + interval '3 months',
+            interval '1 month'
+        )
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF received_emails FOR VALUES FROM (%L) TO (%L)',
+            'received_emails_p' || to_char(partition_start AT TIME ZONE 'UTC', 'YYYY_MM'),
+            partition_start, partition_start + interval '1 month'
+        );
+    END LOOP;
+END
+$$;
 
 -- Conversão de Status de Email de STRING para ENUM
-CREATE TYPE email_status AS ENUM ('draft', 'queued', 'sent', 'failed');
+CREATE TYPE email_status AS ENUM ('draft', 'queued', 'sending', 'sent', 'failed');
 
 -- Tabela de Mensagens Enviadas
 CREATE TABLE outgoing_emails (
@@ -30,16 +73,126 @@ CREATE TABLE outgoing_emails (
     account_id INTEGER NOT NULL,
     recipient VARCHAR(255) NOT NULL, -- Endereço de e-mail do destinatário
     subject TEXT, -- Assunto do e-mail
-    body TEXT, -- Conteúdo do e-mail
+    body_hash VARCHAR(64), -- Conteúdo do e-mail (email_bodies)
     status email_status NOT NULL DEFAULT 'draft',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     sent_at TIMESTAMP WITH TIME ZONE,
     error_message TEXT, -- Mensagem de erro, se houver
+    attempts INTEGER NOT NULL DEFAULT 0, -- Tentativas de envio já feitas
+    next_attempt_at TIMESTAMP WITH TIME ZONE, -- Após um erro temporário, só reenvia a partir daqui
+    lease_expires_at TIMESTAMP WITH TIME ZONE, -- Fim da reserva de um e-mail 'sending' por um worker
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE,
+    FOREIGN KEY (body_hash) REFERENCES email_bodies(content_hash)
+);
+
+CREATE INDEX ix_outgoing_emails_body_hash ON outgoing_emails(body_hash);
+
+-- Listagem paginada por cursor (received_at, id) dos e-mails recebidos de um agente,
+-- com e sem filtro de remetente
+CREATE INDEX idx_received_emails_account_received ON received_emails(account_id, received_at, id);
+CREATE INDEX idx_received_emails_account_sender ON received_emails(account_id, sender, received_at, id);
+
+-- Busca textual: search_vector é gravado pela aplicação na inserção, a partir do assunto
+-- (peso A) e do corpo (peso B), já que o corpo fica comprimido em email_bodies:
+-- setweight(to_tsvector('portuguese', coalesce(subject, '')), 'A') ||
+-- setweight(to_tsvector('portuguese', coalesce(<corpo>, '')), 'B')
+
+-- GIN composto (extensão btree_gin): a busca de um agente é resolvida só pelo índice
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX idx_received_emails_search ON received_emails USING GIN (account_id, search_vector);
+
+-- Listagem paginada por cursor (created_at, id) dos e-mails enviados de um agente,
+-- com e sem filtro de status
+CREATE INDEX idx_outgoing_emails_account_created ON outgoing_emails(account_id, created_at, id);
+CREATE INDEX idx_outgoing_emails_account_status ON outgoing_emails(account_id, status, created_at, id);
+
+-- Índice parcial usado pelos workers da fila de envio (FOR UPDATE SKIP LOCKED)
+CREATE INDEX idx_outgoing_emails_queued ON outgoing_emails(created_at, id) WHERE status = 'queued';
+CREATE INDEX idx_outgoing_emails_sending ON outgoing_emails(lease_expires_at) WHERE status = 'sending';
+
+-- Resumos de e-mails recebidos, encaminhados para o webhook do agente
+CREATE TYPE forward_status AS ENUM ('pending', 'success', 'failed');
+
+CREATE TABLE email_summaries (
+    id SERIAL PRIMARY KEY,
+    received_email_id INTEGER NOT NULL,
+    account_id INTEGER NOT NULL, -- Cópia de received_emails.account_id para a listagem por agente
+    summary_text TEXT NOT NULL,
+    forward_url VARCHAR(2048) NOT NULL, -- Webhook para onde o resumo foi encaminhado
+    forward_status forward_status NOT NULL DEFAULT 'pending',
+    status_message TEXT, -- Mensagem de erro do encaminhamento, se houver
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    -- received_email_id sem FK: a chave de received_emails (particionada) é (id, received_at).
+    -- O arquivador apaga os resumos junto com os e-mails
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+);
+
+-- Um resumo por e-mail, mesmo com vários processos resumindo ao mesmo tempo
+CREATE UNIQUE INDEX uq_email_summaries_received_email ON email_summaries(received_email_id);
+-- Listagem paginada por cursor (created_at, id), com e sem filtro de status
+CREATE INDEX idx_email_summaries_account_created ON email_summaries(account_id, created_at, id);
+CREATE INDEX idx_email_summaries_account_status ON email_summaries(account_id, forward_status, created_at, id);
+
+-- Mensagens do Gmail que falharam no pipeline: tentadas de novo nas próximas execuções,
+-- com o watermark da conta já adiante, até GMAIL_MESSAGE_MAX_ATTEMPTS
+CREATE TABLE gmail_message_attempts (
+    account_id INTEGER NOT NULL,
+    gmail_message_id VARCHAR(255) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1, -- Execuções em que a mensagem falhou
+    last_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account_id, gmail_message_id),
     FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
 );
 
--- Cria um índice na coluna account_id da tabela received_emails
-CREATE INDEX idx_received_emails_account_id ON received_emails(account_id);
+-- Cache de respostas geradas pela IA, endereçado pelo hash do conteúdo normalizado
+CREATE TABLE ai_reply_cache (
+    cache_key VARCHAR(64) PRIMARY KEY, -- SHA-256 de (remetente, assunto, corpo, modelo, versão do prompt)
+    model_name VARCHAR(100) NOT NULL,
+    prompt_version VARCHAR(20) NOT NULL,
+    reply_text TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX ix_ai_reply_cache_expires_at ON ai_reply_cache(expires_at);
+
+-- Jobs de processamento da caixa de entrada (POST /agents/{id}/process-emails)
+CREATE TYPE processing_job_status AS ENUM ('queued', 'running', 'completed', 'failed', 'cancelled');
+
+CREATE TABLE processing_jobs (
+    id SERIAL PRIMARY KEY,
+    account_id INTEGER NOT NULL,
+    status processing_job_status NOT NULL DEFAULT 'queued',
+    total_messages INTEGER NOT NULL DEFAULT 0,
+    processed_messages INTEGER NOT NULL DEFAULT 0,
+    replied_messages INTEGER NOT NULL DEFAULT 0,
+    failed_messages INTEGER NOT NULL DEFAULT 0,
+    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+    error_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE, -- Atualizado enquanto o job roda; jobs parados são retomados
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+);
+
+CREATE INDEX ix_processing_jobs_account_id ON processing_jobs(account_id);
+-- No máximo um job ativo por conta, mesmo com pedidos simultâneos
+CREATE UNIQUE INDEX uq_processing_jobs_active_account ON processing_jobs(account_id)
+    WHERE status IN ('queued', 'running');
+
+-- Resultado de cada mensagem tratada por um job
+CREATE TYPE processing_message_outcome AS ENUM ('replied', 'no_reply', 'failed');
+
+CREATE TABLE processing_job_messages (
+    id SERIAL PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    gmail_message_id VARCHAR(255) NOT NULL,
+    outcome processing_message_outcome NOT NULL,
+    error_message TEXT,
+    started_at TIMESTAMP WITH TIME ZONE, -- Quando a mensagem foi buscada
+    finished_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    FOREIGN KEY (job_id) REFERENCES processing_jobs(id) ON DELETE CASCADE
+);
 
--- Cria um índice na coluna account_id da tabela outgoing_emails
-CREATE INDEX idx_outgoing_emails_account_id ON outgoing_emails(account_id);
+CREATE INDEX ix_processing_job_messages_job_id ON processing_job_messages(job_id);
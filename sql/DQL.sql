@@ -1,2 +1,8 @@
 -- 3) Worker para consultar email's pelo Backend
 SELECT * FROM outgoing_emails WHERE status = 'queued' ORDER BY created_at LIMIT 10 FOR UPDATE SKIP LOCKED;
+
+-- 4) Listagem paginada por cursor (keyset): a próxima página continua a partir do
+-- (received_at, id) do último item, usando o índice (account_id, received_at, id)
+SELECT * FROM received_emails
+WHERE account_id = 1 AND (received_at, id) < ('<received_at_do_ultimo>', <id_do_ultimo>)
+ORDER BY received_at DESC, id DESC LIMIT 50;
@@ -0,0 +1,5 @@
+-- Migração 001: watermark da sincronização incremental (historyId do Gmail).
+-- Bancos criados antes desta coluna: create_all não altera tabelas que já existem.
+-- Idempotente; aplique com: psql -v ON_ERROR_STOP=1 -f sql/migrations/001_accounts_gmail_history_id.sql
+
+ALTER TABLE accounts ADD COLUMN IF NOT EXISTS gmail_history_id VARCHAR(32);
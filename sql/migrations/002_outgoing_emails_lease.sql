@@ -0,0 +1,22 @@
+-- Migração 002: reserva (lease) e novas tentativas na fila de envio (outgoing_emails).
+-- O worker marca o e-mail como 'sending' e envia fora da transação; erros temporários
+-- voltam para a fila com next_attempt_at. Idempotente; rode com o psql em autocommit
+-- (padrão), pois ALTER TYPE ... ADD VALUE não pode ser usado na mesma transação.
+
+-- Bancos criados pelo create_all antes do nome explícito do tipo usam 'emailstatusenum'
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'emailstatusenum')
+       AND NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'email_status') THEN
+        ALTER TYPE emailstatusenum RENAME TO email_status;
+    END IF;
+END $$;
+
+ALTER TYPE email_status ADD VALUE IF NOT EXISTS 'sending' AFTER 'queued';
+
+ALTER TABLE outgoing_emails ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE outgoing_emails ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE outgoing_emails ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_outgoing_emails_queued ON outgoing_emails(created_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_outgoing_emails_sending ON outgoing_emails(lease_expires_at) WHERE status = 'sending';
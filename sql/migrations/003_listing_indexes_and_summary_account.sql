@@ -0,0 +1,42 @@
+-- Migração 003: listagens paginadas por cursor (e-mails recebidos, enviados e resumos).
+-- Bancos criados antes da paginação: create_all não altera tabelas nem tipos que já existem.
+-- Idempotente; aplique com: psql -v ON_ERROR_STOP=1 -f sql/migrations/003_listing_indexes_and_summary_account.sql
+
+-- Bancos criados pelo create_all antes do nome explícito do tipo usam 'forwardstatusenum'
+-- (o tipo dos e-mails enviados é renomeado na migração 002)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'forwardstatusenum')
+       AND NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'forward_status') THEN
+        ALTER TYPE forwardstatusenum RENAME TO forward_status;
+    END IF;
+END $$;
+
+-- email_summaries.account_id: cópia de received_emails.account_id, preenchida para os resumos existentes
+ALTER TABLE email_summaries ADD COLUMN IF NOT EXISTS account_id INTEGER;
+
+UPDATE email_summaries AS s
+SET account_id = r.account_id
+FROM received_emails AS r
+WHERE r.id = s.received_email_id AND s.account_id IS NULL;
+
+ALTER TABLE email_summaries ALTER COLUMN account_id SET NOT NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'email_summaries_account_id_fkey') THEN
+        ALTER TABLE email_summaries ADD CONSTRAINT email_summaries_account_id_fkey
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE;
+    END IF;
+END $$;
+
+-- Índices compostos da paginação; substituem os índices simples em account_id
+CREATE INDEX IF NOT EXISTS idx_received_emails_account_received ON received_emails(account_id, received_at, id);
+CREATE INDEX IF NOT EXISTS idx_received_emails_account_sender ON received_emails(account_id, sender, received_at, id);
+CREATE INDEX IF NOT EXISTS idx_outgoing_emails_account_created ON outgoing_emails(account_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_outgoing_emails_account_status ON outgoing_emails(account_id, status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_email_summaries_account_created ON email_summaries(account_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_email_summaries_account_status ON email_summaries(account_id, forward_status, created_at, id);
+
+DROP INDEX IF EXISTS idx_received_emails_account_id;
+DROP INDEX IF EXISTS idx_outgoing_emails_account_id;
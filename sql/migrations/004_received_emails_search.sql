@@ -0,0 +1,13 @@
+-- Migração 004: busca textual em received_emails (tsvector gerado e índice GIN).
+-- Em bancos novos a coluna é criada pelo create_all (evento after_create em app/models.py),
+-- que não altera tabelas que já existem. Idempotente; aplique com:
+-- psql -v ON_ERROR_STOP=1 -f sql/migrations/004_received_emails_search.sql
+-- Em tabelas grandes, o ADD COLUMN reescreve a tabela: rode fora do horário de pico.
+
+ALTER TABLE received_emails ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('portuguese', coalesce(subject, '')), 'A') ||
+    setweight(to_tsvector('portuguese', coalesce(body, '')), 'B')
+) STORED;
+
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX IF NOT EXISTS idx_received_emails_search ON received_emails USING GIN (account_id, search_vector);
@@ -0,0 +1,10 @@
+-- Migração 005: um resumo por e-mail recebido (email_summaries.received_email_id único).
+-- Remove resumos duplicados (mantém o mais antigo) e troca o índice simples pelo único.
+-- Idempotente; aplique com: psql -v ON_ERROR_STOP=1 -f sql/migrations/005_email_summaries_unique.sql
+
+DELETE FROM email_summaries AS s
+USING email_summaries AS older
+WHERE older.received_email_id = s.received_email_id AND older.id < s.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_email_summaries_received_email ON email_summaries(received_email_id);
+DROP INDEX IF EXISTS ix_email_summaries_received_email_id;
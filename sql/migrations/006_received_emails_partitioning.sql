@@ -0,0 +1,73 @@
+-- Migração 006: particionamento mensal de received_emails por received_at e retenção por conta.
+-- Converte received_emails em tabela particionada (PARTITION BY RANGE (received_at)),
+-- copiando as linhas existentes: em tabelas grandes a cópia é demorada e bloqueia a
+-- ingestão, então rode em uma janela de manutenção. Idempotente; aplique com
+-- python -m app.migrate ou psql -v ON_ERROR_STOP=1 -f sql/migrations/006_received_emails_partitioning.sql
+-- As partições dos meses seguintes são criadas pelo arquivador (app/services/archiver.py).
+--
+-- O Postgres exige a chave de partição nas restrições únicas: a chave primária passa a
+-- ser (id, received_at) e a unicidade do gmail_message_id vira (gmail_message_id,
+-- received_at). received_at vem do internalDate do Gmail, então uma mensagem sempre cai
+-- na mesma partição. Pelo mesmo motivo, email_summaries.received_email_id deixa de ter
+-- FK (o arquivador apaga os resumos junto com os e-mails).
+
+ALTER TABLE accounts ADD COLUMN IF NOT EXISTS retention_days INTEGER;
+
+DO $$
+DECLARE
+    partition_start timestamptz;
+    column_list text;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('received_emails')) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE email_summaries DROP CONSTRAINT IF EXISTS email_summaries_received_email_id_fkey;
+    ALTER TABLE received_emails RENAME TO received_emails_unpartitioned;
+    -- Libera o nome do índice da chave primária para a tabela nova
+    ALTER INDEX IF EXISTS received_emails_pkey RENAME TO received_emails_unpartitioned_pkey;
+
+    -- Mesmas colunas da tabela atual (com defaults e colunas geradas, como search_vector),
+    -- seja ela criada pelo sql/DDL.sql antigo ou pelo create_all
+    CREATE TABLE received_emails (
+        LIKE received_emails_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED,
+        PRIMARY KEY (id, received_at),
+        CONSTRAINT received_emails_account_id_fkey FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (received_at);
+
+    CREATE TABLE received_emails_default PARTITION OF received_emails DEFAULT;
+    FOR partition_start IN
+        SELECT generate_series(
+            date_trunc('month', coalesce(min(received_at), now()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+            date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + interval '3 months',
+            interval '1 month'
+        ) FROM received_emails_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF received_emails FOR VALUES FROM (%L) TO (%L)',
+            'received_emails_p' || to_char(partition_start AT TIME ZONE 'UTC', 'YYYY_MM'),
+            partition_start, partition_start + interval '1 month'
+        );
+    END LOOP;
+
+    -- Copia todas as colunas, menos as geradas (recalculadas na tabela nova)
+    UPDATE received_emails_unpartitioned SET received_at = now() WHERE received_at IS NULL;
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO column_list
+    FROM pg_attribute
+    WHERE attrelid = 'received_emails_unpartitioned'::regclass
+      AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    EXECUTE format('INSERT INTO received_emails (%s) SELECT %s FROM received_emails_unpartitioned',
+                   column_list, column_list);
+
+    ALTER SEQUENCE received_emails_id_seq OWNED BY received_emails.id;
+    DROP TABLE received_emails_unpartitioned;
+END
+$$;
+
+-- Índices na tabela particionada (cada partição recebe o seu)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_received_emails_gmail_message ON received_emails(gmail_message_id, received_at);
+CREATE INDEX IF NOT EXISTS ix_received_emails_gmail_message_id ON received_emails(gmail_message_id);
+CREATE INDEX IF NOT EXISTS idx_received_emails_account_received ON received_emails(account_id, received_at, id);
+CREATE INDEX IF NOT EXISTS idx_received_emails_account_sender ON received_emails(account_id, sender, received_at, id);
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX IF NOT EXISTS idx_received_emails_search ON received_emails USING GIN (account_id, search_vector);
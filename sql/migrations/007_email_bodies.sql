@@ -0,0 +1,40 @@
+-- Migração 007: corpos de e-mail em email_bodies, endereçados pelo SHA-256 do texto e
+-- comprimidos (zlib); received_emails e outgoing_emails passam a guardar só body_hash.
+-- Este script cria a tabela e as colunas. A cópia dos corpos existentes precisa da
+-- compressão feita pela aplicação: rode `python -m app.migrate`, que aplica este script
+-- e depois copia os corpos em lotes, preenche body_hash e remove as colunas body.
+-- Idempotente.
+
+CREATE TABLE IF NOT EXISTS email_bodies (
+    content_hash VARCHAR(64) PRIMARY KEY,
+    data BYTEA NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE received_emails ADD COLUMN IF NOT EXISTS body_hash VARCHAR(64);
+ALTER TABLE outgoing_emails ADD COLUMN IF NOT EXISTS body_hash VARCHAR(64);
+
+DO $$
+BEGIN
+    -- A conversão da 006 (CREATE TABLE ... LIKE) não copia as FKs de uma tabela criada pelo create_all
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'received_emails_body_hash_fkey'
+                   AND conrelid = 'received_emails'::regclass) THEN
+        ALTER TABLE received_emails ADD CONSTRAINT received_emails_body_hash_fkey
+            FOREIGN KEY (body_hash) REFERENCES email_bodies(content_hash);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'outgoing_emails_body_hash_fkey'
+                   AND conrelid = 'outgoing_emails'::regclass) THEN
+        ALTER TABLE outgoing_emails ADD CONSTRAINT outgoing_emails_body_hash_fkey
+            FOREIGN KEY (body_hash) REFERENCES email_bodies(content_hash);
+    END IF;
+END
+$$;
+
+-- Usados ao apagar corpos sem referência (app/services/archiver.py)
+CREATE INDEX IF NOT EXISTS ix_received_emails_body_hash ON received_emails(body_hash);
+CREATE INDEX IF NOT EXISTS ix_outgoing_emails_body_hash ON outgoing_emails(body_hash);
+
+-- search_vector deixa de ser gerada a partir de body: os valores atuais são mantidos e
+-- os próximos são gravados pela aplicação (models.search_vector_expression)
+ALTER TABLE received_emails ALTER COLUMN search_vector DROP EXPRESSION IF EXISTS;
@@ -0,0 +1,13 @@
+-- Migração 008: registro das mensagens do Gmail que falharam no pipeline. O watermark
+-- (accounts.gmail_history_id) passa a avançar mesmo com falhas, e essas mensagens são
+-- tentadas de novo nas execuções seguintes, até GMAIL_MESSAGE_MAX_ATTEMPTS.
+-- Idempotente; aplique com: psql -v ON_ERROR_STOP=1 -f sql/migrations/008_gmail_message_attempts.sql
+
+CREATE TABLE IF NOT EXISTS gmail_message_attempts (
+    account_id INTEGER NOT NULL,
+    gmail_message_id VARCHAR(255) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    last_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account_id, gmail_message_id),
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+);